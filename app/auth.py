@@ -1,15 +1,65 @@
 # app/auth.py
-from passlib.hash import pbkdf2_sha256
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import jwt, JWTError
 from .config import settings
 
+# rounds из настроек; хэши с другими параметрами пересчитываются при следующем логине
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], pbkdf2_sha256__rounds=settings.PASSWORD_HASH_ROUNDS)
+
 def hash_password(password: str) -> str:
-    return pbkdf2_sha256.hash(password)
+    return pwd_context.hash(password)
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return pbkdf2_sha256.verify(password, password_hash)
+    return pwd_context.verify(password, password_hash)
+
+def verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+# ---- pbkdf2 вне event loop ----
+# hashlib.pbkdf2_hmac отпускает GIL, поэтому по умолчанию хватает потоков;
+# PASSWORD_HASH_EXECUTOR=process — отдельные процессы.
+
+class HashPoolBusy(Exception):
+    """Очередь на хэширование переполнена — отвечаем 429, а не копим задержку."""
+
+_executor: Optional[Executor] = None
+_pending = 0
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if settings.PASSWORD_HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="pbkdf2")
+    return _executor
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+        raise HashPoolBusy()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), partial(fn, *args))
+    finally:
+        _pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+async def verify_and_update_async(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return await _run(verify_and_update, password, password_hash)
+
+def shutdown_hasher() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
 
 def create_access_token(subject: str, expires_minutes: int | None = None) -> str:
     to_encode = {"sub": subject, "iat": int(datetime.utcnow().timestamp())}
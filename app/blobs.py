@@ -0,0 +1,59 @@
+# app/blobs.py
+"""
+Счётчики ссылок на файлы контентно-адресуемого LocalStorage (таблица stored_objects).
+
+Один sha256 — один файл на диске; refcount — сколько задач на него указывает
+(одинаковые ролики после скачивания, попадания кэша генераций). Коммит — на вызывающем.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import dialect_insert
+from .storage import LocalStorage, SavedFile
+
+log = logging.getLogger("storycraft.blobs")
+
+O = models.StoredObject
+
+async def add_ref(db: AsyncSession, saved: SavedFile, n: int = 1) -> None:
+    if saved.sha256 is None:
+        return
+    stmt = dialect_insert(db, O).values(sha256=saved.sha256, path=saved.path, size=saved.size, refcount=n)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[O.sha256],
+                                                set_={"refcount": O.refcount + n}))
+
+async def retain(db: AsyncSession, path: str) -> None:
+    """Ещё одна задача указывает на уже сохранённый файл."""
+    await db.execute(update(O).where(O.path == path).values(refcount=O.refcount + 1))
+
+async def migrate_legacy(db: AsyncSession, storage: LocalStorage, job_id: UUID, legacy: str) -> Optional[str]:
+    """
+    Плоский <root>/<job_id>.mp4 → objects/ab/cd/<sha>.mp4 при первом обращении. Возвращает новый путь
+    (коммит внутри — файл-исходник удаляется только после фиксации нового пути) или None, если файла нет.
+    Параллельные вызовы безопасны: ссылку добавляет только тот, чей UPDATE сменил file_path.
+    """
+    J = models.VideoJob
+    try:
+        saved = await asyncio.to_thread(storage.adopt, legacy)
+    except FileNotFoundError:
+        # уже перенесён параллельным запросом (или файла нет вовсе)
+        path = await db.scalar(select(J.file_path).where(J.id == job_id))
+        return path if path != legacy else None
+    res = await db.execute(update(J).where(J.id == job_id, J.file_path == legacy)
+                           .values(file_path=saved.path, updated_at=J.updated_at))
+    if res.rowcount:
+        await add_ref(db, saved)
+    await db.commit()
+    try:
+        await asyncio.to_thread(os.unlink, legacy)
+    except FileNotFoundError:
+        pass
+    log.info("Migrated %s -> %s", legacy, saved.path)
+    return saved.path
@@ -0,0 +1,59 @@
+# app/cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from . import metrics
+
+class TTLCache:
+    """
+    LRU на OrderedDict с TTL на каждую запись. Без блокировок — использовать только из event loop.
+    name — метка cache в cache_lookups_total{cache,result} и cache_entries{cache} (GET /metrics).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._size_changed()
+
+    def _size_changed(self) -> None:
+        if self.name:
+            metrics.CACHE_ENTRIES.set(len(self._data), cache=self.name)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self._data[key]
+                self._size_changed()
+            self.misses += 1
+            if self.name:
+                metrics.CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        if self.name:
+            metrics.CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        self._size_changed()
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._size_changed()
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._size_changed()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,28 +1,150 @@
 # app/config.py (фрагмент)
 from pydantic_settings import BaseSettings
-from pydantic import Field
+from pydantic import AliasChoices, Field
 from typing import Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str = Field(default="postgresql+asyncpg://postgres:postgres@db:5432/storycraft")
+    # Реплика для чтения списков/карточек; ?consistent=true у этих эндпоинтов читает с primary
+    DATABASE_READ_URL: Optional[str] = None
+
+    # Пул соединений SQLAlchemy (для обоих движков; у SQLite не применяется)
+    DB_POOL_SIZE: int = Field(default=5)
+    DB_MAX_OVERFLOW: int = Field(default=10)
+    DB_POOL_TIMEOUT: float = Field(default=30.0)          # сек ожидания соединения из пула
+    DB_POOL_RECYCLE: int = Field(default=1800)            # сек, старше — переоткрываем (-1 — никогда)
+    DB_POOL_PRE_PING: bool = Field(default=True)          # SELECT 1 на каждый checkout; false — полагаться на recycle
+    DB_STATEMENT_CACHE_SIZE: int = Field(default=100)     # подготовленных выражений на соединение (asyncpg), 0 — выкл.
+    # Старт: сверять ревизию схемы с app/migrations (не совпала — воркер не стартует); сами миграции — python -m app.migrate
+    DB_SCHEMA_CHECK: bool = Field(default=True)
     OPENAI_API_KEY: str = Field(default="")
+    OPENAI_BASE_URL: str = Field(default="https://api.openai.com/v1")
+
+    # Пул соединений к OpenAI (один клиент на процесс)
+    UPSTREAM_MAX_CONNECTIONS: int = Field(default=100)
+    UPSTREAM_MAX_KEEPALIVE: int = Field(default=20)
+    UPSTREAM_KEEPALIVE_EXPIRY: float = Field(default=30.0)
+    UPSTREAM_HTTP2: bool = Field(default=False)           # нужен пакет h2
+    UPSTREAM_CONNECT_TIMEOUT: float = Field(default=10.0)
+    UPSTREAM_READ_TIMEOUT: float = Field(default=120.0)
+    UPSTREAM_DOWNLOAD_TIMEOUT: float = Field(default=600.0)
     JWT_SECRET: str = Field(default="change-me")
     JWT_ALG: str = Field(default="HS256")
     JWT_EXPIRES_MINUTES: int = Field(default=7*24*60)
 
+    # Допуск к OpenAI (app/ratelimit.py): запросов/сек (0 — без лимита) и параллельность по типам вызовов
+    UPSTREAM_CREATE_RPS: float = Field(default=5.0)
+    UPSTREAM_CREATE_CONCURRENCY: int = Field(default=10)
+    UPSTREAM_STATUS_RPS: float = Field(default=20.0)
+    UPSTREAM_STATUS_CONCURRENCY: int = Field(default=20)
+    UPSTREAM_CONTENT_RPS: float = Field(default=5.0)
+    UPSTREAM_CONTENT_CONCURRENCY: int = Field(default=8)      # одновременных скачиваний
+    UPSTREAM_LIMIT_MAX_WAIT: float = Field(default=30.0)      # дольше ждать токен — 503 вместо очереди
+    UPSTREAM_RETRIES: int = Field(default=3)                  # POST повторяется только на 429 и ошибках соединения
+    UPSTREAM_BACKOFF_BASE: float = Field(default=0.5)
+    UPSTREAM_BACKOFF_MAX: float = Field(default=20.0)
+    UPSTREAM_BREAKER_THRESHOLD: int = Field(default=5)        # ошибок подряд (429/5xx/сеть) до размыкания
+    UPSTREAM_BREAKER_COOLDOWN: float = Field(default=30.0)    # сек в open до пробного запроса
+
+    # Кэш проверенных JWT и принципалов (id, is_admin) в процессе
+    AUTH_TOKEN_CACHE_SIZE: int = Field(default=10000)
+    AUTH_PRINCIPAL_CACHE_SIZE: int = Field(default=10000)
+    AUTH_PRINCIPAL_CACHE_TTL: float = Field(default=30.0)
+
+    # pbkdf2 для паролей: считается в отдельном пуле, при переполнении очереди — 429
+    PASSWORD_HASH_ROUNDS: int = Field(default=29000)
+    PASSWORD_HASH_EXECUTOR: str = Field(default="thread")   # thread | process
+    PASSWORD_HASH_WORKERS: int = Field(default=4)
+    PASSWORD_HASH_MAX_QUEUE: int = Field(default=64)
+
     WELCOME_CREDITS: int = Field(default=100)
     CREDITS_PER_SECOND: int = Field(default=20)
 
+    # Очередь отправки в OpenAI (app/scheduler.py): справедливый порядок между пользователями.
+    # SCHEDULER_IN_APP=false — диспетчер работает только в python -m app.poller
+    SCHEDULER_IN_APP: bool = Field(default=True)
+    SCHEDULER_INTERVAL: float = Field(default=1.0)          # сек между проходами, если не разбудили
+    SCHEDULER_BATCH_SIZE: int = Field(default=20)           # задач за проход (не больше SCHEDULER_SUBMIT_CONCURRENCY)
+    SCHEDULER_SCAN_SIZE: int = Field(default=200)           # сколько головы очереди смотрим за проход
+    SCHEDULER_LEASE_SECONDS: float = Field(default=900.0)   # аренда на отправку; больше худшего create_video (check_lease)
+    SCHEDULER_USER_INFLIGHT: int = Field(default=3)         # задач пользователя одновременно в OpenAI
+    SCHEDULER_PRIORITY_INFLIGHT: int = Field(default=10)    # то же для админов и платящих
+    SCHEDULER_PRIORITY_WEIGHT: float = Field(default=4.0)   # их доля пропускной способности относительно обычных
+    SCHEDULER_MAX_INFLIGHT: int = Field(default=0)          # всего задач в OpenAI, 0 — без лимита
+    # сколько задач из очереди отправляем в OpenAI одновременно (старое имя BATCH_SUBMIT_CONCURRENCY тоже читается)
+    SCHEDULER_SUBMIT_CONCURRENCY: int = Field(default=5, validation_alias=AliasChoices(
+        "SCHEDULER_SUBMIT_CONCURRENCY", "BATCH_SUBMIT_CONCURRENCY"))
+
     FRONTEND_ORIGINS: str = Field(default="*")
 
     STORAGE_BACKEND: str = Field(default="local")
     STORAGE_LOCAL_PATH: str = Field(default="./data/videos")
 
+    # GET /videos/{id}/file: app | x-accel (nginx) | x-sendfile
+    FILE_DELIVERY: str = Field(default="app")
+    X_ACCEL_PREFIX: str = Field(default="/protected/videos/")
+
     S3_BUCKET: Optional[str] = None
     S3_REGION: Optional[str] = None
     S3_ENDPOINT_URL: Optional[str] = None
     S3_ACCESS_KEY: Optional[str] = None
     S3_SECRET_KEY: Optional[str] = None
+    S3_ADDRESSING_STYLE: Optional[str] = None                # 'path' для MinIO / moto
+    S3_MAX_WORKERS: int = Field(default=8)                   # пул потоков под boto3
+    S3_MULTIPART_CONCURRENCY: int = Field(default=4)         # частей в полёте на одну загрузку
+    S3_PRESIGN_EXPIRES: int = Field(default=3600)
+    S3_PRESIGN_REFRESH_MARGIN: int = Field(default=300)      # переподписываем заранее
+    S3_PRESIGN_CACHE_SIZE: int = Field(default=10000)
+
+    # Потоковая загрузка видео: память на одну загрузку ограничена размером чанка/части
+    DOWNLOAD_CHUNK_SIZE: int = Field(default=1024 * 1024)
+    S3_MULTIPART_PART_SIZE: int = Field(default=8 * 1024 * 1024)   # S3 требует >= 5 MiB
+
+    # MP4 faststart при записи (app/mp4.py): moov перед mdat. Метаданные читаются и при выключенном
+    MP4_FASTSTART: bool = Field(default=True)
+    MP4_MAX_MOOV: int = Field(default=64 * 1024 * 1024)       # moov больше — файл пишется как есть
+    MP4_SPOOL_MEMORY: int = Field(default=16 * 1024 * 1024)   # сколько mdat держать в памяти, дальше — на диск
+
+    # Фоновый поллер статусов (app/poller.py). При POLLER_ENABLED /videos/{id}/pull — дешёвое чтение из БД.
+    # POLLER_IN_APP=false — поллер не стартует в API-процессе, запускать отдельно: python -m app.poller
+    POLLER_ENABLED: bool = Field(default=True)
+    POLLER_IN_APP: bool = Field(default=True)
+    POLLER_BATCH_SIZE: int = Field(default=50)
+    POLLER_CONCURRENCY: int = Field(default=10)
+    POLLER_IDLE_SLEEP: float = Field(default=2.0)
+    POLLER_LEASE_SECONDS: float = Field(default=900.0)      # должна покрывать скачивание ролика
+    POLLER_MIN_INTERVAL: float = Field(default=5.0)
+    POLLER_MAX_INTERVAL: float = Field(default=120.0)
+    POLLER_RENDER_FACTOR: float = Field(default=10.0)       # ожидаемый рендер ≈ seconds * factor, сек
+    # POST /videos/pull: сколько задач за запрос и сколько параллельных запросов в OpenAI
+    PULL_MAX_JOBS: int = Field(default=100)
+    PULL_CONCURRENCY: int = Field(default=8)
+
+    # Push статусов: GET /videos/events (SSE) и /videos/events/ws. На Postgres — через LISTEN/NOTIFY
+    EVENTS_ENABLED: bool = Field(default=True)
+    EVENTS_CHANNEL: str = Field(default="video_jobs")
+    EVENTS_MAX_CONNECTIONS: int = Field(default=1000)      # на один процесс uvicorn
+    EVENTS_MAX_PER_USER: int = Field(default=5)
+    EVENTS_QUEUE_SIZE: int = Field(default=100)            # событий в очереди на соединение
+    EVENTS_HEARTBEAT: float = Field(default=15.0)          # сек, keep-alive для прокси
+
+    # Кэш генераций: одинаковые (prompt+стиль, model, size, seconds) получают уже готовый файл
+    GENERATION_CACHE_ENABLED: bool = Field(default=False)
+    GENERATION_CACHE_MAX_AGE: int = Field(default=7 * 24 * 3600)   # сек, старше — генерируем заново
+    GENERATION_CACHE_MAX_HITS: int = Field(default=100)            # повторов на один исходный ролик
+    GENERATION_CACHE_CHARGE: bool = Field(default=True)            # списывать ли кредиты за попадание
+
+    # Idempotency-Key для POST /videos и /videos/batch
+    IDEMPOTENCY_TTL: int = Field(default=24 * 3600)          # сколько хранить ответ, сек
+    IDEMPOTENCY_LOCK_TIMEOUT: int = Field(default=300)       # после — владелец ключа считается упавшим
+    IDEMPOTENCY_WAIT: float = Field(default=30.0)            # сколько повтор ждёт первый запрос, потом 409
+    IDEMPOTENCY_POLL_INTERVAL: float = Field(default=0.25)
+    IDEMPOTENCY_PURGE_INTERVAL: float = Field(default=600.0) # чистка истёкших ключей в поллере
+
+    # GET /metrics (формат Prometheus). METRICS_TOKEN — если задан, нужен Authorization: Bearer <token>
+    METRICS_ENABLED: bool = Field(default=True)
+    METRICS_TOKEN: Optional[str] = None
+    METRICS_JOB_COUNTS_TTL: float = Field(default=30.0)    # сек, кэш GROUP BY по video_jobs
 
     # SSL-настройки для БД (теперь поддерживаем disable)
     DB_SSLMODE: Optional[str] = None          # 'disable' | 'require' | 'verify-ca' | 'verify-full'
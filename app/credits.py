@@ -0,0 +1,134 @@
+# app/credits.py
+"""
+Изменения баланса — только условными UPDATE в БД, без read-modify-write в Python.
+Параллельные запросы одного пользователя не могут увести credits в минус,
+а settle/refund одной траты срабатывают ровно один раз (выигрывает тот, кто перевёл pending).
+Каждая запись и смена статуса в ledger тут же отражается в credit_rollups (app/rollups.py).
+Коммит — на вызывающем.
+"""
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from sqlalchemy import insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, rollups
+
+users = models.User.__table__
+ledger = models.CreditTransaction.__table__
+
+async def reserve(db: AsyncSession, user_id: UUID, cost: int, ref: str) -> Optional[UUID]:
+    """
+    Списывает cost и пишет pending spend за один round-trip:
+        WITH reserved AS (UPDATE users SET credits = credits - :cost
+                          WHERE id = :id AND credits >= :cost RETURNING id)
+        INSERT INTO credit_transactions (...) SELECT ... FROM reserved RETURNING id
+    None — кредитов не хватило, ничего не изменено.
+    """
+    if db.bind.dialect.name != "postgresql":
+        # data-modifying CTE есть только в Postgres; иначе — два запроса в той же транзакции
+        ids = await reserve_many(db, user_id, [(cost, ref)])
+        return ids[0] if ids else None
+    reserved = (update(users)
+                .where(users.c.id == user_id, users.c.credits >= cost)
+                .values(credits=users.c.credits - cost)
+                .returning(users.c.id)
+                .cte("reserved"))
+    tx_id = uuid4()
+    stmt = (insert(ledger)
+            .from_select(["id", "user_id", "type", "amount", "ref", "status"],
+                         select(literal(tx_id, ledger.c.id.type), reserved.c.id,
+                                literal(models.TxType.spend, ledger.c.type.type), literal(-cost),
+                                literal(ref), literal(models.TxStatus.pending, ledger.c.status.type)))
+            .returning(ledger.c.id, ledger.c.created_at))
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        return None
+    await rollups.bump(db, user_id, [(row.created_at, models.TxType.spend, models.TxStatus.pending, 1, -cost)])
+    return row.id
+
+async def reserve_many(db: AsyncSession, user_id: UUID, items: Iterable[Tuple[int, str]]) -> Optional[List[UUID]]:
+    """
+    Резерв на батч [(cost, ref), ...]: одно условное списание суммы + pending spend на каждый элемент.
+    Возвращает id транзакций; None — кредитов не хватило.
+    """
+    items = list(items)
+    if not items:
+        return []
+    total = sum(cost for cost, _ in items)
+    res = await db.execute(update(users)
+                           .where(users.c.id == user_id, users.c.credits >= total)
+                           .values(credits=users.c.credits - total)
+                           .returning(users.c.id))
+    if res.first() is None:
+        return None
+    rows = [{"id": uuid4(), "user_id": user_id, "type": models.TxType.spend, "amount": -cost,
+             "ref": ref, "status": models.TxStatus.pending}
+            for cost, ref in items]
+    res = await db.execute(insert(ledger).values(rows).returning(ledger.c.created_at))
+    await rollups.bump(db, user_id, [(res.scalars().first(), models.TxType.spend, models.TxStatus.pending,
+                                      len(rows), -total)])
+    return [r["id"] for r in rows]
+
+async def balance(db: AsyncSession, user_id: UUID) -> int:
+    res = await db.execute(select(users.c.credits).where(users.c.id == user_id))
+    return res.scalar_one_or_none() or 0
+
+async def settle(db: AsyncSession, user_id: UUID, ref: str) -> bool:
+    """pending spend → settled. False — нечего закрывать (уже закрыто другим финализатором)."""
+    res = await db.execute(update(ledger)
+                           .where(ledger.c.user_id == user_id, ledger.c.ref == ref,
+                                  ledger.c.type == models.TxType.spend,
+                                  ledger.c.status == models.TxStatus.pending)
+                           .values(status=models.TxStatus.settled)
+                           .returning(ledger.c.amount, ledger.c.created_at))
+    rows = res.all()
+    await rollups.bump(db, user_id, [c for r in rows for c in rollups.moved(r.created_at, models.TxType.spend,
+                                                                            models.TxStatus.pending,
+                                                                            models.TxStatus.settled, r.amount)])
+    return bool(rows)
+
+async def _fail_pending(db: AsyncSession, user_id: UUID, ref: str) -> Optional[int]:
+    # pending spend → failed и вернуть кредиты; None — уже не pending (другой финализатор успел)
+    res = await db.execute(update(ledger)
+                           .where(ledger.c.user_id == user_id, ledger.c.ref == ref,
+                                  ledger.c.type == models.TxType.spend,
+                                  ledger.c.status == models.TxStatus.pending)
+                           .values(status=models.TxStatus.failed)
+                           .returning(ledger.c.amount, ledger.c.created_at))
+    row = res.one_or_none()
+    if row is None:
+        return None
+    await db.execute(update(users).where(users.c.id == user_id).values(credits=users.c.credits - row.amount))
+    await rollups.bump(db, user_id, rollups.moved(row.created_at, models.TxType.spend, models.TxStatus.pending,
+                                                  models.TxStatus.failed, row.amount))
+    return row.amount
+
+async def refund(db: AsyncSession, user_id: UUID, ref: str) -> bool:
+    """Задача упала в OpenAI: spend → failed, кредиты назад и settled refund в ledger. Срабатывает один раз."""
+    amount = await _fail_pending(db, user_id, ref)
+    if amount is None:
+        return False
+    res = await db.execute(insert(ledger).values(id=uuid4(), user_id=user_id, type=models.TxType.refund,
+                                                 amount=-amount, ref=ref, status=models.TxStatus.settled)
+                           .returning(ledger.c.created_at))
+    await rollups.bump(db, user_id, [(res.scalar_one(), models.TxType.refund, models.TxStatus.settled, 1, -amount)])
+    return True
+
+async def release(db: AsyncSession, user_id: UUID, ref: str) -> bool:
+    """OpenAI не принял задачу: spend → failed, кредиты назад, без refund-записи."""
+    return await _fail_pending(db, user_id, ref) is not None
+
+async def grant(db: AsyncSession, user_id: UUID, amount: int, ref: str,
+                tx_type: models.TxType = models.TxType.grant) -> Optional[UUID]:
+    """Начисление: атомарный += и settled-запись. None — пользователя нет."""
+    res = await db.execute(update(users).where(users.c.id == user_id)
+                           .values(credits=users.c.credits + amount).returning(users.c.id))
+    if res.first() is None:
+        return None
+    tx_id = uuid4()
+    res = await db.execute(insert(ledger).values(id=tx_id, user_id=user_id, type=tx_type, amount=amount,
+                                                 ref=ref, status=models.TxStatus.settled)
+                           .returning(ledger.c.created_at))
+    await rollups.bump(db, user_id, [(res.scalar_one(), tx_type, models.TxStatus.settled, 1, amount)])
+    return tx_id
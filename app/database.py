@@ -1,8 +1,12 @@
 # app/database.py
 import asyncio
 import ssl
+import time
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from . import metrics
 from .config import settings
 
 def _connect_args_from_env():
@@ -36,19 +40,74 @@ def _connect_args_from_env():
         args["ssl"] = ctx
     return args
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,
-    connect_args=_connect_args_from_env(),
-)
+class TimedPool(AsyncAdaptedQueuePool):
+    """QueuePool, который пишет в метрики время ожидания свободного соединения."""
+    role = "primary"
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.DB_POOL_WAIT.observe(time.perf_counter() - t0, role=self.role)
+
+class ReplicaTimedPool(TimedPool):
+    role = "replica"
+
+def _engine_args(url_str: str, poolclass) -> dict:
+    url = make_url(url_str)
+    args = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "connect_args": _connect_args_from_env()}
+    if url.get_backend_name() == "postgresql" and url.get_driver_name() == "asyncpg":
+        # кэш подготовленных выражений: на стороне SQLAlchemy и самого asyncpg (0 — для pgbouncer в transaction mode)
+        args["connect_args"].update(prepared_statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+                                    statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE)
+    # размеры и TimedPool — только для QueuePool (asyncpg); у aiosqlite по умолчанию NullPool/StaticPool
+    default = url.get_dialect(_is_async=True).get_pool_class(url)
+    if issubclass(default, QueuePool):
+        args.update(poolclass=poolclass, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW,
+                    pool_timeout=settings.DB_POOL_TIMEOUT, pool_recycle=settings.DB_POOL_RECYCLE)
+    return args
+
+engine = create_async_engine(settings.DATABASE_URL, echo=False, **_engine_args(settings.DATABASE_URL, TimedPool))
+# реплика только для чтения (GET /videos, /videos/{id}, /credits/transactions); без DATABASE_READ_URL — тот же primary
+read_engine = (create_async_engine(settings.DATABASE_READ_URL, echo=False,
+                                   **_engine_args(settings.DATABASE_READ_URL, ReplicaTimedPool))
+               if settings.DATABASE_READ_URL else engine)
+
+def _pool_gauges():
+    values = {}
+    for role, eng in (("primary", engine), ("replica", read_engine)):
+        pool = eng.pool
+        if (role == "replica" and eng is engine) or not isinstance(pool, QueuePool):
+            continue
+        values.update({(role, "size"): pool.size(), (role, "checked_out"): pool.checkedout(),
+                       (role, "overflow"): max(0, pool.overflow()), (role, "checked_in"): pool.checkedin()})
+    return values
+
+metrics.Gauge("db_pool_connections", "SQLAlchemy pool connections by state", ("role", "state"), fn=_pool_gauges)
 
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+
+def dialect_insert(db: AsyncSession, table):
+    """insert() с on_conflict_do_*: в Postgres и SQLite конструкторы разные."""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+async def connect_raw():
+    """Отдельное asyncpg-соединение мимо пула (LISTEN, миграции)."""
+    import asyncpg
+    url = make_url(settings.DATABASE_URL)
+    return await asyncpg.connect(user=url.username, password=url.password, host=url.host,
+                                 port=url.port, database=url.database, **_connect_args_from_env())
 
 class Base(DeclarativeBase):
     pass
 
 async def init_db():
-    from . import models  # noqa
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # схему создаёт и обновляет python -m app.migrate; на старте — только сверка ревизии
+    from .migrate import check
+    await check()
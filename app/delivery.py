@@ -0,0 +1,156 @@
+# app/delivery.py
+"""
+Отдача mp4 для GET /videos/{id}/file: Range/206, ETag/Last-Modified, If-None-Match/If-Range.
+
+FILE_DELIVERY:
+  app        — байты отдаёт сам воркер (sendfile, если ASGI-сервер умеет http.response.zerocopy)
+  x-accel    — только заголовок X-Accel-Redirect, файл отдаёт nginx (internal location)
+  x-sendfile — то же для Apache/lighttpd (X-Sendfile)
+"""
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from .config import settings
+
+CHUNK_SIZE = 256 * 1024
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    'bytes=a-b' / 'bytes=a-' / 'bytes=-n' → (start, end) включительно.
+    Несколько диапазонов и кривой синтаксис игнорируем (None → отдаём весь файл, RFC 9110 это разрешает).
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            n = int(last)
+            if n <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip() for t in inm.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _if_range_ok(request: Request, etag: str, mtime: float) -> bool:
+    value = request.headers.get("if-range")
+    if value is None:
+        return True
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag  # If-Range требует сильного сравнения
+    try:
+        return int(mtime) <= parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+class RangeFileResponse(Response):
+    """Отдаёт [start, end] файла; через sendfile, если сервер поддерживает zerocopy-расширение."""
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict, send_body: bool = True):
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        self.status_code = status_code
+        self.media_type = "video/mp4"
+        self.background = None
+        self.send_body = send_body
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopy", "file": f,
+                            "offset": self.start, "count": self.count, "more_body": False})
+            return
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            left = self.count
+            while left > 0:
+                chunk = await f.read(min(CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": left > 0})
+            if left > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def serve_file(request: Request, path: str, filename: str) -> Response:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(404, "File not available (yet)")
+
+    disposition = f"attachment; filename=\"{quote(filename)}\""
+    mode = settings.FILE_DELIVERY.lower()
+    if mode == "x-accel":
+        rel = os.path.relpath(path, settings.STORAGE_LOCAL_PATH).replace(os.sep, "/")
+        target = settings.X_ACCEL_PREFIX.rstrip("/") + "/" + quote(rel)
+        return Response(media_type="video/mp4",
+                        headers={"X-Accel-Redirect": target, "Content-Disposition": disposition})
+    if mode == "x-sendfile":
+        return Response(media_type="video/mp4",
+                        headers={"X-Sendfile": os.path.abspath(path), "Content-Disposition": disposition})
+
+    etag = file_etag(st)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": formatdate(st.st_mtime, usegmt=True),
+        "content-disposition": disposition,
+    }
+    if _not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = st.st_size
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and _if_range_ok(request, etag, st.st_mtime):
+        try:
+            rng = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+        if rng:
+            start, end = rng
+            status = 206
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+    headers["content-length"] = str(max(0, end - start + 1))
+    return RangeFileResponse(path, start, end, status, headers, send_body=request.method != "HEAD")
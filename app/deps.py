@@ -1,34 +1,116 @@
-from typing import AsyncGenerator
-from fastapi import Depends, HTTPException, status
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import AsyncGenerator, Optional
+from uuid import UUID
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from .database import SessionLocal
+from .cache import TTLCache
+from .config import settings
+from .database import ReadSessionLocal, SessionLocal, read_engine, engine
 from .auth import decode_token
 from .models import User
 
 security = HTTPBearer(auto_error=True)
+optional_security = HTTPBearer(auto_error=False)
+
+@dataclass(frozen=True)
+class Principal:
+    """Кто делает запрос — без баланса. Хватает эндпоинтам, которым не нужен свежий credits."""
+    id: UUID
+    is_admin: bool
+
+# sha256(token) -> user_id; запись живёт не дольше exp токена
+_tokens = TTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE, ttl=0, name="auth_token")
+# user_id -> Principal; короткий TTL + явная инвалидация (invalidate_principal)
+_principals = TTLCache(maxsize=settings.AUTH_PRINCIPAL_CACHE_SIZE, ttl=settings.AUTH_PRINCIPAL_CACHE_TTL,
+                       name="auth_principal")
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with SessionLocal() as session:
         yield session
 
+async def get_read_db(consistent: bool = Query(False, description="Читать с primary: видны только что сделанные изменения")
+                      ) -> AsyncGenerator[AsyncSession, None]:
+    """Сессия для чтения: реплика DATABASE_READ_URL (может отставать) или primary, если её нет / consistent=true."""
+    factory = SessionLocal if consistent or read_engine is engine else ReadSessionLocal
+    async with factory() as session:
+        yield session
+
+def _token_subject(token: str) -> UUID:
+    key = hashlib.sha256(token.encode()).digest()
+    user_id = _tokens.get(key)
+    if user_id is not None:
+        return user_id
+    payload = decode_token(token)
+    if not payload or "sub" not in payload:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    try:
+        user_id = UUID(str(payload["sub"]))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    ttl = float(payload["exp"]) - time.time() if payload.get("exp") else 0
+    if ttl > 0:
+        _tokens.set(key, user_id, ttl=ttl)
+    return user_id
+
+def invalidate_principal(user_id: UUID) -> None:
+    _principals.pop(user_id)
+
+def auth_cache_stats() -> dict:
+    return {
+        "token_cache": {"hits": _tokens.hits, "misses": _tokens.misses, "size": len(_tokens)},
+        "principal_cache": {"hits": _principals.hits, "misses": _principals.misses, "size": len(_principals)},
+    }
+
 async def get_current_user(
     creds: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db),
 ) -> User:
-    token = creds.credentials
-    payload = decode_token(token)
-    if not payload or "sub" not in payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    user_id = payload["sub"]
+    user_id = _token_subject(creds.credentials)
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
     if not user:
+        invalidate_principal(user_id)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    _principals.set(user_id, Principal(id=user.id, is_admin=user.is_admin))
     return user
 
-async def get_current_admin(user: User = Depends(get_current_user)) -> User:
-    if not user.is_admin:
+async def _load_principal(user_id: UUID, db: AsyncSession) -> Principal:
+    principal = _principals.get(user_id)
+    if principal is not None:
+        return principal
+    result = await db.execute(select(User.id, User.is_admin).where(User.id == user_id))
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    principal = Principal(id=row.id, is_admin=row.is_admin)
+    _principals.set(user_id, principal)
+    return principal
+
+async def get_current_principal(
+    creds: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db),
+) -> Principal:
+    return await _load_principal(_token_subject(creds.credentials), db)
+
+async def principal_from_token(token: Optional[str]) -> Principal:
+    """Для долгих соединений (SSE/WebSocket): своя короткая сессия, чтобы не держать её весь стрим."""
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    user_id = _token_subject(token)
+    async with SessionLocal() as db:
+        return await _load_principal(user_id, db)
+
+async def get_stream_principal(
+    creds: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    token: Optional[str] = Query(None, description="JWT для EventSource/WebSocket, где нельзя задать заголовок"),
+) -> Principal:
+    return await principal_from_token(creds.credentials if creds else token)
+
+async def get_current_admin(principal: Principal = Depends(get_current_principal)) -> Principal:
+    if not principal.is_admin:
         raise HTTPException(status_code=403, detail="Admin only")
-    return user
+    return principal
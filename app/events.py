@@ -0,0 +1,158 @@
+# app/events.py
+"""
+Push статусов задач клиентам (GET /videos/events, SSE и WebSocket).
+
+advance_job вызывает job_changed() при смене статуса. На Postgres событие уходит через
+pg_notify в той же транзакции: доставится только после commit, и его получат все
+воркеры/реплики (listen() держит отдельное соединение с LISTEN). На других БД —
+прямо в этот процесс после commit.
+
+Подписки живут в памяти воркера: очередь на соединение, не больше
+EVENTS_MAX_CONNECTIONS на процесс и EVENTS_MAX_PER_USER на пользователя.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .config import settings
+
+log = logging.getLogger("storycraft.events")
+
+# лимит payload у NOTIFY — 8000 байт
+_NOTIFY_MAX = 7900
+
+class TooManySubscribers(Exception):
+    pass
+
+_subs: Dict[UUID, Set[asyncio.Queue]] = {}
+_connections = 0
+_stats = {"published": 0, "delivered": 0, "dropped": 0, "notified": 0, "rejected": 0}
+
+def stats() -> dict:
+    return {"connections": _connections, "users": len(_subs), "listening": _listening, **_stats}
+
+def subscribe(user_id: UUID) -> asyncio.Queue:
+    """Новая очередь событий пользователя; освобождать через unsubscribe()."""
+    global _connections
+    if _connections >= settings.EVENTS_MAX_CONNECTIONS or len(_subs.get(user_id, ())) >= settings.EVENTS_MAX_PER_USER:
+        _stats["rejected"] += 1
+        raise TooManySubscribers()
+    q: asyncio.Queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+    _subs.setdefault(user_id, set()).add(q)
+    _connections += 1
+    return q
+
+def unsubscribe(user_id: UUID, q: asyncio.Queue) -> None:
+    # идемпотентно: вызывается и из генератора, и из background ответа
+    global _connections
+    queues = _subs.get(user_id)
+    if queues is None or q not in queues:
+        return
+    queues.discard(q)
+    _connections -= 1
+    if not queues:
+        del _subs[user_id]
+
+def _offer(q: asyncio.Queue, item: tuple) -> None:
+    if q.full():
+        # медленный клиент: выкидываем самое старое — свежий статус важнее истории
+        q.get_nowait()
+        _stats["dropped"] += 1
+    q.put_nowait(item)
+    _stats["delivered"] += 1
+
+def publish_local(user_id: UUID, kind: str, data: Optional[dict]) -> None:
+    for q in _subs.get(user_id, ()):
+        _offer(q, (kind, data))
+
+def broadcast_local(kind: str, data: Optional[dict] = None) -> None:
+    for queues in _subs.values():
+        for q in queues:
+            _offer(q, (kind, data))
+
+def job_payload(job: models.VideoJob) -> dict:
+    return schemas.VideoOut.model_validate(job).model_dump(mode="json")
+
+async def job_changed(db: AsyncSession, job: models.VideoJob) -> None:
+    """Поставить событие об изменении job; уйдёт подписчикам только после commit."""
+    if not settings.EVENTS_ENABLED:
+        return
+    data = job_payload(job)
+    _stats["published"] += 1
+    if db.bind.dialect.name == "postgresql":
+        msg = json.dumps({"u": str(job.user_id), "job": data}, separators=(",", ":"))
+        if len(msg.encode()) > _NOTIFY_MAX:
+            # prompt после создания не меняется — в дельте без него можно обойтись
+            data.pop("prompt", None)
+            msg = json.dumps({"u": str(job.user_id), "job": data}, separators=(",", ":"))
+        await db.execute(select(func.pg_notify(settings.EVENTS_CHANNEL, msg)))
+    else:
+        db.sync_session.info.setdefault("job_events", []).append((job.user_id, data))
+
+@event.listens_for(Session, "after_commit")
+def _flush_local(session: Session) -> None:
+    for user_id, data in session.info.pop("job_events", ()):
+        publish_local(user_id, "job", data)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_local(session: Session) -> None:
+    session.info.pop("job_events", None)
+
+# ---- LISTEN (только Postgres) ----
+_listening = False
+
+def _on_notify(conn, pid, channel, payload: str) -> None:
+    _stats["notified"] += 1
+    try:
+        msg = json.loads(payload)
+        user_id = UUID(msg["u"])
+    except (ValueError, KeyError, TypeError):
+        log.warning("Bad job event payload: %.200s", payload)
+        return
+    publish_local(user_id, "job", msg.get("job"))
+
+async def listen(stop: Optional[asyncio.Event] = None) -> None:
+    """Держит LISTEN-соединение и переподключается; после обрыва просит клиентов перечитать состояние."""
+    from .database import connect_raw
+
+    global _listening
+    stop = stop or asyncio.Event()
+    delay = 1.0
+    while not stop.is_set():
+        lost = asyncio.Event()
+        conn = None
+        try:
+            conn = await connect_raw()
+            conn.add_termination_listener(lambda c: lost.set())
+            await conn.add_listener(settings.EVENTS_CHANNEL, _on_notify)
+            if delay > 1.0:
+                broadcast_local("resync")  # пока не слушали, события могли потеряться
+            _listening, delay = True, 1.0
+            log.info("Listening for job events on %r", settings.EVENTS_CHANNEL)
+            waiters = [asyncio.create_task(lost.wait()), asyncio.create_task(stop.wait())]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for w in waiters:
+                    w.cancel()
+            if lost.is_set():
+                log.warning("Job events connection lost, reconnecting")
+        except Exception:
+            log.exception("Job events listener failed")
+        finally:
+            _listening = False
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        if not stop.is_set():
+            delay = min(delay * 2, 30.0)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,83 @@
+# app/gencache.py
+"""
+Кэш результатов генерации (GENERATION_CACHE_ENABLED, по умолчанию выключен).
+
+compose_prompt(style, prompt) + model + size + seconds полностью определяют запрос в OpenAI,
+их sha256 хранится в VideoJob.request_hash. Если есть завершённая задача с тем же хэшем
+и файлом, новая задача сразу создаётся completed и указывает на тот же файл — без вызова
+OpenAI и скачивания.
+
+Вытеснение по записи (источнику):
+  - не старше GENERATION_CACHE_MAX_AGE;
+  - не больше GENERATION_CACHE_MAX_HITS повторных использований (reuse_count);
+  - файл источника должен существовать (локальное хранилище).
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import blobs, models
+from .config import settings
+from .storage import LocalStorage, get_storage
+
+_stats = {"hits": 0, "misses": 0}
+# сколько самых свежих источников с тем же хэшем проверяем за один lookup
+LOOKUP_CANDIDATES = 5
+
+def stats() -> dict:
+    return {"enabled": settings.GENERATION_CACHE_ENABLED, **_stats}
+
+def request_hash(final_prompt: str, model: str, size: str, seconds: int) -> str:
+    key = json.dumps([final_prompt, model, size, seconds], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _usable(storage, file_path: str) -> bool:
+    if not isinstance(storage, LocalStorage):
+        return True
+    # плоские файлы до переноса в objects/ не делим: перенос трогает только свою задачу
+    return storage.is_content_addressed(file_path) and os.path.exists(file_path)
+
+async def lookup(db: AsyncSession, h: str):
+    """
+    Ищет источник и учитывает повторное использование (reuse_count += 1) — только у принятого:
+    кандидат без файла или с плоским файлом счётчик не расходует.
+    Возвращает строку (id, openai_id, file_path, file_url, duration, width, height, codec) или None.
+    Коммит — на вызывающем: при откате (например, не хватило кредитов) счётчик тоже откатится.
+    """
+    J = models.VideoJob
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.GENERATION_CACHE_MAX_AGE)
+    fresh = (J.request_hash == h, J.status == models.JobStatus.completed, J.file_path.isnot(None),
+             J.source_job_id.is_(None), J.created_at >= cutoff,
+             J.reuse_count < settings.GENERATION_CACHE_MAX_HITS)
+    storage = get_storage()
+    candidates = (await db.execute(select(J.id, J.file_path).where(*fresh)
+                                   .order_by(J.created_at.desc()).limit(LOOKUP_CANDIDATES))).all()
+    row = None
+    for job_id, file_path in candidates:
+        if not _usable(storage, file_path):
+            continue
+        # условия повторены в WHERE: параллельные попадания не превысят MAX_HITS
+        res = await db.execute(update(J).where(J.id == job_id, *fresh)
+                               .values(reuse_count=J.reuse_count + 1, updated_at=J.updated_at)
+                               .returning(J.id, J.openai_id, J.file_path, J.file_url,
+                                          J.duration, J.width, J.height, J.codec))
+        row = res.first()
+        if row is not None:
+            break
+    _stats["hits" if row is not None else "misses"] += 1
+    return row
+
+async def reuse(db: AsyncSession, job: models.VideoJob, src) -> None:
+    """Превращает новую задачу в готовую копию источника (+1 ссылка на файл)."""
+    job.status = models.JobStatus.completed
+    job.source_job_id = src.id
+    job.openai_id = src.openai_id
+    job.file_path = src.file_path
+    job.file_url = src.file_url
+    job.duration, job.width, job.height, job.codec = src.duration, src.width, src.height, src.codec
+    if isinstance(get_storage(), LocalStorage):
+        await blobs.retain(db, src.file_path)
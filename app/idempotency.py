@@ -0,0 +1,128 @@
+# app/idempotency.py
+"""
+Idempotency-Key для дорогих POST (создание генераций).
+
+Первый запрос с ключом вставляет строку (status_code NULL) и выполняется; его ответ
+сохраняется на IDEMPOTENCY_TTL. Повтор с тем же ключом и телом:
+  - первый ещё выполняется — ждём его (до IDEMPOTENCY_WAIT, потом 409);
+  - первый завершился — отдаём сохранённый ответ, OpenAI и кредиты не трогаем;
+  - первый упал — строка удалена, повтор выполняется заново.
+Тот же ключ с другим телом — 422.
+
+Учёт ведётся в отдельных коротких сессиях: транзакция эндпоинта его не касается.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+from uuid import UUID
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import and_, delete, or_, select, update
+
+from . import models
+from .config import settings
+from .database import SessionLocal, dialect_insert
+
+log = logging.getLogger("storycraft.idempotency")
+
+K = models.IdempotencyKey
+
+# (user_id, key) -> Event: повторы в этом же процессе просыпаются сразу, остальные — опросом
+_inflight: Dict[Tuple[UUID, str], asyncio.Event] = {}
+
+def request_hash(scope: str, payload: BaseModel) -> str:
+    body = json.dumps(payload.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{scope}\n{body}".encode()).hexdigest()
+
+async def _claim(user_id: UUID, key: str, h: str):
+    """True — ключ наш, выполняем; иначе строка (request_hash, status_code, response) или None."""
+    now = datetime.utcnow()
+    fresh = dict(request_hash=h, status_code=None, response=None,
+                 locked_until=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT),
+                 expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL))
+    async with SessionLocal() as db:
+        async with db.begin():
+            res = await db.execute(dialect_insert(db, K).values(user_id=user_id, key=key, **fresh)
+                                   .on_conflict_do_nothing(index_elements=[K.user_id, K.key]))
+            if res.rowcount == 1:
+                return True
+            # истёкший ключ или брошенный упавшим владельцем — забираем себе
+            res = await db.execute(update(K)
+                                   .where(K.user_id == user_id, K.key == key,
+                                          or_(K.expires_at <= now,
+                                              and_(K.status_code.is_(None), K.locked_until <= now,
+                                                   K.request_hash == h)))
+                                   .values(**fresh))
+            if res.rowcount == 1:
+                return True
+            res = await db.execute(select(K.request_hash, K.status_code, K.response)
+                                   .where(K.user_id == user_id, K.key == key))
+            return res.first()
+
+async def _finish(user_id: UUID, key: str, status_code: Optional[int] = None, body: Any = None) -> None:
+    try:
+        async with SessionLocal() as db:
+            async with db.begin():
+                if status_code is None:
+                    await db.execute(delete(K).where(K.user_id == user_id, K.key == key))
+                else:
+                    await db.execute(update(K).where(K.user_id == user_id, K.key == key)
+                                     .values(status_code=status_code,
+                                             response=json.dumps(body, separators=(",", ":"))))
+    finally:
+        ev = _inflight.pop((user_id, key), None)
+        if ev is not None:
+            ev.set()
+
+async def run(user_id: UUID, key: Optional[str], scope: str, payload: BaseModel,
+              response_model: Type[BaseModel], status_code: int,
+              handler: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполнить handler() не больше одного раза на (user_id, key); без ключа — просто выполнить."""
+    if not key:
+        return await handler()
+    h = request_hash(scope, payload)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.IDEMPOTENCY_WAIT
+    while True:
+        row = await _claim(user_id, key, h)
+        if row is True:
+            break
+        if row is not None:
+            if row.request_hash != h:
+                raise HTTPException(422, "Idempotency-Key was already used with a different request")
+            if row.status_code is not None:
+                return JSONResponse(json.loads(row.response), status_code=row.status_code,
+                                    headers={"Idempotent-Replayed": "true"})
+            if loop.time() >= deadline:
+                raise HTTPException(409, "A request with this Idempotency-Key is still in progress",
+                                    headers={"Retry-After": "5"})
+            # первый запрос ещё идёт — ждём его завершения
+            ev = _inflight.get((user_id, key))
+            try:
+                await asyncio.wait_for(ev.wait() if ev else asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL),
+                                       timeout=settings.IDEMPOTENCY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    _inflight[(user_id, key)] = asyncio.Event()
+    try:
+        result = await handler()
+    except BaseException:
+        # ошибки не кэшируем: повтор с тем же ключом выполнится заново
+        await asyncio.shield(_finish(user_id, key))
+        raise
+    body = jsonable_encoder(response_model.model_validate(result))
+    await _finish(user_id, key, status_code, body)
+    return result
+
+async def purge_expired() -> int:
+    async with SessionLocal() as db:
+        async with db.begin():
+            res = await db.execute(delete(K).where(K.expires_at <= datetime.utcnow()))
+    return res.rowcount or 0
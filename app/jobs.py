@@ -0,0 +1,157 @@
+# app/jobs.py
+"""
+Переходы состояний VideoJob по ответу OpenAI: processing / completed (+settle) / failed (+refund).
+Общий код для POST /videos/{id}/pull, POST /videos/pull (пачкой) и фонового поллера (app/poller.py).
+Смена статуса публикуется в app/events.py.
+
+Запросы в OpenAI и скачивание ролика идут без соединения с БД: advance_job работает по снимку
+задачи, а итог применяет короткой транзакцией. Переход — условный UPDATE по текущему status
+(TRANSITIONS), поэтому из нескольких параллельных финализаторов (pull, поллер, другая реплика)
+срабатывает ровно один, и settle/refund выполняются только им.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import blobs, credits, events, metrics, models, mp4
+from .config import settings
+from .database import SessionLocal
+from .openai_client import get_video as oa_get_video, stream_video_by_id as oa_stream_by_id
+from .ratelimit import UpstreamUnavailable
+from .storage import get_storage, LocalStorage, SavedFile
+
+log = logging.getLogger("storycraft.jobs")
+
+IN_PROGRESS = ("queued", "in_progress", "processing")
+ACTIVE = (models.JobStatus.queued, models.JobStatus.submitting, models.JobStatus.processing)
+# уже в OpenAI (openai_id задан), их опрашивает поллер; те же статусы, что в ix_video_jobs_poll
+POLLED = (models.JobStatus.queued, models.JobStatus.processing)
+
+# новый статус -> из каких можно в него перейти
+TRANSITIONS = {
+    # queued ⇄ submitting — отправка в OpenAI (app/scheduler.py)
+    models.JobStatus.submitting: (models.JobStatus.queued,),
+    models.JobStatus.queued: (models.JobStatus.submitting,),
+    models.JobStatus.processing: (models.JobStatus.queued,),
+    models.JobStatus.completed: ACTIVE,
+    models.JobStatus.failed: ACTIVE,
+}
+
+def upstream_status(info: dict) -> str:
+    return (info.get("status") or info.get("data", {}).get("status") or "").lower()
+
+async def transition(db: AsyncSession, job_id: UUID, to: models.JobStatus, *conditions,
+                     **values) -> Optional[models.VideoJob]:
+    """
+    UPDATE video_jobs SET status = :to ... WHERE id = :id AND status IN (допустимые) [AND conditions] RETURNING *.
+    None — задача уже не в исходном состоянии (её перевёл кто-то другой). Коммит — на вызывающем.
+    """
+    J = models.VideoJob
+    res = await db.execute(update(J)
+                           .where(J.id == job_id, J.status.in_(TRANSITIONS[to]), *conditions)
+                           .values(status=to, **values)
+                           .returning(J)
+                           .execution_options(populate_existing=True))
+    job = res.scalar_one_or_none()
+    if job is not None:
+        metrics.JOB_TRANSITIONS.inc(status=to.value)
+    return job
+
+Outcome = Tuple[models.JobStatus, Optional[SavedFile], dict]
+
+async def apply_outcome(db: AsyncSession, job_id: UUID, outcome: Outcome) -> Optional[models.VideoJob]:
+    """Переход + settle/refund + событие в транзакции db. Коммит — на вызывающем."""
+    to, saved, values = outcome
+    job = await transition(db, job_id, to, **values)
+    if job is None:
+        return None
+    if to == models.JobStatus.completed:
+        if saved is not None:
+            await blobs.add_ref(db, saved)   # только для контентно-адресуемого LocalStorage
+        # закрываем spend → settled
+        await credits.settle(db, job.user_id, str(job.id))
+    elif to == models.JobStatus.failed:
+        # spend → failed, кредиты назад (ровно один раз)
+        await credits.refund(db, job.user_id, str(job.id))
+    # подписчики /videos/events получат событие после commit
+    await events.job_changed(db, job)
+    return job
+
+async def check_upstream(job: models.VideoJob) -> Optional[Outcome]:
+    """
+    Часть шага без БД: спрашиваем OpenAI, при completed стримим файл в хранилище.
+    None — переходить некуда (задача уже processing и всё ещё рендерится).
+    """
+    info = await oa_get_video(job.openai_id)
+    status_str = upstream_status(info)
+    if status_str in IN_PROGRESS:
+        if job.status == models.JobStatus.processing:
+            return None
+        return models.JobStatus.processing, None, {}
+    if status_str == "completed":
+        # стримим /videos/{id}/content прямо в хранилище, не собирая mp4 в памяти;
+        # по пути moov переносится в начало, длительность/разрешение/кодек — в колонки задачи
+        storage = get_storage()
+        backend = "local" if isinstance(storage, LocalStorage) else "s3"
+        meta = mp4.VideoMeta()
+        stream = mp4.faststart(oa_stream_by_id(job.openai_id), meta, remux=settings.MP4_FASTSTART)
+        with metrics.STORAGE_DURATION.time(backend=backend):
+            saved = await storage.save_stream(str(job.id), stream, ext="mp4")
+        metrics.STORAGE_BYTES.inc(saved.size, backend=backend)
+        metrics.MP4_FASTSTART.inc(result="remuxed" if meta.remuxed else "unchanged")
+        file_url = None
+        if not isinstance(storage, LocalStorage):
+            # для S3 file_path — ключ объекта; свежая ссылка всегда доступна через /videos/{id}/url
+            file_url, _ = await storage.presigned_url(saved.path)
+        return models.JobStatus.completed, saved, {"file_path": saved.path, "file_url": file_url, **meta.columns()}
+    log.warning("Job %s failed upstream (status=%r)", job.id, status_str)
+    return models.JobStatus.failed, None, {}
+
+async def advance_job(job: models.VideoJob) -> Optional[models.VideoJob]:
+    """
+    Один шаг по снимку job (может быть из закрытой сессии): check_upstream без соединения с БД,
+    затем переход короткой транзакцией. Возвращает задачу после перехода;
+    None — статус не изменился или его уже применил другой финализатор.
+    """
+    outcome = await check_upstream(job)
+    if outcome is None:
+        return None
+    async with SessionLocal() as db:
+        updated = await apply_outcome(db, job.id, outcome)
+        await db.commit()
+        return updated
+
+async def advance_many(jobs: Sequence[models.VideoJob], concurrency: int) -> Dict[UUID, models.VideoJob]:
+    """
+    advance_job для пачки: OpenAI опрашивается параллельно (не больше concurrency), все переходы —
+    одной транзакцией. Ошибка по одной задаче её пропускает, остальные применяются.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def check(job: models.VideoJob) -> Optional[Outcome]:
+        async with sem:
+            try:
+                return await check_upstream(job)
+            except UpstreamUnavailable as e:
+                log.warning("Refresh skipped for job %s: %s", job.id, e)
+            except Exception:
+                log.exception("Refresh failed for job %s", job.id)
+            return None
+
+    outcomes = await asyncio.gather(*(check(j) for j in jobs))
+    # по пользователю: credit_rollups и ledger блокируются в одном порядке во всех транзакциях
+    todo = sorted(((j.user_id, j.id, o) for j, o in zip(jobs, outcomes) if o is not None), key=lambda t: t[:2])
+    if not todo:
+        return {}
+    updated: Dict[UUID, models.VideoJob] = {}
+    async with SessionLocal() as db:
+        for _, job_id, outcome in todo:
+            job = await apply_outcome(db, job_id, outcome)
+            if job is not None:
+                updated[job_id] = job
+        await db.commit()
+    return updated
@@ -1,47 +1,100 @@
 from __future__ import annotations
-import os, time, logging
-from uuid import UUID
-from typing import List
+import asyncio, json, os, time, logging
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from sqlalchemy import select, update
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
+from starlette.background import BackgroundTask
 
 from .config import settings
 from .logging_conf import setup_logging
-from .database import init_db
-from .deps import get_db, get_current_user, get_current_admin
-from . import models, schemas
-from .auth import hash_password, verify_password, create_access_token
-from .openai_client import (
-    create_video as oa_create_video,
-    get_video as oa_get_video,
-    download_video_by_id as oa_download_by_id,
-)
-from .storage import get_storage, LocalStorage
+from .database import init_db, engine, SessionLocal, ReadSessionLocal
+from .deps import (get_db, get_read_db, get_current_user, get_current_principal, get_current_admin,
+                   get_stream_principal, principal_from_token, invalidate_principal, auth_cache_stats, Principal)
+from . import (models, schemas, openai_client, poller, scheduler, delivery, credits, events, idempotency, gencache,
+               blobs, metrics, rollups)
+from .auth import HashPoolBusy, hash_password_async, verify_and_update_async, shutdown_hasher, create_access_token
+from .jobs import ACTIVE, advance_job, advance_many
+from .ratelimit import UpstreamUnavailable, check_available
+from .pagination import keyset, split_page
+from .serialize import FastJSONResponse, columns, fieldset, rows_to_dicts
+from .storage import get_storage, S3Storage
 from .styles import compose_prompt, format_to_size
 
 # ---- logging & app ----
 setup_logging(debug=getattr(settings, "DEBUG", True))
 logger = logging.getLogger("storycraft.api")
-app = FastAPI(title="StoryCraft AI Backend", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    os.makedirs(settings.STORAGE_LOCAL_PATH, exist_ok=True)
+    await init_db()
+    await openai_client.init_client()
+    poller_task = None
+    if settings.POLLER_ENABLED and settings.POLLER_IN_APP:
+        poller_task = asyncio.create_task(poller.run_forever())
+    scheduler_task = None
+    if settings.SCHEDULER_IN_APP:
+        scheduler.check_lease()
+        scheduler_task = asyncio.create_task(scheduler.run_forever())
+    events_task = None
+    if settings.EVENTS_ENABLED and engine.dialect.name == "postgresql":
+        events_task = asyncio.create_task(events.listen())
+    try:
+        yield
+    finally:
+        if events_task:
+            events_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await events_task
+        if scheduler_task:
+            # задачу с незавершённой отправкой (submitting) после аренды переведёт в failed reap_stuck()
+            scheduler_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await scheduler_task
+        if poller_task:
+            # недообработанные задачи подберёт другая реплика, когда истечёт аренда
+            poller_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await poller_task
+        await openai_client.close_client()
+        shutdown_hasher()
+
+app = FastAPI(title="StoryCraft AI Backend", version="0.1.0", lifespan=lifespan)
 
 @app.middleware("http")
 async def log_requests(request, call_next):
-    start = time.time()
+    start = time.perf_counter()
     try:
         response = await call_next(request)
-        logger.info("%s %s -> %s (%d ms)",
-                    request.method, request.url.path,
-                    getattr(response, "status_code", "?"),
-                    int((time.time() - start) * 1000))
-        return response
     except Exception:
         logger.exception("Unhandled error on %s %s", request.method, request.url.path)
-        return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+        response = JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+    elapsed = time.perf_counter() - start
+    # шаблон маршрута (/videos/{job_id}), а не сырой путь — иначе метка на каждый id
+    route = request.scope.get("route")
+    metrics.HTTP_DURATION.observe(elapsed, method=request.method,
+                                  route=route.path if route is not None else "<unmatched>",
+                                  status=response.status_code)
+    logger.info("%s %s -> %s (%d ms)", request.method, request.url.path, response.status_code, int(elapsed * 1000))
+    return response
+
+@app.exception_handler(HashPoolBusy)
+async def hash_pool_busy(request, exc):
+    return JSONResponse(status_code=429, content={"detail": "Too many concurrent auth requests, retry shortly"},
+                        headers={"Retry-After": "1"})
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request, exc: UpstreamUnavailable):
+    return JSONResponse(status_code=503, content={"detail": "Video provider is temporarily unavailable, retry later"},
+                        headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))})
 
 @app.exception_handler(Exception)
 async def unhandled_exc(request, exc):
@@ -56,17 +109,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # без этого браузер не отдаст фронтенду курсор /credits/transactions и признак повтора Idempotency-Key
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed", "Retry-After"],
 )
 
-@app.on_event("startup")
-async def on_startup():
-    os.makedirs(settings.STORAGE_LOCAL_PATH, exist_ok=True)
-    await init_db()
-
 @app.get("/health")
 async def health():
     return {"ok": True}
 
+# ---- metrics ----
+metrics.Gauge("event_stream_connections", "Open SSE/WebSocket job event streams in this worker",
+              fn=lambda: {(): events.stats()["connections"]})
+metrics.Gauge("generation_cache_lookups", "Generation cache lookups since start", ("result",),
+              fn=lambda: {("hit",): gencache.stats()["hits"], ("miss",): gencache.stats()["misses"]})
+_job_counts_at = 0.0
+
+async def _refresh_job_counts() -> None:
+    # GROUP BY по всей таблице — не чаще раза в METRICS_JOB_COUNTS_TTL, сколько бы раз ни скрейпили
+    global _job_counts_at
+    now = time.monotonic()
+    if now - _job_counts_at < settings.METRICS_JOB_COUNTS_TTL:
+        return
+    _job_counts_at = now
+    async with ReadSessionLocal() as db:
+        res = await db.execute(select(models.VideoJob.status, func.count()).group_by(models.VideoJob.status))
+        counts = dict(res.all())
+    for st in models.JobStatus:
+        metrics.JOB_STATES.set(counts.get(st, 0), status=st.value)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(404, "Not Found")
+    if settings.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(401, "Invalid metrics token")
+    try:
+        await _refresh_job_counts()
+    except Exception:
+        logger.exception("Job counts for /metrics failed")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --------- AUTH ---------
 @app.post("/auth/register", response_model=schemas.TokenOut, status_code=201)
 async def register(payload: schemas.RegisterIn, db: AsyncSession = Depends(get_db)):
@@ -74,16 +156,12 @@ async def register(payload: schemas.RegisterIn, db: AsyncSession = Depends(get_d
     if res.scalar_one_or_none():
         raise HTTPException(400, "Email already registered")
 
-    user = models.User(email=payload.email, password_hash=hash_password(payload.password),
-                       credits=settings.WELCOME_CREDITS)
+    user = models.User(email=payload.email, password_hash=await hash_password_async(payload.password), credits=0)
     db.add(user)
-    await db.flush()
-
-    tx = models.CreditTransaction(user_id=user.id, type=models.TxType.grant,
-                                  amount=settings.WELCOME_CREDITS, ref="welcome",
-                                  status=models.TxStatus.settled)
-    db.add(tx)
     try:
+        await db.flush()
+        # приветственные кредиты — обычным grant: ledger и credit_rollups в той же транзакции
+        await credits.grant(db, user.id, settings.WELCOME_CREDITS, ref="welcome")
         await db.commit()
     except IntegrityError:
         await db.rollback()
@@ -100,8 +178,15 @@ async def register(payload: schemas.RegisterIn, db: AsyncSession = Depends(get_d
 async def login(payload: schemas.LoginIn, db: AsyncSession = Depends(get_db)):
     res = await db.execute(select(models.User).where(models.User.email == payload.email))
     user = res.scalar_one_or_none()
-    if not user or not verify_password(payload.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    ok, new_hash = await verify_and_update_async(payload.password, user.password_hash)
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    if new_hash:
+        # параметры хэша поменялись — тихо пересчитываем
+        user.password_hash = new_hash
+        await db.commit()
     token = create_access_token(str(user.id))
     return {"access_token": token, "token_type": "bearer"}
 
@@ -110,30 +195,87 @@ async def me(user: models.User = Depends(get_current_user)):
     return user
 
 # --------- CREDITS ---------
+FieldsQuery = Query(None, description="Только эти поля, через запятую: id,status,created_at")
+
 @app.get("/credits/transactions", response_model=List[schemas.CreditTxOut])
-async def my_transactions(user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(models.CreditTransaction)
-                           .where(models.CreditTransaction.user_id == user.id)
-                           .order_by(models.CreditTransaction.created_at.desc()))
-    return res.scalars().all()
+async def my_transactions(limit: int = Query(50, ge=1, le=200), after: Optional[str] = None,
+                          type: Optional[List[models.TxType]] = Query(None),
+                          status: Optional[List[models.TxStatus]] = Query(None),
+                          fields: Optional[str] = FieldsQuery,
+                          user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_read_db)):
+    T = models.CreditTransaction
+    names = fieldset(schemas.CreditTxOut, fields)
+    # id и created_at — для курсора, даже если их не просили
+    stmt = select(*columns(T, ["id", "created_at", *names])).where(T.user_id == user.id)
+    if type:
+        stmt = stmt.where(T.type.in_(type))
+    if status:
+        stmt = stmt.where(T.status.in_(status))
+    res = await db.execute(keyset(stmt, T.created_at, T.id, after, limit))
+    rows, next_cursor = split_page(res.all(), limit)
+    # ответ — список (как раньше), курсор следующей страницы — в заголовке
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return FastJSONResponse(rows_to_dicts(rows, names), headers=headers)
+
+@app.get("/credits/summary", response_model=schemas.CreditSummaryOut)
+async def credits_summary(days: int = Query(30, ge=0, le=3660, description="Окно в днях; 0 — вся история"),
+                          daily: bool = False,
+                          user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_read_db)):
+    """Сводка по дневным итогам credit_rollups — без чтения истории транзакций."""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date() if days else None
+    rows = await rollups.summary(db, user.id, since)
+    totals = {}
+    for day, tx_type, tx_status, count, amount in rows:
+        cur = totals.setdefault((tx_type, tx_status), [0, 0])
+        cur[0] += count
+        cur[1] += amount
+    T, S = models.TxType, models.TxStatus
+
+    def total(t, s) -> int:
+        return totals.get((t, s), (0, 0))[1]
+
+    return {"balance": await credits.balance(db, user.id), "since": since,
+            "spent": -total(T.spend, S.settled), "reserved": -total(T.spend, S.pending),
+            "received": total(T.grant, S.settled) + total(T.purchase, S.settled),
+            "totals": [{"type": t, "status": s, "count": n, "amount": a}
+                       for (t, s), (n, a) in sorted(totals.items(), key=lambda kv: (kv[0][0].value, kv[0][1].value))
+                       if n or a],
+            "daily": [{"day": d, "type": t, "status": s, "count": n, "amount": a}
+                      for d, t, s, n, a in rows if n or a] if daily else []}
 
 @app.post("/credits/grant", response_model=schemas.CreditTxOut)
-async def grant_credits(payload: schemas.GrantIn, admin: models.User = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(models.User).where(models.User.id == payload.user_id))
-    u = res.scalar_one_or_none()
-    if not u:
+async def grant_credits(payload: schemas.GrantIn, admin: Principal = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
+    tx_id = await credits.grant(db, payload.user_id, payload.amount, ref="admin_grant")
+    if tx_id is None:
         raise HTTPException(404, "User not found")
-    u.credits += payload.amount
-    tx = models.CreditTransaction(user_id=u.id, type=models.TxType.grant, amount=payload.amount,
-                                  ref="admin_grant", status=models.TxStatus.settled)
-    db.add(tx)
     await db.commit()
-    await db.refresh(tx)
-    return tx
+    invalidate_principal(payload.user_id)
+    return await db.get(models.CreditTransaction, tx_id)
+
+@app.get("/admin/credits/reconcile", response_model=schemas.ReconcileOut)
+async def admin_reconcile(after: Optional[UUID] = None, limit: int = Query(1000, ge=1, le=10000),
+                          admin: Principal = Depends(get_current_admin)):
+    """Одна пачка сверки users.credits и credit_rollups с ledger; весь проход — python -m app.rollups."""
+    batch = await rollups.reconcile_batch(after, limit)
+    return {"checked": batch.checked, "next_after": batch.next_after,
+            "mismatches": [vars(m) for m in batch.mismatches]}
+
+@app.get("/admin/stats")
+async def admin_stats(admin: Principal = Depends(get_current_admin)):
+    return {"auth": auth_cache_stats(), "events": events.stats(), "generation_cache": gencache.stats(),
+            "scheduler": scheduler.stats()}
 
 # --------- VIDEOS ---------
+IdempotencyKeyHeader = Header(None, alias="Idempotency-Key", max_length=255,
+                              description="Повтор с тем же ключом вернёт первый ответ, без второй генерации")
+
 @app.post("/videos", response_model=schemas.VideoOut, status_code=201)
-async def create_video(payload: schemas.VideoCreateIn, user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def create_video(payload: schemas.VideoCreateIn, user: Principal = Depends(get_current_principal),
+                       db: AsyncSession = Depends(get_db), idempotency_key: Optional[str] = IdempotencyKeyHeader):
+    return await idempotency.run(user.id, idempotency_key, "POST /videos", payload, schemas.VideoOut, 201,
+                                 lambda: _create_video(payload, user, db))
+
+async def _create_video(payload: schemas.VideoCreateIn, user: Principal, db: AsyncSession) -> models.VideoJob:
     if payload.seconds not in (4, 8, 12):
         raise HTTPException(400, "Allowed seconds are 4, 8, or 12")
 
@@ -142,188 +284,325 @@ async def create_video(payload: schemas.VideoCreateIn, user: models.User = Depen
     final_prompt = compose_prompt(payload.style or "default", payload.prompt)
 
     cost = payload.seconds * settings.CREDITS_PER_SECOND
-    if user.credits < cost:
-        raise HTTPException(400, f"Not enough credits: need {cost}, have {user.credits}")
-
     uid = user.id
 
-    # резерв
-    spend_tx = models.CreditTransaction(user_id=uid, type=models.TxType.spend,
-                                        amount=-cost, ref="pending", status=models.TxStatus.pending)
-    db.add(spend_tx)
-    user.credits -= cost
+    # резерв: условный UPDATE users + pending spend одним запросом
+    model = payload.model or "sora-2"
+    job = models.VideoJob(id=uuid4(), user_id=uid, prompt=final_prompt, style=(payload.style or "default"),
+                          model=model, size=size, seconds=payload.seconds,
+                          cost_credits=cost, status=models.JobStatus.queued,
+                          request_hash=gencache.request_hash(final_prompt, model, size, payload.seconds))
+    if settings.GENERATION_CACHE_ENABLED and payload.reuse_cached:
+        src = await gencache.lookup(db, job.request_hash)
+        if src is not None:
+            await gencache.reuse(db, job, src)
+            if not settings.GENERATION_CACHE_CHARGE:
+                job.cost_credits = 0
+            elif await credits.reserve(db, uid, cost, ref=str(job.id)) is None:
+                have = await credits.balance(db, uid)
+                raise HTTPException(400, f"Not enough credits: need {cost}, have {have}")
+            else:
+                await credits.settle(db, uid, str(job.id))
+            db.add(job)
+            await db.commit()
+            await db.refresh(job)
+            return job
 
-    job = models.VideoJob(user_id=uid, prompt=final_prompt, style=(payload.style or "default"),
-                          model=payload.model or "sora-2", size=size, seconds=payload.seconds,
-                          cost_credits=cost, status=models.JobStatus.queued)
+    # OpenAI заведомо недоступен (breaker open) — 503 сразу, без резерва и транзакций
+    check_available()
+    if await credits.reserve(db, uid, cost, ref=str(job.id)) is None:
+        have = await credits.balance(db, uid)
+        raise HTTPException(400, f"Not enough credits: need {cost}, have {have}")
+    # в OpenAI задачу отправит диспетчер в порядке справедливой очереди; ошибка отправки — failed + возврат
+    await scheduler.enqueue(db, uid, user.is_admin, [job])
     db.add(job)
-    await db.flush()
-
-    try:
-        resp = await oa_create_video(final_prompt, model=payload.model or "sora-2")
-        openai_id = resp.get("id")
-        if not openai_id:
-            raise RuntimeError(f"OpenAI response missing id: {resp}")
-        job.openai_id = openai_id
-        spend_tx.ref = str(job.id)
-        await db.commit()
-    except Exception as e:
-        await db.rollback()
-        # вернуть кредиты в новой транзакции
-        async with db.begin():
-            await db.execute(update(models.User).where(models.User.id == uid)
-                             .values(credits=models.User.credits + cost))
-            db.add(models.CreditTransaction(user_id=uid, type=models.TxType.spend,
-                                            amount=-cost, ref="create_error",
-                                            status=models.TxStatus.failed))
-        raise HTTPException(502, detail=f"OpenAI error: {e}")
+    await db.commit()
+    scheduler.wake()
 
     await db.refresh(job)
+    await scheduler.annotate(db, [job])
     return job
 
+# колонки, по которым scheduler.queue_positions считает место в очереди
+_QUEUE_COLUMNS = ("id", "status", "openai_id", "source_job_id", "queue_tag")
+
 @app.get("/videos", response_model=schemas.VideoListOut)
-async def list_videos(user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(models.VideoJob).where(models.VideoJob.user_id == user.id)
-                           .order_by(models.VideoJob.created_at.desc()))
-    return {"items": res.scalars().all()}
+async def list_videos(limit: int = Query(50, ge=1, le=200), after: Optional[str] = None,
+                      status: Optional[List[models.JobStatus]] = Query(None),
+                      fields: Optional[str] = FieldsQuery,
+                      user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_read_db)):
+    J = models.VideoJob
+    names = fieldset(schemas.VideoOut, fields)
+    need = ["id", "created_at", *names]
+    if "queue_position" in names:
+        need += _QUEUE_COLUMNS
+    # только колонки ответа (без длинного prompt, если его не просили) и строки вместо ORM-объектов
+    stmt = select(*columns(J, need)).where(J.user_id == user.id)
+    if status:
+        stmt = stmt.where(J.status.in_(status))
+    res = await db.execute(keyset(stmt, J.created_at, J.id, after, limit))
+    rows, next_cursor = split_page(res.all(), limit)
+    extra = {"queue_position": await scheduler.queue_positions(db, rows)} if "queue_position" in names else None
+    return FastJSONResponse({"items": rows_to_dicts(rows, names, extra), "next_cursor": next_cursor})
+
+# ---- push статусов: SSE и WebSocket ----
+async def _events_subscribe(user_id: UUID):
+    """Подписка + текущее состояние активных задач (чтобы не потерять переходы до подключения)."""
+    if not settings.EVENTS_ENABLED:
+        raise HTTPException(404, "Events are disabled")
+    try:
+        q = events.subscribe(user_id)
+    except events.TooManySubscribers:
+        raise HTTPException(503, "Too many event streams", headers={"Retry-After": "5"})
+    try:
+        async with SessionLocal() as db:
+            res = await db.execute(select(models.VideoJob)
+                                   .where(models.VideoJob.user_id == user_id, models.VideoJob.status.in_(ACTIVE))
+                                   .order_by(models.VideoJob.created_at.desc()))
+            jobs = res.scalars().all()
+            await scheduler.annotate(db, jobs)
+            snapshot = [events.job_payload(j) for j in jobs]
+    except Exception:
+        events.unsubscribe(user_id, q)
+        raise
+    return q, snapshot
+
+def _sse(kind: str, data) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@app.get("/videos/events")
+async def video_events(user: Principal = Depends(get_stream_principal)):
+    """
+    SSE: `event: job` с VideoOut при каждой смене статуса, сначала — все активные задачи.
+    `event: resync` — события могли потеряться, перечитайте GET /videos.
+    EventSource не умеет заголовки — токен можно передать как ?token=.
+    """
+    q, snapshot = await _events_subscribe(user.id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            for data in snapshot:
+                yield _sse("job", data)
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(q.get(), timeout=settings.EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(kind, data)
+        finally:
+            events.unsubscribe(user.id, q)
+
+    # background — на случай, если клиент ушёл до первой итерации генератора
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(events.unsubscribe, user.id, q))
+
+@app.websocket("/videos/events/ws")
+async def video_events_ws(websocket: WebSocket, token: Optional[str] = None):
+    """Те же события, что и SSE: JSON {"event": ..., "data": ...}. Токен — ?token=."""
+    try:
+        user = await principal_from_token(token)
+        q, snapshot = await _events_subscribe(user.id)
+    except HTTPException as e:
+        await websocket.close(code=1013 if e.status_code == 503 else 1008)
+        return
+    try:
+        await websocket.accept()
+        for data in snapshot:
+            await websocket.send_json({"event": "job", "data": data})
+
+        async def pump():
+            while True:
+                kind, data = await q.get()
+                await websocket.send_json({"event": kind, "data": data})
+
+        sender = asyncio.create_task(pump())
+        try:
+            while True:
+                await websocket.receive_text()  # входящие игнорируем, ждём отключения
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            with suppress(asyncio.CancelledError, WebSocketDisconnect, RuntimeError):
+                await sender
+    finally:
+        events.unsubscribe(user.id, q)
 
 @app.get("/videos/{job_id}", response_model=schemas.VideoOut)
-async def get_video(job_id: UUID, user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def get_video(job_id: UUID, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_read_db)):
     res = await db.execute(select(models.VideoJob)
                            .where(models.VideoJob.id == job_id, models.VideoJob.user_id == user.id))
     job = res.scalar_one_or_none()
     if not job:
         raise HTTPException(404, "Video not found")
+    await scheduler.annotate(db, [job])
     return job
 
+@app.post("/videos/pull", response_model=schemas.VideoPullOut)
+async def pull_videos(payload: schemas.VideoPullIn, user: Principal = Depends(get_current_principal),
+                      db: AsyncSession = Depends(get_db)):
+    """Обновить галерею одним запросом: задачи по ids или group_id, опрос OpenAI параллельно, один commit."""
+    if (payload.ids is None) == (payload.group_id is None):
+        raise HTTPException(422, "Pass either ids or group_id")
+    if payload.ids is not None and len(payload.ids) > settings.PULL_MAX_JOBS:
+        raise HTTPException(422, f"At most {settings.PULL_MAX_JOBS} ids per request")
+    J = models.VideoJob
+    q = select(J).where(J.user_id == user.id)
+    if payload.ids is not None:
+        q = q.where(J.id.in_(payload.ids))
+    else:
+        q = q.where(J.group_id == payload.group_id).order_by(J.created_at, J.id).limit(settings.PULL_MAX_JOBS)
+    jobs = list((await db.execute(q)).scalars().all())
+    if payload.ids is not None:
+        by_id = {j.id: j for j in jobs}
+        jobs = [by_id[i] for i in dict.fromkeys(payload.ids) if i in by_id]
+
+    # как у одиночного pull: при поллере — только чтение из БД
+    stale = [] if settings.POLLER_ENABLED else [j for j in jobs if j.status in ACTIVE and j.openai_id]
+    if stale:
+        check_available()
+        # соединение не держим, пока ждём OpenAI
+        await db.commit()
+        updated = await advance_many(stale, settings.PULL_CONCURRENCY)
+        rest = [j.id for j in stale if j.id not in updated]
+        if rest:
+            # статус не изменился или задачи только что завершил поллер — перечитываем одним запросом
+            await db.execute(select(J).where(J.id.in_(rest)).execution_options(populate_existing=True))
+        jobs = [updated.get(j.id, j) for j in jobs]
+    await scheduler.annotate(db, jobs)
+    found = {j.id for j in jobs}
+    return {"items": jobs, "missing": [i for i in dict.fromkeys(payload.ids or []) if i not in found]}
+
 @app.post("/videos/{job_id}/pull", response_model=schemas.VideoOut)
-async def pull_video(job_id: UUID, user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def pull_video(job_id: UUID, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
     res = await db.execute(select(models.VideoJob)
                            .where(models.VideoJob.id == job_id, models.VideoJob.user_id == user.id))
     job = res.scalar_one_or_none()
     if not job:
         raise HTTPException(404, "Video not found")
-    if not job.openai_id:
-        raise HTTPException(400, "OpenAI id unknown for this job")
+    # статусы двигает фоновый поллер — здесь просто отдаём состояние из БД;
+    # завершённые (в т.ч. из кэша генераций) и ещё не отправленные тоже не трогаем
+    if settings.POLLER_ENABLED or job.status not in ACTIVE or not job.openai_id:
+        await scheduler.annotate(db, [job])
+        return job
 
+    # отпускаем соединение: запрос в OpenAI и скачивание идут без него, итог — своей короткой транзакцией
+    await db.commit()
     try:
-        info = await oa_get_video(job.openai_id)
-        status_str = (info.get("status") or info.get("data", {}).get("status") or "").lower()
-        if status_str in ("queued", "in_progress", "processing"):
-            job.status = models.JobStatus.processing
-            await db.commit()
-            await db.refresh(job)
-            return job
-        elif status_str == "completed":
-            # качаем байты из /videos/{id}/content
-            content = await oa_download_by_id(job.openai_id)
-
-            storage = get_storage()
-            if isinstance(storage, LocalStorage):
-                saved = storage.save_bytes(str(job.id), content, ext="mp4")
-                job.file_path = saved
-                job.file_url = None
-            else:
-                # для S3 save_bytes должен вернуть публичный/подписанный URL
-                job.file_url = get_storage().save_bytes(str(job.id), content, ext="mp4")
-
-            job.status = models.JobStatus.completed
-
-            # закрываем spend → settled
-            txq = await db.execute(select(models.CreditTransaction)
-                                   .where(models.CreditTransaction.user_id == user.id,
-                                          models.CreditTransaction.ref == str(job.id),
-                                          models.CreditTransaction.type == models.TxType.spend,
-                                          models.CreditTransaction.status == models.TxStatus.pending))
-            spend = txq.scalar_one_or_none()
-            if spend:
-                spend.status = models.TxStatus.settled
-
-            await db.commit()
-            await db.refresh(job)
-            return job
-        else:
-            # failed
-            job.status = models.JobStatus.failed
-            txq = await db.execute(select(models.CreditTransaction)
-                                   .where(models.CreditTransaction.user_id == user.id,
-                                          models.CreditTransaction.ref == str(job.id),
-                                          models.CreditTransaction.type == models.TxType.spend,
-                                          models.CreditTransaction.status == models.TxStatus.pending))
-            spend = txq.scalar_one_or_none()
-            if spend:
-                spend.status = models.TxStatus.failed
-                db.add(models.CreditTransaction(user_id=user.id, type=models.TxType.refund,
-                                                amount=job.cost_credits, ref=str(job.id),
-                                                status=models.TxStatus.settled))
-                # вернуть кредиты
-                res2 = await db.execute(select(models.User).where(models.User.id == user.id))
-                u2 = res2.scalar_one()
-                u2.credits += job.cost_credits
-            await db.commit()
-            await db.refresh(job)
-            return job
+        updated = await advance_job(job)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(502, f"OpenAI check/download error: {e}")
+    if updated is None:
+        # статус не изменился или задачу только что завершил поллер/параллельный pull
+        await db.refresh(job)
+        return job
+    return updated
 
 @app.post("/videos/batch", response_model=schemas.VideoBatchOut, status_code=201)
-async def create_videos_batch(payload: schemas.VideoBatchIn, user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def create_videos_batch(payload: schemas.VideoBatchIn, user: Principal = Depends(get_current_principal),
+                              db: AsyncSession = Depends(get_db), idempotency_key: Optional[str] = IdempotencyKeyHeader):
+    return await idempotency.run(user.id, idempotency_key, "POST /videos/batch", payload, schemas.VideoBatchOut, 201,
+                                 lambda: _create_videos_batch(payload, user, db))
+
+async def _create_videos_batch(payload: schemas.VideoBatchIn, user: Principal, db: AsyncSession) -> dict:
     if payload.seconds not in (4, 8, 12):
         raise HTTPException(400, "Allowed seconds are 4, 8, or 12")
 
     size = format_to_size(payload.format) if payload.format else "1280x720"
     styles = payload.styles or ["default", "80s", "bleach", "modern", "none"]
-    total_cost = len(styles) * payload.seconds * settings.CREDITS_PER_SECOND
-    if user.credits < total_cost:
-        raise HTTPException(400, f"Not enough credits for batch: need {total_cost}, have {user.credits}")
 
     uid = user.id
-    created: List[models.VideoJob] = []
+    cost = payload.seconds * settings.CREDITS_PER_SECOND
+    model = payload.model or "sora-2"
 
+    # резерв кредитов на весь батч — одной транзакцией
+    group_id = uuid4()
+    jobs = []
     for st in styles:
-        cost = payload.seconds * settings.CREDITS_PER_SECOND
-        spend_tx = models.CreditTransaction(user_id=uid, type=models.TxType.spend,
-                                            amount=-cost, ref="pending", status=models.TxStatus.pending)
-        db.add(spend_tx)
-        user.credits -= cost
-
         final_prompt = compose_prompt(st, payload.prompt)
-        job = models.VideoJob(user_id=uid, prompt=final_prompt, style=st,
-                              model=payload.model or "sora-2", size=size,
-                              seconds=payload.seconds, cost_credits=cost,
-                              status=models.JobStatus.queued)
-        db.add(job)
-        await db.flush()
-        try:
-            resp = await oa_create_video(final_prompt, model=payload.model or "sora-2")
-            openai_id = resp.get("id")
-            if not openai_id:
-                raise RuntimeError(f"OpenAI response missing id: {resp}")
-            job.openai_id = openai_id
-            spend_tx.ref = str(job.id)
-            await db.commit()
-            created.append(job)
-        except Exception as e:
-            await db.rollback()
-            async with db.begin():
-                await db.execute(update(models.User).where(models.User.id == uid)
-                                 .values(credits=models.User.credits + cost))
-                db.add(models.CreditTransaction(user_id=uid, type=models.TxType.spend,
-                                                amount=-cost, ref="create_error",
-                                                status=models.TxStatus.failed))
-            raise HTTPException(502, detail=f"OpenAI error: {e}")
-
-    for j in created:
-        await db.refresh(j)
-    return {"items": created}
-
-@app.get("/videos/{job_id}/file")
-async def download_file(job_id: UUID, user: models.User = Depends(get_current_user)):
+        jobs.append(models.VideoJob(id=uuid4(), user_id=uid, group_id=group_id, prompt=final_prompt, style=st,
+                                    model=model, size=size, seconds=payload.seconds, cost_credits=cost,
+                                    status=models.JobStatus.queued,
+                                    request_hash=gencache.request_hash(final_prompt, model, size, payload.seconds)))
+
+    # стили, уже сгенерированные кем-то с тем же запросом, берём из кэша — без OpenAI
+    if settings.GENERATION_CACHE_ENABLED and payload.reuse_cached:
+        for job in jobs:
+            src = await gencache.lookup(db, job.request_hash)
+            if src is not None:
+                await gencache.reuse(db, job, src)
+                if not settings.GENERATION_CACHE_CHARGE:
+                    job.cost_credits = 0
+    to_submit = [j for j in jobs if j.source_job_id is None]
+    if to_submit:
+        check_available()
+    charged = [j for j in jobs if j.cost_credits]
+    total_cost = sum(j.cost_credits for j in charged)
+
+    if await credits.reserve_many(db, uid, [(j.cost_credits, str(j.id)) for j in charged]) is None:
+        have = await credits.balance(db, uid)
+        raise HTTPException(400, f"Not enough credits for batch: need {total_cost}, have {have}")
+    for job in charged:
+        if job.source_job_id is not None:
+            await credits.settle(db, uid, str(job.id))
+    # остальное отправит диспетчер: батч встаёт в очередь пользователя, а не занимает OpenAI целиком
+    if to_submit:
+        await scheduler.enqueue(db, uid, user.is_admin, to_submit)
+    db.add_all(jobs)
+    await db.commit()
+    if to_submit:
+        scheduler.wake()
+
+    # created_at/updated_at — серверные дефолты: перечитываем весь батч одним запросом
+    res = await db.execute(select(models.VideoJob)
+                           .where(models.VideoJob.id.in_([j.id for j in jobs]))
+                           .execution_options(populate_existing=True))
+    by_id = {j.id: j for j in res.scalars().all()}
+    items = [by_id[j.id] for j in jobs]
+    await scheduler.annotate(db, items)
+    return {"group_id": group_id, "items": items}
+
+@app.api_route("/videos/{job_id}/file", methods=["GET", "HEAD"])
+async def download_file(job_id: UUID, request: Request, user: Principal = Depends(get_current_principal),
+                        db: AsyncSession = Depends(get_db)):
+    # только проверка владельца и путь — без загрузки всей строки и без сборки storage
+    res = await db.execute(select(models.VideoJob.file_path)
+                           .where(models.VideoJob.id == job_id, models.VideoJob.user_id == user.id))
+    row = res.first()
+    if row is None:
+        raise HTTPException(404, "Video not found")
     storage = get_storage()
-    if isinstance(storage, LocalStorage):
-        path = storage.get_path(str(job_id))
-        if not path.exists():
+    if isinstance(storage, S3Storage):
+        # S3: короткий редирект на свежую подпись вместо проксирования байтов
+        url, _ = await storage.presigned_url(row.file_path or storage.key_for(str(job_id)))
+        return RedirectResponse(url, status_code=307)
+    if not row.file_path:
+        raise HTTPException(404, "File not available (yet)")
+    path = row.file_path
+    if not storage.is_content_addressed(path):
+        # файл из старой плоской раскладки — переносим в objects/ при первом обращении
+        path = await blobs.migrate_legacy(db, storage, job_id, path)
+        if path is None:
             raise HTTPException(404, "File not available (yet)")
-        return FileResponse(path, media_type="video/mp4", filename=f"{job_id}.mp4")
-    else:
-        raise HTTPException(400, "For S3, use file_url returned in job")
+    return delivery.serve_file(request, path, filename=f"{job_id}.mp4")
+
+@app.get("/videos/{job_id}/url", response_model=schemas.VideoUrlOut)
+async def video_url(job_id: UUID, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    res = await db.execute(select(models.VideoJob.file_path, models.VideoJob.status)
+                           .where(models.VideoJob.id == job_id, models.VideoJob.user_id == user.id))
+    row = res.first()
+    if row is None:
+        raise HTTPException(404, "Video not found")
+    if row.status != models.JobStatus.completed:
+        raise HTTPException(404, "File not available (yet)")
+    storage = get_storage()
+    if isinstance(storage, S3Storage):
+        # старые строки хранили только file_url — ключ восстанавливаем по id
+        url, expires_at = await storage.presigned_url(row.file_path or storage.key_for(str(job_id)))
+        return {"url": url, "expires_at": expires_at}
+    return {"url": f"/videos/{job_id}/file", "expires_at": None}
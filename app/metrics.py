@@ -0,0 +1,163 @@
+# app/metrics.py
+"""
+Метрики в текстовом формате Prometheus для GET /metrics — без prometheus_client и внешних сервисов.
+
+Counter / Histogram / Gauge с метками; значения — в памяти процесса (при нескольких
+воркерах uvicorn Prometheus собирает каждый отдельно). Время — только time.perf_counter().
+Использовать из event loop; Histogram.observe дёшев (bisect + два сложения).
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: List["_Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, v in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, key)} {_num(v)}"
+
+class Gauge(_Metric):
+    """Значения ставятся set() или считаются при сборе: fn() -> {значения меток: число}."""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        values = self._fn() if self._fn else self._values
+        for key, v in values.items():
+            yield f"{self.name}{_labels(self.labelnames, key)} {_num(v)}"
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                le = 'le="%s"' % _num(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {acc}"
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+# ---- метрики приложения ----
+HTTP_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                          ("method", "route", "status"))
+UPSTREAM_DURATION = Histogram("upstream_request_duration_seconds", "OpenAI API call latency",
+                              ("op", "status"))
+DB_POOL_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a DB connection from the pool",
+                         ("role",), buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0))
+STORAGE_BYTES = Counter("storage_write_bytes_total", "Bytes written to video storage", ("backend",))
+STORAGE_DURATION = Histogram("storage_write_duration_seconds", "Time to stream one video into storage", ("backend",))
+MP4_FASTSTART = Counter("video_faststart_total", "Stored videos by MP4 layout handling (remuxed / unchanged)",
+                        ("result",))
+JOB_TRANSITIONS = Counter("video_job_transitions_total", "Job status transitions applied", ("status",))
+JOB_STATES = Gauge("video_jobs", "Jobs by status (refreshed at most every METRICS_JOB_COUNTS_TTL seconds)",
+                   ("status",))
+
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "OpenAI calls retried", ("op", "reason"))
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "OpenAI calls not sent (circuit open / limiter)",
+                            ("op", "reason"))
+LIMITER_WAIT = Histogram("upstream_limiter_wait_seconds", "Time spent waiting for a rate limiter token", ("op",))
+BREAKER_OPENED = Counter("upstream_circuit_opened_total", "Times the upstream circuit breaker opened")
+CACHE_LOOKUPS = Counter("cache_lookups_total", "In-process cache lookups (app/cache.py)", ("cache", "result"))
+CACHE_ENTRIES = Gauge("cache_entries", "Entries in in-process caches (app/cache.py)", ("cache",))
+SCHEDULER_WAIT = Histogram("scheduler_queue_wait_seconds", "Time a job waited in the submission queue",
+                           ("priority",), buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0))
+
+class _Call:
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = "error"   # не дошли до ответа — исключение/таймаут
+
+@contextmanager
+def upstream_call(op: str):
+    """with upstream_call("get_video") as call: ...; call.status = r.status_code"""
+    call = _Call()
+    t0 = time.perf_counter()
+    try:
+        yield call
+    finally:
+        UPSTREAM_DURATION.observe(time.perf_counter() - t0, op=op, status=call.status)
@@ -0,0 +1,147 @@
+# app/migrate.py
+"""
+Версионные миграции схемы: app/migrations/NNNN_*.sql применяются по порядку,
+каждый файл — в своей транзакции вместе с записью в schema_migrations.
+
+    python -m app.migrate            # применить недостающие (релизный шаг / docker compose)
+    python -m app.migrate --status   # что применено, что нет
+
+API при старте только сверяет последнюю ревизию в schema_migrations с кодом (check()) — без
+create_all и DDL на каждом воркере. Параллельные migrate сериализуются через pg_advisory_lock.
+Файлы идемпотентны (IF NOT EXISTS), поэтому их можно прогнать и на БД, куда часть
+изменений уже накатили вручную через psql.
+
+SQL в migrations/ — диалект Postgres. На других БД (SQLite в локальной разработке)
+схема создаётся из моделей, а ревизии просто помечаются применёнными.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import DBAPIError
+
+from .config import settings
+from .database import Base, connect_raw, engine
+from .logging_conf import setup_logging
+
+log = logging.getLogger("storycraft.migrate")
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# ключ pg_advisory_lock: один migrate на базу одновременно
+_LOCK_KEY = 7_310_531_001
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(255) PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT now()
+)
+"""
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+def available() -> List[str]:
+    return sorted(p.stem for p in MIGRATIONS_DIR.glob("*.sql"))
+
+def head() -> str:
+    return available()[-1]
+
+async def applied() -> List[str]:
+    from .models import SchemaMigration
+    try:
+        async with engine.connect() as conn:
+            return sorted((await conn.execute(select(SchemaMigration.version))).scalars())
+    except DBAPIError:
+        # таблицы ещё нет — база до первого migrate
+        return []
+
+async def _upgrade_models() -> List[str]:
+    from .models import SchemaMigration
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        done = set((await conn.execute(select(SchemaMigration.version))).scalars())
+        todo = [v for v in available() if v not in done]
+        if todo:
+            await conn.execute(insert(SchemaMigration), [{"version": v} for v in todo])
+    return todo
+
+async def upgrade() -> List[str]:
+    """Применить недостающие миграции; возвращает их имена."""
+    from . import models  # noqa: F401  — таблицы в Base.metadata
+    if engine.dialect.name != "postgresql":
+        return await _upgrade_models()
+    conn = await connect_raw()
+    try:
+        # lock держится до закрытия соединения; второй migrate дождётся и увидит всё применённым
+        await conn.execute("SELECT pg_advisory_lock($1)", _LOCK_KEY)
+        await conn.execute(_CREATE_TABLE)
+        done = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        todo = [v for v in available() if v not in done]
+        for version in todo:
+            sql = (MIGRATIONS_DIR / f"{version}.sql").read_text(encoding="utf-8")
+            t0 = time.perf_counter()
+            async with conn.transaction():
+                # без аргументов asyncpg идёт простым протоколом — можно несколько выражений
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+            log.info("Applied %s in %.2fs", version, time.perf_counter() - t0)
+        return todo
+    finally:
+        await conn.close()
+
+async def check() -> None:
+    """Старт воркера: один SELECT вместо create_all. Схема старее кода — SchemaOutdated."""
+    from .models import SchemaMigration
+    if engine.dialect.name != "postgresql":
+        await _upgrade_models()
+        return
+    if not settings.DB_SCHEMA_CHECK:
+        return
+    try:
+        async with engine.connect() as conn:
+            current: Optional[str] = (await conn.execute(select(func.max(SchemaMigration.version)))).scalar()
+    except DBAPIError:
+        current = None
+    expected = head()
+    if current is None or current < expected:
+        raise SchemaOutdated(f"Database schema is at {current or 'no revision'}, code expects {expected}: "
+                             f"run `python -m app.migrate`")
+    if current > expected:
+        # новая схема при старом коде — обычное дело во время выката, не падаем
+        log.warning("Database schema %s is newer than code (%s)", current, expected)
+
+async def _main(args) -> None:
+    retry_on = (OSError, asyncio.TimeoutError)
+    if engine.dialect.name == "postgresql":
+        import asyncpg
+        retry_on += (asyncpg.CannotConnectNowError,)
+    deadline = time.monotonic() + args.wait
+    while True:
+        try:
+            if args.status:
+                done = set(await applied())
+                for v in available():
+                    print(f"{'applied' if v in done else 'pending'}  {v}")
+                return
+            todo = await upgrade()
+            print(f"applied: {', '.join(todo)}" if todo else f"up to date ({head()})")
+            return
+        except retry_on as e:
+            # docker compose: Postgres ещё поднимается
+            if time.monotonic() >= deadline:
+                raise
+            log.warning("Database not reachable (%s), retrying", e)
+            await asyncio.sleep(1.0)
+        finally:
+            await engine.dispose()
+
+if __name__ == "__main__":
+    setup_logging(debug=False)
+    ap = argparse.ArgumentParser(description="Apply SQL migrations from app/migrations")
+    ap.add_argument("--status", action="store_true", help="показать применённые и недостающие")
+    ap.add_argument("--wait", type=float, default=30.0, help="сек ждать, пока БД станет доступна")
+    asyncio.run(_main(ap.parse_args()))
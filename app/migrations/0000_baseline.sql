@@ -0,0 +1,37 @@
+-- Исходная схема (до 0001): пользователи, ledger кредитов, задачи. На существующей БД ничего не меняет
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY,
+    email VARCHAR(255) NOT NULL UNIQUE,
+    password_hash VARCHAR(255) NOT NULL,
+    credits INTEGER NOT NULL,
+    is_admin BOOLEAN NOT NULL,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS credit_transactions (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    type VARCHAR(8) NOT NULL,
+    amount INTEGER NOT NULL,
+    ref VARCHAR(255),
+    status VARCHAR(7) NOT NULL DEFAULT 'settled',
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS video_jobs (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    prompt VARCHAR NOT NULL,
+    style VARCHAR(32),
+    group_id UUID,
+    model VARCHAR(50),
+    size VARCHAR(20),
+    seconds INTEGER,
+    openai_id VARCHAR(120),
+    status VARCHAR(10) NOT NULL DEFAULT 'queued',
+    cost_credits INTEGER,
+    file_path VARCHAR(512),
+    file_url VARCHAR(1024),
+    created_at TIMESTAMP DEFAULT now(),
+    updated_at TIMESTAMP DEFAULT now()
+);
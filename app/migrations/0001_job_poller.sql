@@ -0,0 +1,5 @@
+-- Фоновый поллер статусов: расписание опроса и аренда задач
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS next_poll_at TIMESTAMP;
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS poll_attempts INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS ix_video_jobs_poll ON video_jobs (next_poll_at)
+    WHERE status IN ('queued', 'processing');
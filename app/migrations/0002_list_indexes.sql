@@ -0,0 +1,5 @@
+-- Keyset-пагинация /videos и /credits/transactions, поиск spend-транзакции задачи
+CREATE INDEX IF NOT EXISTS ix_video_jobs_user_created ON video_jobs (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_video_jobs_user_status_created ON video_jobs (user_id, status, created_at);
+CREATE INDEX IF NOT EXISTS ix_credit_tx_user_created ON credit_transactions (user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_credit_tx_user_ref ON credit_transactions (user_id, ref, type, status);
@@ -0,0 +1,13 @@
+-- Idempotency-Key для POST /videos и /videos/batch
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created_at TIMESTAMP DEFAULT now(),
+    locked_until TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires ON idempotency_keys (expires_at);
@@ -0,0 +1,6 @@
+-- Кэш генераций: хэш запроса в OpenAI и ссылка на исходный ролик
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS request_hash VARCHAR(64);
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS source_job_id UUID;
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS reuse_count INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS ix_video_jobs_request_hash ON video_jobs (request_hash, created_at)
+    WHERE status = 'completed' AND source_job_id IS NULL;
@@ -0,0 +1,8 @@
+-- Контентно-адресуемое LocalStorage: один файл на sha256 и счётчик ссылок
+CREATE TABLE IF NOT EXISTS stored_objects (
+    sha256 VARCHAR(64) PRIMARY KEY,
+    path VARCHAR(512) NOT NULL UNIQUE,
+    size BIGINT NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT now()
+);
@@ -0,0 +1,5 @@
+-- Очередь отправки в OpenAI (app/scheduler.py): WFQ-тег и приоритет пользователя
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS queue_tag DOUBLE PRECISION;
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS ix_video_jobs_queue ON video_jobs (queue_tag)
+    WHERE status = 'queued' AND openai_id IS NULL;
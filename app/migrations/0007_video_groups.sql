@@ -0,0 +1,3 @@
+-- POST /videos/pull по group_id: задачи одного POST /videos/batch
+CREATE INDEX IF NOT EXISTS ix_video_jobs_user_group ON video_jobs (user_id, group_id)
+    WHERE group_id IS NOT NULL;
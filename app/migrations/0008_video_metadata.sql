@@ -0,0 +1,5 @@
+-- Метаданные ролика из moov (app/mp4.py): пишутся при сохранении файла
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS duration DOUBLE PRECISION;
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS width INTEGER;
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS height INTEGER;
+ALTER TABLE video_jobs ADD COLUMN IF NOT EXISTS codec VARCHAR(32);
@@ -0,0 +1,18 @@
+-- Дневные итоги ledger (app/rollups.py): GET /credits/summary без чтения истории
+CREATE TABLE IF NOT EXISTS credit_rollups (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    type VARCHAR(8) NOT NULL,
+    status VARCHAR(7) NOT NULL,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    amount BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, type, status)
+);
+
+-- начальное заполнение из истории; записи, сделанные старым кодом во время выката,
+-- досчитает python -m app.rollups --fix
+INSERT INTO credit_rollups (user_id, day, type, status, tx_count, amount)
+SELECT user_id, CAST(COALESCE(created_at, now()) AS DATE), type, status, count(*), sum(amount)
+FROM credit_transactions
+GROUP BY 1, 2, 3, 4
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,4 @@
+-- Статус submitting: задача забрана диспетчером, идёт POST в OpenAI (app/scheduler.py).
+-- status — VARCHAR(10), новое значение влезает; здесь только индекс для поиска зависших отправок
+CREATE INDEX IF NOT EXISTS ix_video_jobs_submitting ON video_jobs (next_poll_at)
+    WHERE status = 'submitting';
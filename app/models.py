@@ -2,13 +2,12 @@
 from __future__ import annotations
 import enum, uuid
 from sqlalchemy import (
-    Column, String, Integer, Boolean, DateTime, ForeignKey,
-    Enum as SAEnum, func
+    Column, String, Integer, BigInteger, Boolean, Date, DateTime, Float, ForeignKey, Index,
+    Enum as SAEnum, Text, func, text
 )
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
-from sqlalchemy.orm import declarative_base
 
-Base = declarative_base()
+from .database import Base
 
 # -------- Python enums ----------
 class TxType(str, enum.Enum):
@@ -24,6 +23,7 @@ class TxStatus(str, enum.Enum):
 
 class JobStatus(str, enum.Enum):
     queued = "queued"
+    submitting = "submitting"   # идёт POST в OpenAI (app/scheduler.py)
     processing = "processing"
     completed = "completed"
     failed = "failed"
@@ -49,6 +49,23 @@ class CreditTransaction(Base):
     status = Column(SAEnum(TxStatus, name="txstatus", native_enum=False), nullable=False, server_default="settled")
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        # /credits/transactions: keyset по (created_at, id) в пределах пользователя
+        Index("ix_credit_tx_user_created", "user_id", "created_at", "id"),
+        # поиск spend-транзакции задачи при settle/refund
+        Index("ix_credit_tx_user_ref", "user_id", "ref", "type", "status"),
+    )
+
+class CreditRollup(Base):
+    """Итоги ledger по (пользователь, день создания записи, type, status); ведёт app/rollups.py."""
+    __tablename__ = "credit_rollups"
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    type = Column(SAEnum(TxType, name="txtype", native_enum=False), primary_key=True)
+    status = Column(SAEnum(TxStatus, name="txstatus", native_enum=False), primary_key=True)
+    tx_count = Column(Integer, nullable=False, default=0, server_default="0")
+    amount = Column(BigInteger, nullable=False, default=0, server_default="0")
+
 class VideoJob(Base):
     __tablename__ = "video_jobs"
     id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -64,5 +81,74 @@ class VideoJob(Base):
     cost_credits = Column(Integer, default=0)
     file_path = Column(String(512))
     file_url = Column(String(1024))
+    # из moov при сохранении файла (app/mp4.py)
+    duration = Column(Float)
+    width = Column(Integer)
+    height = Column(Integer)
+    codec = Column(String(32))
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # фоновый поллер: когда опрашивать OpenAI в следующий раз (заодно — аренда задачи)
+    next_poll_at = Column(DateTime)
+    poll_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # кэш генераций (app/gencache.py): хэш запроса в OpenAI, источник файла и сколько раз его переиспользовали
+    request_hash = Column(String(64))
+    source_job_id = Column(PGUUID(as_uuid=True))
+    reuse_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # очередь отправки (app/scheduler.py): виртуальное время окончания WFQ и приоритет пользователя
+    queue_tag = Column(Float)
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # /videos: keyset по (created_at, id), опционально с фильтром по статусу
+        Index("ix_video_jobs_user_created", "user_id", "created_at", "id"),
+        Index("ix_video_jobs_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_video_jobs_poll", "next_poll_at",
+              postgresql_where=text("status IN ('queued', 'processing')")),
+        Index("ix_video_jobs_request_hash", "request_hash", "created_at",
+              postgresql_where=text("status = 'completed' AND source_job_id IS NULL")),
+        Index("ix_video_jobs_queue", "queue_tag",
+              postgresql_where=text("status = 'queued' AND openai_id IS NULL")),
+        # зависшие отправки: аренда в next_poll_at истекла
+        Index("ix_video_jobs_submitting", "next_poll_at",
+              postgresql_where=text("status = 'submitting'")),
+        # POST /videos/pull {"group_id": ...}
+        Index("ix_video_jobs_user_group", "user_id", "group_id",
+              postgresql_where=text("group_id IS NOT NULL")),
+    )
+    # не колонка: номер в очереди отправки, заполняет scheduler.annotate() перед ответом
+    queue_position = None
+    # updated_at (onupdate=now()) возвращается через RETURNING при flush, а не протухает:
+    # событие о смене статуса сериализует задачу внутри той же транзакции
+    __mapper_args__ = {"eager_defaults": True}
+
+class IdempotencyKey(Base):
+    """Idempotency-Key для POST /videos и /videos/batch: сохранённый ответ на (user_id, key)."""
+    __tablename__ = "idempotency_keys"
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)    # sha256 эндпоинта + тела запроса
+    status_code = Column(Integer)                       # NULL — первый запрос ещё выполняется
+    response = Column(Text)                             # JSON ответа
+    created_at = Column(DateTime, server_default=func.now())
+    locked_until = Column(DateTime, nullable=False)     # после — считаем владельца упавшим
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires", "expires_at"),
+    )
+
+class StoredObject(Base):
+    """Файл контентно-адресуемого LocalStorage и число задач, которые на него указывают."""
+    __tablename__ = "stored_objects"
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String(512), nullable=False, unique=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, server_default=func.now())
+
+class SchemaMigration(Base):
+    """Применённые файлы app/migrations (app/migrate.py)."""
+    __tablename__ = "schema_migrations"
+    version = Column(String(255), primary_key=True)
+    applied_at = Column(DateTime, server_default=func.now())
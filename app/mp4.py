@@ -0,0 +1,221 @@
+# app/mp4.py
+"""
+Потоковый faststart для MP4: moov переносится перед mdat прямо при записи ролика в хранилище,
+чтобы плеер начинал воспроизведение с первых байт /videos/{id}/file, не запрашивая хвост файла.
+
+faststart(chunks, meta) — обёртка над потоком байтов из OpenAI:
+  * moov уже перед mdat — байты идут насквозь, в памяти только сам moov (ради метаданных);
+  * moov после mdat — всё начиная с mdat пишется во временный файл (в памяти до MP4_SPOOL_MEMORY),
+    moov с поправленными смещениями stco/co64 отдаётся первым, за ним — содержимое временного файла;
+  * не MP4, moov не найден или смещения не влезают в 32-битный stco — файл отдаётся как есть.
+Попутно из moov заполняется meta: длительность (mvhd), разрешение и кодек видеодорожки (tkhd, stsd).
+"""
+import asyncio
+import logging
+import struct
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Iterator, Optional, Tuple
+
+from .config import settings
+
+log = logging.getLogger("storycraft.mp4")
+
+# типы боксов верхнего уровня, по которым узнаём MP4; остальное не трогаем
+TOP_LEVEL = {b"ftyp", b"styp", b"moov", b"mdat", b"free", b"skip", b"wide", b"uuid", b"pdin",
+             b"meta", b"moof", b"mfra", b"sidx"}
+# контейнеры на пути moov → trak → mdia → minf → stbl → stco/co64
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+@dataclass
+class VideoMeta:
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    codec: Optional[str] = None
+    remuxed: bool = False    # moov перенесён перед mdat
+
+    def columns(self) -> dict:
+        return {"duration": self.duration, "width": self.width, "height": self.height, "codec": self.codec}
+
+def iter_boxes(data, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """(тип, начало содержимого, конец бокса) для боксов в data[start:end]; обрезанный хвост пропускается."""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+def _find(data, start: int, end: int, *path: bytes) -> Optional[Tuple[int, int]]:
+    for kind, body, box_end in iter_boxes(data, start, end):
+        if kind == path[0]:
+            return (body, box_end) if len(path) == 1 else _find(data, body, box_end, *path[1:])
+    return None
+
+def read_meta(moov, meta: VideoMeta) -> None:
+    """Длительность, разрешение и кодек из moov (вместе с его заголовком)."""
+    top = _find(moov, 0, len(moov), b"moov")
+    if top is None:
+        return
+    mvhd = _find(moov, *top, b"mvhd")
+    if mvhd is not None:
+        body = mvhd[0]
+        if moov[body] == 1:
+            timescale, duration = struct.unpack_from(">IQ", moov, body + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", moov, body + 12)
+        if timescale:
+            meta.duration = round(duration / timescale, 3)
+    for kind, body, end in iter_boxes(moov, *top):
+        if kind != b"trak":
+            continue
+        hdlr = _find(moov, body, end, b"mdia", b"hdlr")
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        stsd = _find(moov, body, end, b"mdia", b"minf", b"stbl", b"stsd")
+        if stsd is not None and struct.unpack_from(">I", moov, stsd[0] + 4)[0]:
+            entry = stsd[0] + 8   # первая запись: size, format, ..., width/height (16 бит) по смещению 32
+            meta.codec = moov[entry + 4:entry + 8].decode("latin-1").strip("\0 ") or None
+            meta.width, meta.height = struct.unpack_from(">HH", moov, entry + 32)
+        tkhd = _find(moov, body, end, b"tkhd")
+        if tkhd is not None:
+            # ширина/высота в tkhd — отображаемый размер, 16.16 fixed point
+            at = tkhd[0] + (88 if moov[tkhd[0]] == 1 else 76)
+            width, height = struct.unpack_from(">II", moov, at)
+            if width and height:
+                meta.width, meta.height = width >> 16, height >> 16
+        return
+
+def shift_offsets(moov: bytearray, delta: int, lo: int, hi: int) -> bool:
+    """
+    +delta ко всем смещениям чанков в stco/co64, попадающим в [lo, hi) исходного файла.
+    False (moov не меняется) — новое смещение не влезает в 32-битный stco.
+    """
+    patches = []
+
+    def walk(start: int, end: int) -> bool:
+        for kind, body, box_end in iter_boxes(moov, start, end):
+            if kind in CONTAINERS:
+                if not walk(body, box_end):
+                    return False
+            elif kind in (b"stco", b"co64"):
+                count = struct.unpack_from(">I", moov, body + 4)[0]
+                fmt = f">{count}{'I' if kind == b'stco' else 'Q'}"
+                if body + 8 + struct.calcsize(fmt) > box_end:
+                    raise ValueError(f"truncated {kind!r}")
+                values = [v + delta if lo <= v < hi else v for v in struct.unpack_from(fmt, moov, body + 8)]
+                if kind == b"stco" and values and max(values) > 0xFFFFFFFF:
+                    return False
+                patches.append((fmt, body + 8, values))
+        return True
+
+    if not walk(0, len(moov)):
+        return False
+    for fmt, at, values in patches:
+        struct.pack_into(fmt, moov, at, *values)
+    return True
+
+async def faststart(chunks: AsyncIterable[bytes], meta: VideoMeta, remux: bool = True) -> AsyncIterator[bytes]:
+    """
+    Поток байтов MP4 с moov перед mdat. remux=False — порядок не меняется, только метаданные.
+    Память: moov (не больше MP4_MAX_MOOV) + MP4_SPOOL_MEMORY, остальное — во временном файле.
+    """
+    it = chunks.__aiter__()
+    buf = bytearray()
+    eof = False
+
+    async def fill(n: int) -> bool:
+        nonlocal eof
+        while len(buf) < n and not eof:
+            try:
+                buf.extend(await it.__anext__())
+            except StopAsyncIteration:
+                eof = True
+        return len(buf) >= n
+
+    pos = 0              # смещение buf[0] в исходном файле
+    mdat_at = None       # начало первого mdat, если moov после него
+    moov: Optional[bytearray] = None
+    moov_at = 0
+    spool = None
+    try:
+        while await fill(8):
+            size, kind = struct.unpack_from(">I4s", buf)
+            header = 8
+            if size == 1:
+                if not await fill(16):
+                    break
+                size = struct.unpack_from(">Q", buf, 8)[0]
+                header = 16
+            if kind not in TOP_LEVEL or (size and size < header):
+                break   # не MP4 или повреждён — остальное как есть
+            if kind == b"moov" and header <= size <= settings.MP4_MAX_MOOV:
+                if not await fill(size):
+                    break
+                moov, moov_at = bytearray(buf[:size]), pos
+                del buf[:size]
+                pos += size
+                break
+            if kind == b"mdat" and remux and spool is None:
+                mdat_at = pos
+                spool = tempfile.SpooledTemporaryFile(max_size=settings.MP4_SPOOL_MEMORY)
+            # бокс целиком, не собирая его в памяти: наружу или во временный файл
+            left = size or None   # 0 — до конца файла
+            while left is None or left > 0:
+                if not buf and not await fill(1):
+                    break
+                n = len(buf) if left is None else min(left, len(buf))
+                piece = bytes(buf[:n])
+                del buf[:n]
+                pos += n
+                if left is not None:
+                    left -= n
+                if spool is None:
+                    yield piece
+                else:
+                    await asyncio.to_thread(spool.write, piece)
+            if eof and not buf:
+                break
+
+        if moov is not None:
+            try:
+                read_meta(moov, meta)
+            except (struct.error, IndexError, ValueError) as e:
+                log.warning("Cannot read MP4 metadata: %s", e)
+            if spool is None:
+                yield bytes(moov)
+                moov = None
+            else:
+                try:
+                    moved = shift_offsets(moov, len(moov), mdat_at, moov_at)
+                except (struct.error, ValueError) as e:
+                    log.warning("Cannot patch MP4 chunk offsets: %s", e)
+                    moved = False
+                if moved:
+                    meta.remuxed = True
+                    yield bytes(moov)
+                    moov = None
+        if spool is not None:
+            await asyncio.to_thread(spool.seek, 0)
+            while piece := await asyncio.to_thread(spool.read, settings.DOWNLOAD_CHUNK_SIZE):
+                yield piece
+        if moov is not None:
+            # перенести не вышло — исходный порядок
+            yield bytes(moov)
+        if buf:
+            yield bytes(buf)
+        async for chunk in it:
+            yield chunk
+    finally:
+        if spool is not None:
+            spool.close()
@@ -1,40 +1,165 @@
+import asyncio
 import httpx
 import logging
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Optional
+from . import metrics, ratelimit
 from .config import settings
+from .metrics import upstream_call
 
 log = logging.getLogger("openai")
-BASE = "https://api.openai.com/v1"
+
+# Один долгоживущий клиент на процесс: keep-alive + пул соединений вместо
+# нового TCP/TLS рукопожатия на каждый запрос. Создаётся и закрывается в lifespan.
+_client: Optional[httpx.AsyncClient] = None
 
 def _headers():
     return {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
 
+def _build_client() -> httpx.AsyncClient:
+    http2 = settings.UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("UPSTREAM_HTTP2=true, but package 'h2' is not installed; falling back to HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        base_url=settings.OPENAI_BASE_URL,
+        headers=_headers(),
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.UPSTREAM_READ_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+    )
+
+async def init_client() -> None:
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_client() -> httpx.AsyncClient:
+    # вне lifespan (скрипты, отдельный воркер) — создаём лениво
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+RETRYABLE = {429, 500, 502, 503, 504}
+
+async def _send(op: str, limiter: ratelimit.Limiter, method: str, url: str, *, idempotent: bool,
+                held: bool = False, stream: bool = False, **kwargs) -> httpx.Response:
+    """
+    Запрос через лимитер и breaker с повторами (джиттер, Retry-After).
+    POST (idempotent=False) повторяется только на 429 и ConnectError — запрос точно не принят.
+    После исчерпания повторов возвращает последний ответ: raise_for_status — на вызывающем.
+    held — слот параллельности уже занят вызывающим (стриминг держит его до конца тела).
+    """
+    client = get_client()
+    attempt = 0
+    while True:
+        if held:
+            if attempt:
+                await limiter.token()  # первый токен взял вызывающий вместе со слотом
+        else:
+            await limiter.acquire()
+        retry_in: Optional[float] = None
+        try:
+            try:
+                ratelimit.breaker.before_call()
+            except ratelimit.UpstreamUnavailable as e:
+                metrics.UPSTREAM_REJECTED.inc(op=op, reason=e.reason)
+                raise
+            try:
+                with upstream_call(op) as call:
+                    r = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+                    call.status = r.status_code
+            except httpx.TransportError as e:
+                ratelimit.breaker.record(False)
+                if attempt >= settings.UPSTREAM_RETRIES or not (idempotent or isinstance(e, httpx.ConnectError)):
+                    raise
+                reason = type(e).__name__
+            except BaseException:
+                ratelimit.breaker.cancel_probe()
+                raise
+            else:
+                if r.status_code not in RETRYABLE:
+                    ratelimit.breaker.record(True)
+                    return r
+                ratelimit.breaker.record(False)
+                if r.status_code == 429:
+                    retry_in = ratelimit.parse_retry_after(r.headers.get("retry-after"))
+                    if retry_in is not None:
+                        limiter.bucket.pause(retry_in)  # следующий acquire подождёт за всех
+                if attempt >= settings.UPSTREAM_RETRIES or (r.status_code != 429 and not idempotent):
+                    return r
+                if stream:
+                    await r.aclose()
+                reason = str(r.status_code)
+        finally:
+            if not held:
+                limiter.release()
+        metrics.UPSTREAM_RETRIES.inc(op=op, reason=reason)
+        log.warning("OpenAI %s %s: %s, retry %d/%d", method, url, reason, attempt + 1, settings.UPSTREAM_RETRIES)
+        if retry_in is None:
+            await asyncio.sleep(ratelimit.backoff(attempt))
+        attempt += 1
+
 async def create_video(final_prompt: str, model: str = "sora-2") -> Dict[str, Any]:
     # ТОЛЬКО как curl -F: multipart/form-data с двумя полями
     files = {
         "model":  (None, model),
         "prompt": (None, final_prompt),
     }
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post(f"{BASE}/videos", headers=_headers(), files=files)
-        if r.status_code >= 400:
-            log.error("OpenAI /videos %s: %s", r.status_code, r.text)
-            r.raise_for_status()
-        return r.json()
+    r = await _send("create_video", ratelimit.limiters["create_video"], "POST", "/videos",
+                    idempotent=False, files=files)
+    if r.status_code >= 400:
+        log.error("OpenAI /videos %s: %s", r.status_code, r.text)
+        r.raise_for_status()
+    return r.json()
 
 async def get_video(openai_id: str) -> Dict[str, Any]:
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.get(f"{BASE}/videos/{openai_id}", headers=_headers())
-        if r.status_code >= 400:
-            log.error("OpenAI GET /videos/%s %s: %s", openai_id, r.status_code, r.text)
-            r.raise_for_status()
-        return r.json()
+    r = await _send("get_video", ratelimit.limiters["get_video"], "GET", f"/videos/{openai_id}", idempotent=True)
+    if r.status_code >= 400:
+        log.error("OpenAI GET /videos/%s %s: %s", openai_id, r.status_code, r.text)
+        r.raise_for_status()
+    return r.json()
 
 async def download_video_by_id(openai_id: str) -> bytes:
     """Качаем бинарник напрямую: /v1/videos/{id}/content"""
-    async with httpx.AsyncClient(timeout=None) as client:
-        r = await client.get(f"{BASE}/videos/{openai_id}/content", headers=_headers())
-        if r.status_code >= 400:
-            log.error("OpenAI GET /videos/%s/content %s: %s", openai_id, r.status_code, r.text)
-            r.raise_for_status()
-        return r.content
+    timeout = httpx.Timeout(settings.UPSTREAM_DOWNLOAD_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+    r = await _send("download_video", ratelimit.limiters["content"], "GET", f"/videos/{openai_id}/content",
+                    idempotent=True, timeout=timeout)
+    if r.status_code >= 400:
+        log.error("OpenAI GET /videos/%s/content %s: %s", openai_id, r.status_code, r.text)
+        r.raise_for_status()
+    return r.content
+
+async def stream_video_by_id(openai_id: str, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """То же, что download_video_by_id, но отдаёт тело чанками, не держа файл в памяти."""
+    timeout = httpx.Timeout(settings.UPSTREAM_DOWNLOAD_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+    limiter = ratelimit.limiters["content"]
+    # слот параллельности — на всё скачивание, а не только до заголовков
+    await limiter.acquire()
+    try:
+        r = await _send("stream_video", limiter, "GET", f"/videos/{openai_id}/content",
+                        idempotent=True, held=True, stream=True, timeout=timeout)
+        try:
+            if r.status_code >= 400:
+                await r.aread()
+                log.error("OpenAI GET /videos/%s/content %s: %s", openai_id, r.status_code, r.text)
+                r.raise_for_status()
+            async for chunk in r.aiter_bytes(chunk_size or settings.DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await r.aclose()
+    finally:
+        limiter.release()
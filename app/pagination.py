@@ -0,0 +1,47 @@
+# app/pagination.py
+"""Keyset-пагинация по (created_at desc, id desc): курсор — непрозрачная строка base64."""
+import base64
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import Select, func, literal, tuple_
+
+from .database import engine
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, _, row_id = raw.partition("|")
+        return datetime.fromisoformat(ts), UUID(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(400, "Invalid cursor")
+
+def _sortable(value):
+    # SQLite хранит DATETIME строкой: func.now() пишет «2024-01-01 12:00:00», а параметр
+    # SQLAlchemy — «2024-01-01 12:00:00.000000», и строки сравниваются неверно. Приводим обе стороны
+    # (и сортировку) к одному виду; в Postgres — как есть, по индексу
+    if engine.dialect.name == "sqlite":
+        return func.strftime("%Y-%m-%d %H:%M:%f", value)
+    return value
+
+def keyset(stmt: Select, created_col, id_col, after: Optional[str], limit: int) -> Select:
+    # берём limit + 1, чтобы понять, есть ли следующая страница
+    created = _sortable(created_col)
+    if after:
+        created_at, row_id = decode_cursor(after)
+        stmt = stmt.where(tuple_(created, id_col) < tuple_(_sortable(literal(created_at, created_col.type)),
+                                                           literal(row_id, id_col.type)))
+    return stmt.order_by(created.desc(), id_col.desc()).limit(limit + 1)
+
+def split_page(rows: Sequence, limit: int) -> Tuple[List, Optional[str]]:
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,135 @@
+# app/poller.py
+"""
+Фоновый опрос OpenAI по незавершённым задачам (queued/processing).
+
+Работает внутри приложения (POLLER_ENABLED + POLLER_IN_APP) или отдельным процессом:
+    python -m app.poller
+(отдельный процесс заодно отправляет задачи из очереди, см. app/scheduler.py).
+Реплики не обрабатывают одну задачу дважды: пачка забирается через
+SELECT ... FOR UPDATE SKIP LOCKED, и next_poll_at сдвигается на POLLER_LEASE_SECONDS
+(аренда). Если воркер упал, аренда истечёт и задачу подберёт другой.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import UUID
+
+from sqlalchemy import or_, select, update
+
+from . import idempotency, models, openai_client
+from .config import settings
+from .database import SessionLocal
+from .jobs import POLLED, advance_job
+from .logging_conf import setup_logging
+from .ratelimit import UpstreamUnavailable, breaker
+
+log = logging.getLogger("storycraft.poller")
+
+def poll_delay(seconds: Optional[int], age: float, attempts: int) -> float:
+    """
+    Пока ролик «должен ещё рендериться» (age < seconds * POLLER_RENDER_FACTOR) — опрашиваем редко,
+    примерно на середине оставшегося времени; дальше — экспоненциальный backoff по числу попыток.
+    """
+    expected = (seconds or 4) * settings.POLLER_RENDER_FACTOR
+    if age < expected:
+        delay = (expected - age) / 2
+    else:
+        delay = settings.POLLER_MIN_INTERVAL * (1.5 ** min(attempts, 20))
+    return max(settings.POLLER_MIN_INTERVAL, min(delay, settings.POLLER_MAX_INTERVAL))
+
+async def claim_batch(limit: int) -> List[UUID]:
+    J = models.VideoJob
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        async with db.begin():
+            res = await db.execute(select(J.id)
+                                   .where(J.status.in_(POLLED), J.openai_id.isnot(None),
+                                          or_(J.next_poll_at.is_(None), J.next_poll_at <= now))
+                                   .order_by(J.next_poll_at.asc().nulls_first())
+                                   .limit(limit)
+                                   .with_for_update(skip_locked=True))
+            ids = list(res.scalars().all())
+            if ids:
+                # updated_at=updated_at — аренда не должна менять «время изменения» задачи
+                await db.execute(update(J).where(J.id.in_(ids))
+                                 .values(next_poll_at=now + timedelta(seconds=settings.POLLER_LEASE_SECONDS),
+                                         updated_at=J.updated_at))
+    return ids
+
+async def process_job(job_id: UUID) -> None:
+    J = models.VideoJob
+    async with SessionLocal() as db:
+        job = await db.get(J, job_id)
+    # соединение уже в пуле: опрос и скачивание (минуты) идут без него
+    if not job or job.status not in POLLED:
+        return
+    try:
+        await advance_job(job)
+    except UpstreamUnavailable as e:
+        log.warning("Poll skipped for job %s: %s", job_id, e)
+    except Exception:
+        log.exception("Poll failed for job %s", job_id)
+
+    now = datetime.utcnow()
+    created_at = job.created_at or now
+    delay = poll_delay(job.seconds, (now - created_at).total_seconds(), job.poll_attempts or 0)
+    async with SessionLocal() as db:
+        await db.execute(update(J).where(J.id == job_id)
+                         .values(next_poll_at=now + timedelta(seconds=delay),
+                                 poll_attempts=J.poll_attempts + 1,
+                                 updated_at=J.updated_at))
+        await db.commit()
+
+async def poll_once() -> int:
+    if breaker.is_open():
+        # OpenAI недоступен — не берём аренду на задачи, которые всё равно не сможем опросить
+        return 0
+    ids = await claim_batch(settings.POLLER_BATCH_SIZE)
+    sem = asyncio.Semaphore(settings.POLLER_CONCURRENCY)
+
+    async def run(job_id: UUID):
+        async with sem:
+            await process_job(job_id)
+
+    await asyncio.gather(*(run(i) for i in ids))
+    return len(ids)
+
+async def run_forever(stop: Optional[asyncio.Event] = None) -> None:
+    stop = stop or asyncio.Event()
+    log.info("Job poller started")
+    loop = asyncio.get_running_loop()
+    next_purge = loop.time()
+    while not stop.is_set():
+        try:
+            n = await poll_once()
+        except Exception:
+            log.exception("Poller cycle failed")
+            n = 0
+        if loop.time() >= next_purge:
+            # заодно чистим истёкшие Idempotency-Key
+            next_purge = loop.time() + settings.IDEMPOTENCY_PURGE_INTERVAL
+            try:
+                await idempotency.purge_expired()
+            except Exception:
+                log.exception("Idempotency keys purge failed")
+        if n >= settings.POLLER_BATCH_SIZE:
+            continue  # есть ещё просроченные задачи — сразу следующая пачка
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.POLLER_IDLE_SLEEP)
+        except asyncio.TimeoutError:
+            pass
+    log.info("Job poller stopped")
+
+async def _main() -> None:
+    from . import scheduler
+    scheduler.check_lease()
+    await openai_client.init_client()
+    try:
+        await asyncio.gather(run_forever(), scheduler.run_forever())
+    finally:
+        await openai_client.close_client()
+
+if __name__ == "__main__":
+    setup_logging(debug=getattr(settings, "DEBUG", True))
+    asyncio.run(_main())
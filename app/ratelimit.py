@@ -0,0 +1,168 @@
+# app/ratelimit.py
+"""
+Допуск запросов к OpenAI: token bucket + лимит параллельности на каждый тип вызова,
+общий circuit breaker и повторы с джиттером, уважающие Retry-After.
+
+Используется только из app/openai_client.py. Ошибки:
+  UpstreamUnavailable — breaker открыт или очередь к лимитеру слишком длинная;
+  API отвечает 503 + Retry-After, кредиты не резервируются.
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from . import metrics
+from .config import settings
+
+class UpstreamUnavailable(Exception):
+    """Запрос к OpenAI не отправлен: breaker открыт или лимитер перегружен."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"upstream unavailable ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: секунды или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff(attempt: int) -> float:
+    # full jitter: равномерно в [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(settings.UPSTREAM_BACKOFF_MAX, settings.UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+class TokenBucket:
+    """
+    rate токенов/сек, ёмкость burst. Токен резервируется сразу (баланс может уйти в минус),
+    поэтому ожидающие идут по очереди без гонки за освободившийся токен.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, max_wait: float, op: str) -> None:
+        now = time.monotonic()
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+            wait = max(wait, -self.tokens / self.rate)
+        if wait > max_wait:
+            if self.rate > 0:
+                self.tokens += 1
+            raise UpstreamUnavailable("rate_limited", wait)
+        if wait > 0:
+            metrics.LIMITER_WAIT.observe(wait, op=op)
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Upstream прислал 429 + Retry-After: притормаживаем всех, а не только этот запрос."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class Limiter:
+    """Токены (запросов/сек) + семафор параллельности для одного типа вызова."""
+
+    def __init__(self, op: str, rate: float, concurrency: int):
+        self.op = op
+        self.bucket = TokenBucket(rate, burst=max(1.0, rate))
+        self.sem = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.inflight = 0
+
+    async def token(self) -> None:
+        await self.bucket.acquire(settings.UPSTREAM_LIMIT_MAX_WAIT, self.op)
+
+    async def acquire(self) -> None:
+        await self.token()
+        if self.sem is not None:
+            await self.sem.acquire()
+        self.inflight += 1
+
+    def release(self) -> None:
+        self.inflight -= 1
+        if self.sem is not None:
+            self.sem.release()
+
+class CircuitBreaker:
+    """
+    closed → (UPSTREAM_BREAKER_THRESHOLD ошибок подряд) → open → (UPSTREAM_BREAKER_COOLDOWN) →
+    half-open: пропускаем один пробный запрос; успех — closed, ошибка — снова open.
+    """
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def is_open(self) -> bool:
+        """Для проверок «до работы» (поллер, эндпоинты): не занимает пробный слот."""
+        return self.state == self.OPEN and self.retry_after() > 0
+
+    def before_call(self) -> None:
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                raise UpstreamUnavailable("circuit_open", self.retry_after())
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                raise UpstreamUnavailable("circuit_half_open", 1.0)
+            self.probing = True
+
+    def cancel_probe(self) -> None:
+        # пробный запрос не дошёл до ответа (отмена) — пустим следующий
+        self.probing = False
+
+    def record(self, ok: bool) -> None:
+        self.probing = False
+        if ok:
+            self.failures = 0
+            self.state = self.CLOSED
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                metrics.BREAKER_OPENED.inc()
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker(settings.UPSTREAM_BREAKER_THRESHOLD, settings.UPSTREAM_BREAKER_COOLDOWN)
+
+limiters: Dict[str, Limiter] = {
+    "create_video": Limiter("create_video", settings.UPSTREAM_CREATE_RPS, settings.UPSTREAM_CREATE_CONCURRENCY),
+    "get_video": Limiter("get_video", settings.UPSTREAM_STATUS_RPS, settings.UPSTREAM_STATUS_CONCURRENCY),
+    "content": Limiter("content", settings.UPSTREAM_CONTENT_RPS, settings.UPSTREAM_CONTENT_CONCURRENCY),
+}
+
+def check_available() -> None:
+    """Быстрый отказ до резерва кредитов/захвата задач, если OpenAI заведомо недоступен."""
+    if breaker.is_open():
+        raise UpstreamUnavailable("circuit_open", breaker.retry_after())
+
+metrics.Gauge("upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+              fn=lambda: {(): breaker.state})
+metrics.Gauge("upstream_inflight", "OpenAI requests in flight by limiter", ("op",),
+              fn=lambda: {(op,): lim.inflight for op, lim in limiters.items()})
@@ -0,0 +1,192 @@
+# app/rollups.py
+"""
+Дневные итоги ledger по пользователю (таблица credit_rollups): число записей и сумма amount
+по (день создания записи, type, status).
+
+Ведутся в той же транзакции, что и запись в credit_transactions (app/credits.py): новая запись —
++1 в свою корзину, смена статуса (pending → settled/failed) — перенос из старой корзины в новую
+того же дня. GET /credits/summary читает только их: число строк зависит от окна в днях,
+а не от длины истории.
+
+Сверка (reconcile): пачками пользователей по id сравнивает users.credits с балансом по ledger
+и итоги в credit_rollups с агрегатом по ledger. Баланс по ledger:
+    sum(amount) по записям со status != failed и type != refund
+(упавший spend уже не списан, а refund-запись только фиксирует возврат).
+
+    python -m app.rollups            # сверить всё, код выхода 1 — есть расхождения
+    python -m app.rollups --fix      # пересчитать credit_rollups разошедшимся пользователям
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import Date, cast, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import SessionLocal, dialect_insert, engine, read_engine
+from .logging_conf import setup_logging
+
+log = logging.getLogger("storycraft.rollups")
+
+R = models.CreditRollup
+L = models.CreditTransaction
+U = models.User
+
+# (время/день записи, type, status, Δчисло, Δсумма)
+Change = Tuple[Optional[datetime], models.TxType, models.TxStatus, int, int]
+
+def _day(ts) -> date:
+    if ts is None:
+        return datetime.utcnow().date()
+    return ts.date() if isinstance(ts, datetime) else ts
+
+def moved(ts: Optional[datetime], tx_type: models.TxType, src: models.TxStatus, dst: models.TxStatus,
+          amount: int, count: int = 1) -> List[Change]:
+    """Смена статуса записи: из корзины src в dst того же дня."""
+    return [(ts, tx_type, src, -count, -amount), (ts, tx_type, dst, count, amount)]
+
+async def bump(db: AsyncSession, user_id: UUID, changes: Iterable[Change]) -> None:
+    """
+    Применить изменения одним upsert на корзину. Корзины — в порядке ключа, чтобы параллельные
+    транзакции одного пользователя брали блокировки строк в одном порядке. Коммит — на вызывающем.
+    """
+    acc: Dict[Tuple[date, models.TxType, models.TxStatus], List[int]] = {}
+    for ts, tx_type, status, count, amount in changes:
+        cur = acc.setdefault((_day(ts), tx_type, status), [0, 0])
+        cur[0] += count
+        cur[1] += amount
+    for (day, tx_type, status), (count, amount) in sorted(acc.items(), key=lambda kv: (kv[0][0], kv[0][1].value,
+                                                                                       kv[0][2].value)):
+        if not count and not amount:
+            continue
+        stmt = dialect_insert(db, R).values(user_id=user_id, day=day, type=tx_type, status=status,
+                                            tx_count=count, amount=amount)
+        await db.execute(stmt.on_conflict_do_update(index_elements=[R.user_id, R.day, R.type, R.status],
+                                                    set_={"tx_count": R.tx_count + count,
+                                                          "amount": R.amount + amount}))
+
+async def summary(db: AsyncSession, user_id: UUID, since: Optional[date] = None) -> List[Tuple]:
+    """(day, type, status, tx_count, amount) пользователя начиная с since, по возрастанию дня."""
+    stmt = select(R.day, R.type, R.status, R.tx_count, R.amount).where(R.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(R.day >= since)
+    return (await db.execute(stmt.order_by(R.day, R.type, R.status))).all()
+
+# ---- сверка ----
+
+def ledger_balance(buckets: Dict[Tuple[models.TxType, models.TxStatus], Tuple[int, int]]) -> int:
+    return sum(amount for (tx_type, status), (_, amount) in buckets.items()
+               if status != models.TxStatus.failed and tx_type != models.TxType.refund)
+
+@dataclass
+class Mismatch:
+    user_id: UUID
+    credits: int
+    ledger: int              # баланс по ledger
+    rollups_match: bool      # итоги credit_rollups совпадают с ledger
+
+@dataclass
+class Batch:
+    checked: int = 0
+    mismatches: List[Mismatch] = field(default_factory=list)
+    next_after: Optional[UUID] = None   # None — пользователи кончились
+
+def _buckets(rows) -> Dict[UUID, Dict[Tuple, Tuple[int, int]]]:
+    out: Dict[UUID, Dict[Tuple, Tuple[int, int]]] = {}
+    for user_id, tx_type, status, count, amount in rows:
+        if count or amount:
+            out.setdefault(user_id, {})[(tx_type, status)] = (int(count), int(amount or 0))
+    return out
+
+async def reconcile_batch(after: Optional[UUID] = None, limit: int = 1000) -> Batch:
+    """
+    Одна пачка сверки: пользователи с id > after. Читает с реплики (если настроена) одним снимком —
+    users, ledger и rollups пишутся в одной транзакции, так что гонки с записью не дают ложных расхождений.
+    """
+    async with read_engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            stmt = select(U.id, U.credits).order_by(U.id).limit(limit)
+            if after is not None:
+                stmt = stmt.where(U.id > after)
+            users = (await conn.execute(stmt)).all()
+            if not users:
+                return Batch()
+            ids = [u.id for u in users]
+            ledger = _buckets((await conn.execute(
+                select(L.user_id, L.type, L.status, func.count(), func.sum(L.amount))
+                .where(L.user_id.in_(ids)).group_by(L.user_id, L.type, L.status))).all())
+            rolled = _buckets((await conn.execute(
+                select(R.user_id, R.type, R.status, func.sum(R.tx_count), func.sum(R.amount))
+                .where(R.user_id.in_(ids)).group_by(R.user_id, R.type, R.status))).all())
+    batch = Batch(checked=len(users), next_after=ids[-1] if len(users) == limit else None)
+    for user_id, user_credits in users:
+        expected = ledger_balance(ledger.get(user_id, {}))
+        same = ledger.get(user_id, {}) == rolled.get(user_id, {})
+        if user_credits != expected or not same:
+            batch.mismatches.append(Mismatch(user_id, user_credits, expected, same))
+    return batch
+
+def _day_expr(db: AsyncSession):
+    col = func.coalesce(L.created_at, func.now())
+    # в SQLite CAST(... AS DATE) даёт число, а не дату
+    return func.date(col) if db.bind.dialect.name == "sqlite" else cast(col, Date)
+
+async def rebuild(db: AsyncSession, user_ids: List[UUID]) -> None:
+    """Пересчитать credit_rollups пользователей из ledger. Коммит — на вызывающем."""
+    if not user_ids:
+        return
+    await db.execute(delete(R).where(R.user_id.in_(user_ids)))
+    day = _day_expr(db)
+    rows = (await db.execute(select(L.user_id, day, L.type, L.status, func.count(), func.sum(L.amount))
+                             .where(L.user_id.in_(user_ids)).group_by(L.user_id, day, L.type, L.status))).all()
+    if rows:
+        await db.execute(insert(R), [{"user_id": u, "day": d if isinstance(d, date) else date.fromisoformat(d),
+                                      "type": t, "status": s, "tx_count": n, "amount": a}
+                                     for u, d, t, s, n, a in rows])
+
+async def reconcile(fix: bool = False, batch_size: int = 1000) -> Tuple[int, List[Mismatch]]:
+    """Сверить всех пользователей пачками; fix — пересчитать разошедшиеся rollups (баланс не трогаем)."""
+    checked, found = 0, []
+    after = None
+    while True:
+        batch = await reconcile_batch(after, batch_size)
+        checked += batch.checked
+        found.extend(batch.mismatches)
+        broken = [m.user_id for m in batch.mismatches if not m.rollups_match]
+        if fix and broken:
+            async with SessionLocal() as db:
+                await rebuild(db, broken)
+                await db.commit()
+            log.info("Rebuilt rollups for %d users", len(broken))
+        if batch.next_after is None:
+            return checked, found
+        after = batch.next_after
+
+async def _main(args) -> int:
+    try:
+        checked, found = await reconcile(fix=args.fix, batch_size=args.batch)
+    finally:
+        await engine.dispose()
+        await read_engine.dispose()
+    for m in found:
+        what = [] if m.credits == m.ledger else [f"credits {m.credits} != ledger {m.ledger}"]
+        if not m.rollups_match:
+            what.append("rollups rebuilt" if args.fix else "rollups differ from ledger")
+        print(f"{m.user_id}: {'; '.join(what)}")
+    print(f"checked {checked} users, {len(found)} mismatched")
+    # --fix чинит только rollups: расхождение баланса остаётся ошибкой
+    return 1 if any(m.credits != m.ledger or not (args.fix or m.rollups_match) for m in found) else 0
+
+if __name__ == "__main__":
+    setup_logging(debug=False)
+    ap = argparse.ArgumentParser(description="Reconcile users.credits and credit_rollups against the ledger")
+    ap.add_argument("--fix", action="store_true", help="пересчитать credit_rollups разошедшимся пользователям")
+    ap.add_argument("--batch", type=int, default=1000)
+    raise SystemExit(asyncio.run(_main(ap.parse_args())))
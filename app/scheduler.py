@@ -0,0 +1,297 @@
+# app/scheduler.py
+"""
+Очередь отправки задач в OpenAI со справедливым (weighted fair) порядком между пользователями.
+
+POST /videos и /videos/batch только ставят задачу в очередь (status=queued, openai_id IS NULL),
+диспетчер (run_forever: в API-процессе при SCHEDULER_IN_APP и в python -m app.poller)
+отправляет их в OpenAI.
+
+Порядок — по виртуальному времени окончания queue_tag (WFQ):
+    tag = max(V, последний tag пользователя в очереди) + seconds / weight,
+где V — минимальный tag в очереди. Пользователь с сотней задач в очереди не задерживает
+новичка: первая задача новичка встаёт сразу за головой очереди. weight = SCHEDULER_PRIORITY_WEIGHT
+для админов и платящих (есть settled purchase), иначе 1.
+
+Ограничения при отправке: у пользователя не больше SCHEDULER_USER_INFLIGHT задач в OpenAI
+(SCHEDULER_PRIORITY_INFLIGHT для приоритетных), всего — SCHEDULER_MAX_INFLIGHT (0 — без лимита).
+Реплики не отправляют одну задачу дважды: пачка забирается FOR UPDATE SKIP LOCKED и в той же
+транзакции одним UPDATE переходит queued → submitting с арендой в next_poll_at — до ответа OpenAI
+её никто больше не возьмёт. Пачка не больше SCHEDULER_SUBMIT_CONCURRENCY: все её задачи
+отправляются сразу, без очереди внутри процесса. Если воркер умер посреди отправки, задача
+остаётся в submitting: после SCHEDULER_LEASE_SECONDS reap_stuck() переводит её в failed
+с возвратом кредитов — повторный POST мог бы оплатить ролик дважды. Поэтому аренда должна быть
+дольше худшего времени отправки (check_lease при старте).
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from . import credits, events, metrics, models
+from .cache import TTLCache
+from .config import settings
+from .database import SessionLocal
+from .jobs import POLLED, transition
+from .openai_client import create_video as oa_create_video
+from .poller import poll_delay
+from .ratelimit import UpstreamUnavailable, breaker
+
+log = logging.getLogger("storycraft.scheduler")
+
+J = models.VideoJob
+# ждёт отправки: ещё не ушла в OpenAI и не взята из кэша генераций
+PENDING = and_(J.status == models.JobStatus.queued, J.openai_id.is_(None), J.source_job_id.is_(None))
+
+_stats = {"enqueued": 0, "dispatched": 0, "failed": 0, "deferred": 0}
+# user_id -> есть ли оплаченные покупки; меняется редко
+_paid = TTLCache(maxsize=10000, ttl=300, name="scheduler_paid")
+_wake = asyncio.Event()
+
+def stats() -> dict:
+    return dict(_stats)
+
+def submit_worst_case() -> float:
+    """
+    Сколько в худшем случае длится create_video (app/openai_client._send): каждая попытка —
+    ожидание лимитера, connect и read; между попытками — backoff или Retry-After (через лимитер).
+    """
+    attempts = settings.UPSTREAM_RETRIES + 1
+    per_attempt = settings.UPSTREAM_LIMIT_MAX_WAIT + settings.UPSTREAM_CONNECT_TIMEOUT + settings.UPSTREAM_READ_TIMEOUT
+    return attempts * per_attempt + settings.UPSTREAM_RETRIES * settings.UPSTREAM_BACKOFF_MAX
+
+def batch_size() -> int:
+    """Задач за проход: не больше, чем отправляется одновременно, иначе часть ждала бы в submitting."""
+    return max(1, min(settings.SCHEDULER_BATCH_SIZE, settings.SCHEDULER_SUBMIT_CONCURRENCY))
+
+def check_lease() -> None:
+    """Старт диспетчера: аренда короче отправки — живую отправку сочтут зависшей."""
+    if 0 < settings.UPSTREAM_CREATE_CONCURRENCY < batch_size():
+        # лишние POST ждали бы слот лимитера, и это ожидание не ограничено
+        raise RuntimeError(f"SCHEDULER_SUBMIT_CONCURRENCY/SCHEDULER_BATCH_SIZE ({batch_size()}) must not exceed "
+                           f"UPSTREAM_CREATE_CONCURRENCY={settings.UPSTREAM_CREATE_CONCURRENCY}")
+    worst = submit_worst_case()
+    if settings.SCHEDULER_LEASE_SECONDS <= worst:
+        raise RuntimeError(f"SCHEDULER_LEASE_SECONDS={settings.SCHEDULER_LEASE_SECONDS:g} must exceed the worst-case "
+                           f"submit time {worst:g}s (UPSTREAM_RETRIES, UPSTREAM_LIMIT_MAX_WAIT, timeouts, backoff)")
+
+def wake() -> None:
+    """Разбудить диспетчер этого процесса сразу после commit новой задачи."""
+    _wake.set()
+
+async def is_priority(db: AsyncSession, user_id: UUID, is_admin: bool) -> bool:
+    if is_admin:
+        return True
+    paid = _paid.get(user_id)
+    if paid is None:
+        L = models.CreditTransaction
+        paid = (await db.execute(select(L.id).where(L.user_id == user_id, L.type == models.TxType.purchase,
+                                                    L.status == models.TxStatus.settled).limit(1))).first() is not None
+        _paid.set(user_id, paid)
+    return paid
+
+async def enqueue(db: AsyncSession, user_id: UUID, is_admin: bool, jobs: Sequence[models.VideoJob]) -> None:
+    """Проставить queue_tag/priority новым задачам пользователя (до db.add). Коммит — на вызывающем."""
+    priority = await is_priority(db, user_id, is_admin)
+    weight = settings.SCHEDULER_PRIORITY_WEIGHT if priority else 1.0
+    vnow = (await db.execute(select(func.min(J.queue_tag)).where(PENDING))).scalar()
+    last = (await db.execute(select(func.max(J.queue_tag)).where(PENDING, J.user_id == user_id))).scalar()
+    tag = max(vnow or 0.0, last or 0.0)
+    for job in jobs:
+        tag += (job.seconds or 4) / weight
+        job.queue_tag = tag
+        job.priority = 1 if priority else 0
+    _stats["enqueued"] += len(jobs)
+
+async def queue_positions(db: AsyncSession, jobs: Sequence) -> Dict[UUID, int]:
+    """
+    queue_position (1 — следующая) для ждущих отправки задач, одним запросом. jobs — VideoJob
+    или строки select() с колонками id, status, openai_id, source_job_id, queue_tag.
+    """
+    waiting = [j for j in jobs if j.status == models.JobStatus.queued and not j.openai_id
+               and j.source_job_id is None and j.queue_tag is not None]
+    if not waiting:
+        return {}
+    mine, ahead = aliased(J), J
+    res = await db.execute(
+        select(mine.id, func.count(ahead.id))
+        .join(ahead, and_(PENDING, or_(ahead.queue_tag < mine.queue_tag,
+                                       and_(ahead.queue_tag == mine.queue_tag, ahead.id < mine.id))), isouter=True)
+        .where(mine.id.in_([j.id for j in waiting]))
+        .group_by(mine.id))
+    counts = dict(res.all())
+    return {j.id: counts.get(j.id, 0) + 1 for j in waiting}
+
+async def annotate(db: AsyncSession, jobs: Sequence[models.VideoJob]) -> None:
+    """Проставить queue_position задачам перед ответом."""
+    positions = await queue_positions(db, jobs)
+    for j in jobs:
+        j.queue_position = positions.get(j.id)
+
+def pick(candidates: Sequence[tuple], inflight: Dict[UUID, int], free: Optional[int], limit: int) -> List[UUID]:
+    """
+    candidates — (id, user_id, priority) в порядке queue_tag. Пропускаем задачи пользователей,
+    упёршихся в свой лимит; их очередь сохраняет место и уйдёт, когда освободится слот.
+    """
+    taken: List[UUID] = []
+    counts = dict(inflight)
+    for job_id, user_id, priority in candidates:
+        if len(taken) >= limit or (free is not None and len(taken) >= free):
+            break
+        cap = settings.SCHEDULER_PRIORITY_INFLIGHT if priority else settings.SCHEDULER_USER_INFLIGHT
+        if counts.get(user_id, 0) >= cap:
+            continue
+        counts[user_id] = counts.get(user_id, 0) + 1
+        taken.append(job_id)
+    return taken
+
+# снимок задачи для отправки: RETURNING из claim_batch
+Claimed = Tuple[UUID, str, Optional[str], Optional[int], int, Optional[datetime]]
+
+async def claim_batch() -> List[Claimed]:
+    """
+    Забрать пачку: выбор FOR UPDATE SKIP LOCKED и один UPDATE queued → submitting с арендой.
+    Возвращает снимки (id, prompt, model, seconds, priority, created_at) — отправке БД до ответа
+    OpenAI больше не нужна.
+    """
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        async with db.begin():
+            res = await db.execute(select(J.id, J.user_id, J.priority)
+                                   .where(PENDING, or_(J.next_poll_at.is_(None), J.next_poll_at <= now))
+                                   .order_by(J.queue_tag.asc().nulls_first(), J.id)
+                                   .limit(settings.SCHEDULER_SCAN_SIZE)
+                                   .with_for_update(skip_locked=True))
+            candidates = res.all()
+            if not candidates:
+                return []
+            active = or_(J.status == models.JobStatus.submitting, and_(J.status.in_(POLLED), J.openai_id.isnot(None)))
+            users = {c[1] for c in candidates}
+            inflight = dict((await db.execute(select(J.user_id, func.count())
+                                              .where(active, J.user_id.in_(users))
+                                              .group_by(J.user_id))).all())
+            free = None
+            if settings.SCHEDULER_MAX_INFLIGHT > 0:
+                total = (await db.execute(select(func.count()).where(active))).scalar()
+                free = max(0, settings.SCHEDULER_MAX_INFLIGHT - total)
+            ids = pick(candidates, inflight, free, batch_size())
+            _stats["deferred"] += len(candidates) - len(ids)
+            if not ids:
+                return []
+            claimed = (await db.execute(
+                update(J).where(J.id.in_(ids), PENDING)
+                .values(status=models.JobStatus.submitting,
+                        next_poll_at=now + timedelta(seconds=settings.SCHEDULER_LEASE_SECONDS))
+                .returning(J.id, J.prompt, J.model, J.seconds, J.priority, J.created_at))).all()
+    if claimed:
+        metrics.JOB_TRANSITIONS.inc(len(claimed), status=models.JobStatus.submitting.value)
+    return [tuple(row) for row in claimed]
+
+async def submit_job(job: Claimed) -> None:
+    """
+    Отправить задачу, уже переведённую claim_batch в submitting: запрос в OpenAI без соединения
+    с БД — submitting → queued с openai_id. UpstreamUnavailable пробрасывается — задача вернётся
+    в очередь.
+    """
+    job_id, prompt, model, seconds, priority, created_at = job
+    waited = (datetime.utcnow() - created_at).total_seconds() if created_at else 0.0
+    try:
+        resp = await oa_create_video(prompt, model=model or "sora-2")
+        openai_id = resp.get("id")
+        if not openai_id:
+            raise RuntimeError(f"OpenAI response missing id: {resp}")
+    except UpstreamUnavailable as e:
+        # запрос не ушёл: держим место в очереди, повторим после паузы
+        async with SessionLocal() as db:
+            await transition(db, job_id, models.JobStatus.queued,
+                             next_poll_at=datetime.utcnow() + timedelta(seconds=max(1.0, e.retry_after)))
+            await db.commit()
+        raise
+    except Exception as e:
+        log.warning("Submit of job %s failed: %s", job_id, e)
+        async with SessionLocal() as db:
+            failed = await transition(db, job_id, models.JobStatus.failed)
+            if failed is not None:
+                await credits.release(db, failed.user_id, str(failed.id))
+                await events.job_changed(db, failed)
+            await db.commit()
+        _stats["failed"] += 1
+        return
+
+    async with SessionLocal() as db:
+        sent = await transition(db, job_id, models.JobStatus.queued, openai_id=openai_id,
+                                next_poll_at=datetime.utcnow() + timedelta(seconds=poll_delay(seconds, 0, 0)))
+        if sent is None:
+            # пока ждали OpenAI, аренда истекла и reap_stuck() уже перевёл задачу в failed
+            log.warning("Job %s changed during submit, OpenAI video %s is not linked", job_id, openai_id)
+            await db.rollback()
+            return
+        await events.job_changed(db, sent)
+        await db.commit()
+    _stats["dispatched"] += 1
+    metrics.SCHEDULER_WAIT.observe(waited, priority=str(priority or 0))
+
+async def reap_stuck() -> int:
+    """
+    submitting с истёкшей арендой: воркер умер посреди POST. Ушёл ли запрос в OpenAI, неизвестно,
+    поэтому не отправляем повторно, а переводим в failed и возвращаем кредиты.
+    """
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        ids = (await db.scalars(select(J.id).where(J.status == models.JobStatus.submitting, J.next_poll_at <= now)
+                                .limit(settings.SCHEDULER_BATCH_SIZE))).all()
+        n = 0
+        for job_id in ids:
+            job = await transition(db, job_id, models.JobStatus.failed,
+                                   J.status == models.JobStatus.submitting, J.next_poll_at <= now)
+            if job is None:
+                continue
+            log.warning("Job %s stuck in submitting past its lease, marking failed", job_id)
+            await credits.release(db, job.user_id, str(job.id))
+            await events.job_changed(db, job)
+            n += 1
+        await db.commit()
+    _stats["failed"] += n
+    return n
+
+async def dispatch_once() -> int:
+    await reap_stuck()
+    if breaker.is_open():
+        return 0
+    claimed = await claim_batch()
+
+    async def run(job: Claimed):
+        try:
+            await submit_job(job)
+        except UpstreamUnavailable as e:
+            log.warning("Submit deferred for job %s: %s", job[0], e)
+        except Exception:
+            log.exception("Submit failed for job %s", job[0])
+
+    # пачка не больше SCHEDULER_SUBMIT_CONCURRENCY — отправляем все сразу
+    await asyncio.gather(*(run(job) for job in claimed))
+    return len(claimed)
+
+async def run_forever(stop: Optional[asyncio.Event] = None) -> None:
+    stop = stop or asyncio.Event()
+    log.info("Submission scheduler started")
+    while not stop.is_set():
+        _wake.clear()
+        try:
+            n = await dispatch_once()
+        except Exception:
+            log.exception("Scheduler cycle failed")
+            n = 0
+        if n >= batch_size():
+            continue
+        waiters = [asyncio.create_task(_wake.wait()), asyncio.create_task(stop.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=settings.SCHEDULER_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waiters:
+                w.cancel()
+    log.info("Submission scheduler stopped")
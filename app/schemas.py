@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Literal
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID
 from .models import TxType, TxStatus, JobStatus
 
@@ -44,6 +44,33 @@ class CreditTxOut(BaseModel):
     class Config:
         from_attributes = True
 
+class CreditBucketOut(BaseModel):
+    day: Optional[date] = None     # None — итог за всё окно
+    type: TxType
+    status: TxStatus
+    count: int
+    amount: int
+
+class CreditSummaryOut(BaseModel):
+    balance: int
+    since: Optional[date] = None   # первый день окна; None — вся история
+    spent: int                     # списано за окно (settled spend), положительное число
+    reserved: int                  # зарезервировано под незавершённые задачи (pending spend)
+    received: int                  # начислено за окно (grant + purchase)
+    totals: List[CreditBucketOut]  # по (type, status) за окно
+    daily: List[CreditBucketOut] = []
+
+class ReconcileItemOut(BaseModel):
+    user_id: UUID
+    credits: int
+    ledger: int
+    rollups_match: bool
+
+class ReconcileOut(BaseModel):
+    checked: int
+    mismatches: List[ReconcileItemOut]
+    next_after: Optional[UUID] = None   # передать как ?after= для следующей пачки
+
 class GrantIn(BaseModel):
     user_id: UUID
     amount: int = Field(gt=0)
@@ -55,6 +82,7 @@ class VideoCreateIn(BaseModel):
     format: Optional[Fmt] = Field(None, description="Will be mapped to size internally")
     style: Optional[Style] = "default"
     model: Optional[str] = "sora-2"
+    reuse_cached: bool = Field(True, description="Разрешить готовый ролик из кэша (если кэш включён)")
 
 class VideoOut(BaseModel):
     id: UUID
@@ -66,6 +94,13 @@ class VideoOut(BaseModel):
     status: JobStatus
     cost_credits: int
     file_url: Optional[str]
+    duration: Optional[float] = None       # из файла, сек; None — пока не готов или не MP4
+    width: Optional[int] = None
+    height: Optional[int] = None
+    codec: Optional[str] = None            # fourcc видеодорожки: avc1, hvc1, av01...
+    source_job_id: Optional[UUID] = None   # ролик взят из кэша генераций
+    group_id: Optional[UUID] = None        # общий для задач одного POST /videos/batch
+    queue_position: Optional[int] = None   # пока ждёт отправки в OpenAI: 1 — следующая
     created_at: datetime
     updated_at: datetime
 
@@ -74,6 +109,7 @@ class VideoOut(BaseModel):
 
 class VideoListOut(BaseModel):
     items: List[VideoOut]
+    next_cursor: Optional[str] = None   # передать как ?after= для следующей страницы
 
 class VideoBatchIn(BaseModel):
     prompt: str
@@ -81,6 +117,22 @@ class VideoBatchIn(BaseModel):
     format: Optional[Fmt] = None
     model: str = "sora-2"
     styles: Optional[List[Style]] = None  # если None — сгенерим все 5
+    reuse_cached: bool = True
 
 class VideoBatchOut(BaseModel):
+    group_id: Optional[UUID] = None             # для POST /videos/pull {"group_id": ...}
+    # поставленные в очередь / взятые из кэша; итог по стилю — status задачи (failed — не отправилась)
+    items: List[VideoOut]
+
+class VideoPullIn(BaseModel):
+    # либо список id, либо group_id батча
+    ids: Optional[List[UUID]] = Field(None, min_length=1)
+    group_id: Optional[UUID] = None
+
+class VideoPullOut(BaseModel):
     items: List[VideoOut]
+    missing: List[UUID] = []    # id из запроса, которых нет у пользователя
+
+class VideoUrlOut(BaseModel):
+    url: str
+    expires_at: Optional[datetime] = None
@@ -0,0 +1,71 @@
+# app/serialize.py
+"""
+Лёгкий путь ответа для списков (GET /videos, GET /credits/transactions): select только нужных
+колонок (строки без ORM identity map), словари в порядке полей схемы и orjson вместо
+pydantic-валидации + json.dumps. Формат JSON тот же, что у response_model.
+
+fields= — sparse fieldset: ответ только с перечисленными полями схемы.
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Sequence, Type
+from uuid import UUID
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость: без неё — stdlib json
+    orjson = None
+
+def _default(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        # UUID, datetime и Enum orjson пишет сам, в том же виде, что и pydantic
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """content — уже готовые dict/list из примитивов, UUID, datetime и Enum; без повторной валидации."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+def fieldset(schema: Type[BaseModel], fields: Optional[str]) -> List[str]:
+    """Поля схемы в её порядке; fields — «id,status,file_url», неизвестное имя — 400."""
+    names = list(schema.model_fields)
+    if not fields:
+        return names
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted.difference(names)
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [n for n in names if n in wanted]
+
+def columns(model, names: Iterable[str]) -> list:
+    """Колонки модели для select(); имена без колонки (вычисляемые поля) пропускаются."""
+    table = model.__table__.c
+    return [getattr(model, n) for n in dict.fromkeys(names) if n in table]
+
+def rows_to_dicts(rows: Sequence, names: Sequence[str], extra: Optional[Dict[str, Dict]] = None) -> List[dict]:
+    """
+    Строки select() -> словари с полями names. extra — вычисляемые поля: {имя: {id строки: значение}},
+    отсутствующее в нём значение — None.
+    """
+    extra = extra or {}
+    out = []
+    for row in rows:
+        m = row._mapping
+        out.append({n: (extra[n].get(row.id) if n in extra else m[n]) for n in names})
+    return out
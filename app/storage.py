@@ -1,52 +1,217 @@
+import asyncio
+import hashlib
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterable, List, Optional, Set, Tuple
+from .cache import TTLCache
 from .config import settings
 
+@dataclass(frozen=True)
+class SavedFile:
+    path: str                      # локальный путь или ключ S3 — то, что пишется в VideoJob.file_path
+    size: int
+    sha256: Optional[str] = None   # только для контентно-адресуемого LocalStorage
+
 class LocalStorage:
+    """
+    Контентно-адресуемое хранилище: <root>/objects/ab/cd/<sha256>.<ext>.
+    SHA-256 считается на лету при записи, одинаковое содержимое хранится один раз
+    (ссылки считает app/blobs.py). Запись — во временный файл в <root>/.tmp и атомарный rename.
+    Старые файлы <root>/<job_id>.mp4 переносятся при первом обращении (blobs.migrate_legacy).
+    """
+
     def __init__(self, root: str):
         self.root = Path(root)
-        self.root.mkdir(parents=True, exist_ok=True)
+        self.tmp = self.root / ".tmp"
+        self.tmp.mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, sha256: str, ext: str = "mp4") -> Path:
+        return self.root / "objects" / sha256[:2] / sha256[2:4] / f"{sha256}.{ext}"
+
+    def is_content_addressed(self, path: str) -> bool:
+        return Path(path).parent.parent.parent == self.root / "objects"
+
+    def _commit(self, tmp: str, sha256: str, size: int, ext: str) -> SavedFile:
+        path = self.object_path(sha256, ext)
+        if path.exists():
+            # такое содержимое уже есть — новый файл не нужен
+            os.unlink(tmp)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)
+        return SavedFile(path=str(path), size=size, sha256=sha256)
 
-    def save_bytes(self, job_id: str, content: bytes, ext: str = "mp4") -> str:
-        path = self.root / f"{job_id}.{ext}"
-        path.write_bytes(content)
-        # Return a relative URL path handled by /videos/{id}/file
-        return str(path)
+    def save_bytes(self, job_id: str, content: bytes, ext: str = "mp4") -> SavedFile:
+        fd, tmp = tempfile.mkstemp(dir=self.tmp, prefix=f"{job_id}.", suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        return self._commit(tmp, hashlib.sha256(content).hexdigest(), len(content), ext)
 
-    def get_path(self, job_id: str, ext: str = "mp4") -> Path:
-        return self.root / f"{job_id}.{ext}"
+    async def save_stream(self, job_id: str, chunks: AsyncIterable[bytes], ext: str = "mp4") -> SavedFile:
+        # читатель /file никогда не увидит недокачанный mp4: в objects/ попадает только целый файл
+        fd, tmp = tempfile.mkstemp(dir=self.tmp, prefix=f"{job_id}.", suffix=".part")
+        digest = hashlib.sha256()
+        size = 0
 
-try:
-    import boto3
-    from botocore.client import Config as BotoConfig
-except Exception:
-    boto3 = None
+        def write(chunk: bytes) -> None:
+            f.write(chunk)
+            digest.update(chunk)
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    await asyncio.to_thread(write, chunk)
+                    size += len(chunk)
+            return await asyncio.to_thread(self._commit, tmp, digest.hexdigest(), size, ext)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def hash_file(self, path: str) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(settings.DOWNLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), size
+
+    def adopt(self, legacy: str, ext: str = "mp4") -> SavedFile:
+        """Перенос старого плоского файла в objects/: hard link (или копия) + удаление исходника."""
+        sha256, size = self.hash_file(legacy)
+        path = self.object_path(sha256, ext)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(legacy, path)  # атомарно: файл появляется сразу целиком
+            except FileExistsError:
+                pass
+            except OSError:
+                # другая ФС / нет hard link — копия через временный файл
+                fd, tmp = tempfile.mkstemp(dir=self.tmp, prefix="legacy.", suffix=".part")
+                with os.fdopen(fd, "wb") as dst, open(legacy, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp, path)
+        return SavedFile(path=str(path), size=size, sha256=sha256)
 
 class S3Storage:
+    """
+    boto3 синхронный, поэтому все вызовы идут через собственный ограниченный пул потоков
+    (S3_MAX_WORKERS), а не в event loop. Клиент boto3 потокобезопасен и живёт всё время процесса.
+    """
+
     def __init__(self):
-        if not boto3:
+        # boto3 импортируется ~0.1 с — только когда выбран S3, а не при каждом старте воркера
+        try:
+            import boto3
+            from botocore.client import Config as BotoConfig
+        except ImportError:
             raise RuntimeError("boto3 not installed")
         session = boto3.session.Session(
             aws_access_key_id=settings.S3_ACCESS_KEY,
             aws_secret_access_key=settings.S3_SECRET_KEY,
             region_name=settings.S3_REGION,
         )
-        self.s3 = session.client("s3", endpoint_url=settings.S3_ENDPOINT_URL, config=BotoConfig(signature_version="s3v4"))
+        cfg = BotoConfig(signature_version="s3v4", max_pool_connections=settings.S3_MAX_WORKERS,
+                         s3={"addressing_style": settings.S3_ADDRESSING_STYLE} if settings.S3_ADDRESSING_STYLE else None)
+        self.s3 = session.client("s3", endpoint_url=settings.S3_ENDPOINT_URL, config=cfg)
         self.bucket = settings.S3_BUCKET
+        self._executor = ThreadPoolExecutor(max_workers=settings.S3_MAX_WORKERS, thread_name_prefix="s3")
+        # ключ -> (url, expires_at); TTL записи короче срока подписи на S3_PRESIGN_REFRESH_MARGIN
+        self._urls = TTLCache(maxsize=settings.S3_PRESIGN_CACHE_SIZE, ttl=settings.S3_PRESIGN_EXPIRES,
+                             name="s3_presign")
 
-    def save_bytes(self, job_id: str, content: bytes, ext: str = "mp4") -> str:
-        key = f"videos/{job_id}.{ext}"
-        self.s3.put_object(Bucket=self.bucket, Key=key, Body=content, ContentType="video/mp4")
-        # return presigned URL
-        url = self.s3.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": self.bucket, "Key": key},
-            ExpiresIn=3600 * 24 * 7,  # 7 days
-        )
-        return url
+    async def _call(self, fn, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, **kwargs))
+
+    @staticmethod
+    def key_for(job_id: str, ext: str = "mp4") -> str:
+        return f"videos/{job_id}.{ext}"
+
+    async def save_stream(self, job_id: str, chunks: AsyncIterable[bytes], ext: str = "mp4") -> SavedFile:
+        """
+        Multipart upload; до S3_MULTIPART_CONCURRENCY частей грузятся параллельно,
+        так что в памяти не больше (concurrency + 1) * S3_MULTIPART_PART_SIZE. Путь в SavedFile — ключ объекта.
+        """
+        key = self.key_for(job_id, ext)
+        size = 0
+        part_size = settings.S3_MULTIPART_PART_SIZE
+        upload_id: Optional[str] = None
+        inflight: Set[asyncio.Task] = set()
+        parts: List[dict] = []
+        buf = bytearray()
+
+        async def start_part(body: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                r = await self._call(self.s3.create_multipart_upload,
+                                     Bucket=self.bucket, Key=key, ContentType="video/mp4")
+                upload_id = r["UploadId"]
+            while len(inflight) >= settings.S3_MULTIPART_CONCURRENCY:
+                done, _ = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    inflight.discard(t)
+                    parts.append(t.result())
+            number = len(parts) + len(inflight) + 1
+            inflight.add(asyncio.create_task(self._upload_part(key, upload_id, number, body)))
+
+        try:
+            async for chunk in chunks:
+                buf += chunk
+                size += len(chunk)
+                while len(buf) >= part_size:
+                    await start_part(bytes(buf[:part_size]))
+                    del buf[:part_size]
+            if upload_id is None:
+                # файл меньше одной части — обычный put_object
+                await self._call(self.s3.put_object, Bucket=self.bucket, Key=key,
+                                 Body=bytes(buf), ContentType="video/mp4")
+                return SavedFile(path=key, size=size)
+            if buf:
+                await start_part(bytes(buf))
+            parts.extend(await asyncio.gather(*inflight))
+            inflight.clear()
+            parts.sort(key=lambda p: p["PartNumber"])
+            await self._call(self.s3.complete_multipart_upload, Bucket=self.bucket, Key=key,
+                             UploadId=upload_id, MultipartUpload={"Parts": parts})
+        except BaseException:
+            for t in inflight:
+                t.cancel()
+            if upload_id is not None:
+                await self._call(self.s3.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+        return SavedFile(path=key, size=size)
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, body: bytes) -> dict:
+        r = await self._call(self.s3.upload_part, Bucket=self.bucket, Key=key,
+                             UploadId=upload_id, PartNumber=number, Body=body)
+        return {"ETag": r["ETag"], "PartNumber": number}
+
+    async def presigned_url(self, key: str) -> Tuple[str, datetime]:
+        cached = self._urls.get(key)
+        if cached:
+            return cached
+        expires = settings.S3_PRESIGN_EXPIRES
+        url = await self._call(self.s3.generate_presigned_url, ClientMethod="get_object",
+                               Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=expires)
+        value = (url, datetime.utcnow() + timedelta(seconds=expires))
+        self._urls.set(key, value, ttl=max(0, expires - settings.S3_PRESIGN_REFRESH_MARGIN))
+        return value
+
+_storage = None
 
 def get_storage():
-    if settings.STORAGE_BACKEND == "s3":
-        return S3Storage()
-    return LocalStorage(settings.STORAGE_LOCAL_PATH)
+    # один экземпляр на процесс: boto3-клиент, пул потоков и кэш подписей переиспользуются
+    global _storage
+    if _storage is None:
+        _storage = S3Storage() if settings.STORAGE_BACKEND == "s3" else LocalStorage(settings.STORAGE_LOCAL_PATH)
+    return _storage
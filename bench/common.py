@@ -0,0 +1,17 @@
+# bench/common.py
+from typing import Dict, List, Sequence
+
+def percentile(samples: Sequence[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(samples_ms),
+        "p50": percentile(samples_ms, 50),
+        "p95": percentile(samples_ms, 95),
+        "p99": percentile(samples_ms, 99),
+    }
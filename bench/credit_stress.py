@@ -0,0 +1,106 @@
+# bench/credit_stress.py
+"""
+Сотни параллельных резервов кредитов одного пользователя, каждый в своей сессии.
+Нужен Postgres, берётся DATABASE_URL из окружения/.env:
+
+    python -m bench.credit_stress --credits 1000 --cost 7 --requests 400
+
+Проверяет, что баланс не ушёл в минус, успешных резервов ровно credits // cost,
+баланс сходится с ledger, параллельные refund одной траты возвращают кредиты один раз,
+а дневные итоги credit_rollups совпадают с ledger.
+Пользователь создаётся под бенч и удаляется в конце.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, select
+
+from app import credits, models, rollups
+from app.database import SessionLocal
+
+L = models.CreditTransaction
+
+async def reserve_one(uid, cost: int, n: int):
+    async with SessionLocal() as db:
+        tx = await credits.reserve(db, uid, cost, f"stress-{n}")
+        await db.commit()
+        return tx
+
+async def refund_one(uid, ref: str) -> bool:
+    async with SessionLocal() as db:
+        ok = await credits.refund(db, uid, ref)
+        await db.commit()
+        return ok
+
+async def ledger_state(uid):
+    async with SessionLocal() as db:
+        bal = await credits.balance(db, uid)
+        rows = (await db.execute(select(L.type, L.status, func.count(), func.coalesce(func.sum(L.amount), 0))
+                                 .where(L.user_id == uid).group_by(L.type, L.status))).all()
+    return bal, {(r[0].value, r[1].value): (r[2], r[3]) for r in rows}
+
+async def rollup_state(uid):
+    totals = {}
+    async with SessionLocal() as db:
+        for _, tx_type, status, count, amount in await rollups.summary(db, uid):
+            n, a = totals.get((tx_type.value, status.value), (0, 0))
+            totals[(tx_type.value, status.value)] = (n + count, a + amount)
+    return {k: v for k, v in totals.items() if v != (0, 0)}
+
+def check(name: str, ok: bool):
+    print(f"  [{'ok' if ok else 'FAIL'}] {name}")
+    return ok
+
+async def main(args):
+    uid = uuid.uuid4()
+    async with SessionLocal() as db:
+        await db.execute(insert(models.User.__table__).values(
+            id=uid, email=f"bench-{uid.hex[:8]}@example.com", password_hash="x", credits=args.credits))
+        await db.commit()
+
+    try:
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(reserve_one(uid, args.cost, n) for n in range(args.requests)))
+        wall = time.perf_counter() - t0
+        won = [n for n, tx in enumerate(results) if tx is not None]
+        print(f"{args.requests} reserves in {wall:.2f}s: {len(won)} ok, {args.requests - len(won)} rejected")
+
+        bal, state = await ledger_state(uid)
+        pending = state.get(("spend", "pending"), (0, 0))
+        good = all([
+            check(f"successes == credits // cost ({args.credits // args.cost})",
+                  len(won) == min(args.requests, args.credits // args.cost)),
+            check(f"balance >= 0 ({bal})", bal >= 0),
+            check("balance == initial + sum(pending spends)", bal == args.credits + pending[1]),
+        ])
+
+        # одну и ту же трату рефандят параллельно — кредиты вернуться должны один раз
+        targets = won[:args.refunds]
+        outcomes = await asyncio.gather(*(refund_one(uid, f"stress-{n}") for n in targets for _ in range(args.dup)))
+        bal2, state = await ledger_state(uid)
+        refunds = state.get(("refund", "settled"), (0, 0))
+        good &= all([
+            check(f"each refund applied once ({Counter(outcomes)[True]} of {len(outcomes)} calls won)",
+                  Counter(outcomes)[True] == len(targets) and refunds[0] == len(targets)),
+            check(f"balance restored by refunds ({bal} -> {bal2})", bal2 == bal + len(targets) * args.cost),
+            check("credit_rollups match the ledger", await rollup_state(uid) == state),
+        ])
+        print("ledger:", state)
+        print("PASS" if good else "FAIL")
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(delete(L).where(L.user_id == uid))
+            await db.execute(delete(models.User).where(models.User.id == uid))
+            await db.commit()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--credits", type=int, default=1000)
+    ap.add_argument("--cost", type=int, default=7)
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--refunds", type=int, default=20, help="сколько трат рефандить")
+    ap.add_argument("--dup", type=int, default=5, help="параллельных refund на одну трату")
+    asyncio.run(main(ap.parse_args()))
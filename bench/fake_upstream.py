@@ -0,0 +1,206 @@
+# bench/fake_upstream.py
+"""
+Минимальная заглушка OpenAI /v1/videos на голом asyncio (HTTP/1.1 + keep-alive).
+Считает принятые TCP-соединения, чтобы было видно, сколько рукопожатий делает клиент,
+и запросы в работе (inflight) — сколько вызовов клиента сейчас ждут ответа.
+
+Жизненный цикл задачи: render_time > 0 — GET /videos/{id} отдаёт queued → in_progress → completed
+по времени с создания; fail_rate — доля задач, которые закончатся failed.
+
+Контент — настоящий MP4 (ftyp, mdat из content_size нулей, moov с mvhd/tkhd/stsd/stco):
+по умолчанию moov в конце, как у многих энкодеров, moov_first=True — уже faststart.
+
+Сбои: inject(429, count=3, retry_after=1) — следующие запросы получат ошибку;
+down = 503 — все запросы падают, пока не сбросить в None.
+"""
+import asyncio
+import itertools
+import json
+import struct
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Tuple
+
+REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 429: "Too Many Requests",
+           500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+def _box(kind: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+def _full(kind: bytes, *payload: bytes, version: int = 0, flags: int = 0) -> bytes:
+    return _box(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+def mp4_parts(size: int, moov_first: bool = False, seconds: float = 4.0, width: int = 1280, height: int = 720,
+              codec: bytes = b"avc1", chunks: int = 8, co64: bool = False) -> Tuple[bytes, bytes]:
+    """
+    (head, tail) файла head + <size байт содержимого mdat> + tail; смещения чанков в stco/co64
+    указывают на начало каждой из `chunks` равных частей mdat.
+    """
+    ms = int(seconds * 1000)
+
+    def moov(offsets) -> bytes:
+        entry = _box(codec, bytes(6), struct.pack(">H", 1), bytes(16), struct.pack(">HHII", width, height, 0x480000, 0x480000),
+                     bytes(4), struct.pack(">H", 1), bytes(32), struct.pack(">Hh", 0x18, -1))
+        table = (_full(b"co64", struct.pack(f">I{len(offsets)}Q", len(offsets), *offsets)) if co64 else
+                 _full(b"stco", struct.pack(f">I{len(offsets)}I", len(offsets), *offsets)))
+        stbl = _box(b"stbl", _full(b"stsd", struct.pack(">I", 1), entry), table)
+        mdia = _box(b"mdia", _full(b"mdhd", struct.pack(">IIIIHH", 0, 0, 1000, ms, 0x55c4, 0)),
+                    _full(b"hdlr", bytes(4), b"vide", bytes(12), b"VideoHandler\0"),
+                    _box(b"minf", stbl))
+        tkhd = _full(b"tkhd", struct.pack(">IIIII", 0, 0, 1, 0, ms), bytes(8), struct.pack(">hhhH", 0, 0, 0, 0), MATRIX,
+                     struct.pack(">II", width << 16, height << 16), flags=3)
+        mvhd = _full(b"mvhd", struct.pack(">IIIIIH", 0, 0, 1000, ms, 0x10000, 0x100), bytes(10), MATRIX,
+                     bytes(24), struct.pack(">I", 2))
+        return _box(b"moov", mvhd, _box(b"trak", tkhd, mdia))
+
+    ftyp = _box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomiso2avc1mp41")
+    mdat_head = struct.pack(">I4s", 8 + size, b"mdat")
+    step = max(1, size // max(1, chunks))
+    moov_len = len(moov([0] * len(range(0, size, step))))
+    data_at = len(ftyp) + (moov_len if moov_first else 0) + len(mdat_head)
+    table = moov([data_at + i for i in range(0, size, step)])
+    if moov_first:
+        return ftyp + table + mdat_head, b""
+    return ftyp + mdat_head, table
+
+class FakeUpstream:
+    def __init__(self, latency: float = 0.0, content_size: int = 1 << 20,
+                 host: str = "127.0.0.1", port: int = 0, render_time: float = 0.0, fail_rate: float = 0.0,
+                 moov_first: bool = False):
+        self.latency = latency
+        self.content_size = content_size
+        self.moov_first = moov_first
+        self.render_time = render_time
+        self.fail_rate = fail_rate
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.requests = 0
+        self.inflight = 0
+        self.statuses: Counter = Counter()
+        self.down: Optional[int] = None
+        self._faults: Deque[Tuple[int, Optional[float]]] = deque()
+        self._ids = itertools.count(1)
+        self._jobs: Dict[str, float] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> "FakeUpstream":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def reset_counters(self) -> None:
+        self.connections = 0
+        self.requests = 0
+        self.statuses.clear()
+
+    def inject(self, status: int, count: int = 1, retry_after: Optional[float] = None) -> None:
+        self._faults.extend([(status, retry_after)] * count)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                self.inflight += 1
+                try:
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    fault = self._faults.popleft() if self._faults else ((self.down, None) if self.down else None)
+                    if fault:
+                        status, retry_after = fault
+                        extra = (f"Retry-After: {retry_after:g}",) if retry_after is not None else ()
+                        self.statuses[status] += 1
+                        self._send_json(writer, status, {"error": {"message": "injected"}}, extra)
+                    else:
+                        self.statuses[200] += 1
+                        await self._route(writer, method, path.split("?", 1)[0])
+                    await writer.drain()
+                finally:
+                    self.inflight -= 1
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, writer, method: str, path: str):
+        parts = path.strip("/").split("/")  # ["v1", "videos", id, "content"]
+        if parts[:2] != ["v1", "videos"]:
+            return self._send_json(writer, 404, {"error": "not found"})
+        if len(parts) == 2 and method == "POST":
+            vid = f"video_{next(self._ids)}"
+            self._jobs[vid] = time.monotonic()
+            return self._send_json(writer, 200, {"id": vid, "status": "queued"})
+        if len(parts) == 3 and method == "GET":
+            return self._send_json(writer, 200, {"id": parts[2], "status": self._status(parts[2])})
+        if len(parts) == 4 and parts[3] == "content" and method == "GET":
+            return await self._send_content(writer)
+        return self._send_json(writer, 405, {"error": "method not allowed"})
+
+    def _status(self, vid: str) -> str:
+        created = self._jobs.get(vid)
+        if created is None or not self.render_time:
+            return "completed"
+        age = time.monotonic() - created
+        if age < self.render_time * 0.2:
+            return "queued"
+        if age < self.render_time:
+            return "in_progress"
+        # детерминированно по номеру задачи, чтобы доля failed не зависела от числа опросов
+        n = int(vid.rsplit("_", 1)[-1])
+        return "failed" if self.fail_rate and (n * 0.6180339887) % 1 < self.fail_rate else "completed"
+
+    def _send_json(self, writer, status: int, body: dict, extra: Tuple[str, ...] = ()):
+        data = json.dumps(body).encode()
+        self._send_head(writer, status, "application/json", len(data), extra)
+        writer.write(data)
+
+    async def _send_content(self, writer):
+        head, tail = mp4_parts(self.content_size, moov_first=self.moov_first)
+        self._send_head(writer, 200, "video/mp4", len(head) + self.content_size + len(tail))
+        writer.write(head)
+        chunk = b"\0" * (64 * 1024)
+        left = self.content_size
+        while left > 0:
+            n = min(left, len(chunk))
+            writer.write(chunk[:n])
+            await writer.drain()
+            left -= n
+        writer.write(tail)
+
+    @staticmethod
+    def _send_head(writer, status: int, ctype: str, length: int, extra: Tuple[str, ...] = ()):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Status')}",
+                 f"Content-Type: {ctype}", f"Content-Length: {length}", *extra]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
@@ -0,0 +1,82 @@
+# bench/faststart.py
+"""
+app.mp4.faststart на синтетическом MP4 с moov в конце (bench.fake_upstream.mp4_parts):
+
+    python -m bench.faststart --size-mb 64 --chunk-kb 1024
+
+Проверяет, что moov встал перед mdat, а каждое смещение из stco/co64 указывает на те же байты,
+что и в исходном файле; печатает пропускную способность и сколько байт плеер должен скачать
+до начала воспроизведения (до конца moov) — до и после.
+"""
+import argparse
+import asyncio
+import os
+import struct
+import time
+
+from .fake_upstream import mp4_parts
+
+def check(name: str, ok: bool) -> bool:
+    print(f"  [{'ok' if ok else 'FAIL'}] {name}")
+    return ok
+
+def chunk_offsets(data: bytes):
+    from app import mp4
+    for kind, fmt in ((b"stco", "I"), (b"co64", "Q")):
+        box = mp4._find(data, 0, len(data), b"moov", b"trak", b"mdia", b"minf", b"stbl", kind)
+        if box:
+            n = struct.unpack_from(">I", data, box[0] + 4)[0]
+            return struct.unpack_from(f">{n}{fmt}", data, box[0] + 8)
+    return ()
+
+def playable_after(data: bytes) -> int:
+    """Конец moov — раньше плеер не знает, где в mdat кадры."""
+    from app import mp4
+    for kind, _, end in mp4.iter_boxes(data, 0, len(data)):
+        if kind == b"moov":
+            return end
+    return len(data)
+
+async def main(args):
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    from app import mp4
+
+    size = args.size_mb * 1024 * 1024
+    head, tail = mp4_parts(size, chunks=args.samples, co64=args.co64)
+    payload = os.urandom(size)
+    src = head + payload + tail
+    step = args.chunk_kb * 1024
+
+    async def chunks():
+        for i in range(0, len(src), step):
+            yield src[i:i + step]
+
+    meta = mp4.VideoMeta()
+    t0 = time.perf_counter()
+    out = bytearray()
+    async for piece in mp4.faststart(chunks(), meta):
+        out += piece
+    wall = time.perf_counter() - t0
+    out = bytes(out)
+
+    print(f"{len(src) / 2**20:.0f} MiB, {args.chunk_kb} KiB chunks, {'co64' if args.co64 else 'stco'}")
+    good = True
+    good &= check(f"remuxed, same size ({len(out)} bytes)", meta.remuxed and len(out) == len(src))
+    good &= check("moov before mdat", [k for k, _, _ in mp4.iter_boxes(out, 0, len(out))][:3]
+                  == [b"ftyp", b"moov", b"mdat"])
+    before, after = chunk_offsets(src), chunk_offsets(out)
+    good &= check(f"{len(after)} chunk offsets point at the same bytes",
+                  len(before) == len(after) and all(src[a:a + 64] == out[b:b + 64] for a, b in zip(before, after)))
+    good &= check(f"metadata {meta.duration}s {meta.width}x{meta.height} {meta.codec}",
+                  (meta.duration, meta.width, meta.height, meta.codec) == (4.0, 1280, 720, "avc1"))
+    print(f"  throughput {len(src) / 2**20 / wall:.0f} MiB/s ({wall * 1000:.0f} ms)")
+    print(f"  bytes before playback: {playable_after(src):,} -> {playable_after(out):,}")
+    print("PASS" if good else "FAIL")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size-mb", type=int, default=64)
+    ap.add_argument("--chunk-kb", type=int, default=1024)
+    ap.add_argument("--samples", type=int, default=5000, help="число чанков в stco/co64")
+    ap.add_argument("--co64", action="store_true")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,296 @@
+# bench/loadtest.py
+"""
+Сквозной нагрузочный прогон API: приложение (uvicorn) поднимается в этом же процессе, OpenAI
+заменён bench.fake_upstream с жизненным циклом задач и настраиваемой задержкой.
+
+    python -m bench.loadtest                                   # временная SQLite
+    python -m bench.loadtest --database-url postgresql+asyncpg://... --users 50 --concurrency 50
+    python -m bench.loadtest --json before.json                # сохранить числа для сравнения
+
+Сценарии по очереди: register, login, create (POST /videos), batch (POST /videos/batch),
+poll (GET /videos, GET /videos/{id}, POST /videos/{id}/pull), download (GET /videos/{id}/file,
+после того как поллер довёл задачи до completed). По каждому эндпоинту — RPS, p50/p95/p99,
+ошибки; по сценарию — пиковый RSS процесса (сервер + генератор нагрузки).
+
+Сервер и заглушка работают в своих потоках со своими event loop, чтобы генератор нагрузки
+не делил с ними цикл. SQLite годится для сравнения «до/после» на одной машине; абсолютные
+числа — только на Postgres.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+
+from .common import summarize
+from .fake_upstream import FakeUpstream
+
+Request = Callable[[], Tuple[str, Awaitable[httpx.Response]]]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # не Linux: только пик за всё время процесса (ru_maxrss в КБ, на macOS — в байтах)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self.statuses: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self.walls: Dict[str, float] = {}
+        self.rss: Dict[str, float] = {}
+
+    async def run(self, scenario: str, requests: List[Request], concurrency: int) -> None:
+        queue = list(reversed(requests))
+        peak = rss_mb()
+        done = asyncio.Event()
+
+        async def sample():
+            nonlocal peak
+            while not done.is_set():
+                peak = max(peak, rss_mb())
+                await asyncio.sleep(0.02)
+
+        async def worker():
+            while queue:
+                name, call = queue.pop()()
+                t0 = time.perf_counter()
+                try:
+                    r = await call
+                    status = r.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                self.latencies[(scenario, name)].append((time.perf_counter() - t0) * 1000)
+                self.statuses[(scenario, name)][status] += 1
+
+        sampler = asyncio.create_task(sample())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        self.walls[scenario] = time.perf_counter() - t0
+        done.set()
+        await sampler
+        self.rss[scenario] = peak
+
+    def report(self) -> List[dict]:
+        rows = []
+        for (scenario, name), samples in self.latencies.items():
+            statuses = self.statuses[(scenario, name)]
+            errors = sum(n for st, n in statuses.items() if not (isinstance(st, int) and st < 400))
+            rows.append({"scenario": scenario, "endpoint": name, **summarize(samples),
+                         "rps": len(samples) / self.walls[scenario] if self.walls[scenario] else 0.0,
+                         "errors": errors, "statuses": {str(k): v for k, v in statuses.items()},
+                         "peak_rss_mb": self.rss[scenario]})
+        return rows
+
+def print_report(rows: List[dict]) -> None:
+    print(f"{'scenario':<10} {'endpoint':<28} {'n':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'rss MB':>7}")
+    for r in rows:
+        print(f"{r['scenario']:<10} {r['endpoint']:<28} {r['n']:>6} {r['rps']:>8.1f} {r['p50']:>8.1f} "
+              f"{r['p95']:>8.1f} {r['p99']:>8.1f} {r['errors']:>5} {r['peak_rss_mb']:>7.0f}")
+        bad = {k: v for k, v in r["statuses"].items() if not k.startswith(("1", "2", "3"))}
+        if bad:
+            print(f"{'':<39} errors: {bad}")
+
+class Threaded:
+    """Корутины заглушки — в отдельном потоке со своим loop."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+async def wait_completed(client: httpx.AsyncClient, jobs: List[Tuple[str, dict]], timeout: float) -> List[Tuple[str, dict]]:
+    deadline = time.monotonic() + timeout
+    done: Dict[str, Tuple[str, dict]] = {}
+    while time.monotonic() < deadline and len(done) < len(jobs):
+        for job_id, headers in jobs:
+            if job_id in done:
+                continue
+            r = await client.get(f"/videos/{job_id}", headers=headers)
+            if r.status_code == 200 and r.json()["status"] in ("completed", "failed"):
+                if r.json()["status"] == "completed":
+                    done[job_id] = (job_id, headers)
+                else:
+                    done[job_id] = None
+        await asyncio.sleep(0.2)
+    return [d for d in done.values() if d]
+
+async def scenarios(args, base_url: str, rec: Recorder) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency + 5, max_keepalive_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        run = uuid.uuid4().hex[:6]
+        creds = [{"email": f"load-{run}-{i}@example.com", "password": "load-password"} for i in range(args.users)]
+        tokens: List[dict] = [None] * args.users
+
+        def register(i):
+            async def go():
+                r = await client.post("/auth/register", json=creds[i])
+                if r.status_code == 201:
+                    tokens[i] = {"Authorization": f"Bearer {r.json()['access_token']}"}
+                return r
+            return lambda: ("POST /auth/register", go())
+
+        await rec.run("register", [register(i) for i in range(args.users)], args.concurrency)
+        users = [t for t in tokens if t]
+        if not users:
+            raise RuntimeError("no users registered")
+        await rec.run("login", [lambda i=i: ("POST /auth/login", client.post("/auth/login", json=creds[i % args.users]))
+                                for i in range(args.logins)], args.concurrency)
+
+        jobs: List[Tuple[str, dict]] = []
+
+        def create(i):
+            h = users[i % len(users)]
+
+            async def go():
+                r = await client.post("/videos", json={"prompt": f"load {run} {i}", "seconds": 4}, headers=h)
+                if r.status_code == 201:
+                    jobs.append((r.json()["id"], h))
+                return r
+            return lambda: ("POST /videos", go())
+
+        await rec.run("create", [create(i) for i in range(args.creates)], args.concurrency)
+
+        def batch(i):
+            h = users[i % len(users)]
+
+            async def go():
+                r = await client.post("/videos/batch", json={"prompt": f"batch {run} {i}", "seconds": 4,
+                                                             "styles": ["default", "80s", "none"]}, headers=h)
+                if r.status_code == 201:
+                    jobs.extend((it["id"], h) for it in r.json()["items"])
+                return r
+            return lambda: ("POST /videos/batch", go())
+
+        await rec.run("batch", [batch(i) for i in range(args.batches)], args.concurrency)
+        if not jobs:
+            raise RuntimeError("no jobs created")
+
+        poll: List[Request] = []
+        for i in range(args.polls):
+            job_id, h = jobs[i % len(jobs)]
+            kind = i % 3
+            if kind == 0:
+                poll.append(lambda job_id=job_id, h=h: ("GET /videos/{id}", client.get(f"/videos/{job_id}", headers=h)))
+            elif kind == 1:
+                poll.append(lambda job_id=job_id, h=h: ("POST /videos/{id}/pull",
+                                                        client.post(f"/videos/{job_id}/pull", headers=h)))
+            else:
+                poll.append(lambda h=h: ("GET /videos", client.get("/videos", params={"limit": 50}, headers=h)))
+        await rec.run("poll", poll, args.concurrency)
+
+        t0 = time.perf_counter()
+        ready = await wait_completed(client, jobs, args.complete_timeout)
+        print(f"{len(ready)}/{len(jobs)} jobs completed {time.perf_counter() - t0:.1f}s after the poll storm")
+        if ready:
+            async def download(job_id, h):
+                # читаем тело целиком, но не держим его в памяти генератора
+                async with client.stream("GET", f"/videos/{job_id}/file", headers=h) as r:
+                    async for _ in r.aiter_raw(1 << 16):
+                        pass
+                    return r
+
+            await rec.run("download", [lambda i=i: ("GET /videos/{id}/file", download(*ready[i % len(ready)]))
+                                       for i in range(args.downloads)], args.concurrency)
+
+def main(args):
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    # настройки читаются при импорте app.*, поэтому окружение — до него
+    os.environ.update(
+        DATABASE_URL=args.database_url or f"sqlite+aiosqlite:///{tmp}/load.db",
+        STORAGE_BACKEND="local", STORAGE_LOCAL_PATH=os.path.join(tmp, "videos"),
+        OPENAI_API_KEY="load", DEBUG="false", WELCOME_CREDITS="1000000",
+        POLLER_ENABLED="true", POLLER_IN_APP="true", POLLER_IDLE_SLEEP="0.2",
+        POLLER_MIN_INTERVAL="0.2", POLLER_MAX_INTERVAL="1", POLLER_RENDER_FACTOR=str(args.render_time / 8),
+        SCHEDULER_USER_INFLIGHT="1000", SCHEDULER_PRIORITY_INFLIGHT="1000",
+        # меряем приложение, а не собственные лимиты допуска к OpenAI
+        UPSTREAM_CREATE_RPS="0", UPSTREAM_STATUS_RPS="0", UPSTREAM_CONTENT_RPS="0",
+        UPSTREAM_CREATE_CONCURRENCY="0", UPSTREAM_STATUS_CONCURRENCY="0", UPSTREAM_CONTENT_CONCURRENCY="0",
+    )
+    bg = Threaded()
+    up = FakeUpstream(latency=args.upstream_latency, content_size=args.content_size, render_time=args.render_time)
+    bg.call(up.start())
+    os.environ["OPENAI_BASE_URL"] = up.base_url
+
+    import uvicorn
+    from app import migrate
+    from app.database import engine
+    from app.main import app
+    # по строке лога на запрос — заметная доля CPU и шум в выводе
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def prepare():
+        await migrate.upgrade()
+        # соединения пула привязаны к loop — серверу достанутся новые
+        await engine.dispose()
+    asyncio.run(prepare())
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("server failed to start")
+        time.sleep(0.02)
+
+    rec = Recorder()
+    try:
+        asyncio.run(scenarios(args, f"http://127.0.0.1:{port}", rec))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        bg.call(up.stop())
+        bg.stop()
+    rows = rec.report()
+    print_report(rows)
+    print(f"upstream: {up.requests} requests, {up.connections} connections")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--database-url", default=None, help="по умолчанию — временная SQLite")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--logins", type=int, default=100)
+    ap.add_argument("--creates", type=int, default=200)
+    ap.add_argument("--batches", type=int, default=50)
+    ap.add_argument("--polls", type=int, default=2000)
+    ap.add_argument("--downloads", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--upstream-latency", type=float, default=0.05, help="сек на каждый ответ заглушки")
+    ap.add_argument("--render-time", type=float, default=2.0, help="сек от создания до completed в заглушке")
+    ap.add_argument("--content-size", type=int, default=2 << 20)
+    ap.add_argument("--complete-timeout", type=float, default=120.0)
+    ap.add_argument("--json", default=None, help="сохранить результаты в файл")
+    main(ap.parse_args())
@@ -0,0 +1,67 @@
+# bench/login_health.py
+"""
+Задержка /health во время всплеска логинов (pbkdf2). Запускать против поднятого API:
+
+    python -m bench.login_health --url http://localhost:8000 --logins 200 --concurrency 50
+
+Пока pbkdf2 считался прямо в event loop, /health ждал каждый хэш; с пулом p95 /health
+должен оставаться на уровне холостого хода, а лишние логины получают 429.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+from .common import summarize
+
+async def probe_health(client: httpx.AsyncClient, stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await client.get("/health")
+        samples.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(0.01)
+
+async def main(args):
+    creds = {"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "bench-password"}
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        r = await client.post("/auth/register", json=creds)
+        r.raise_for_status()
+
+        idle = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe_health(client, stop, idle))
+        await asyncio.sleep(1.0)
+        stop.set()
+        await task
+
+        loaded, statuses = [], Counter()
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def login():
+            async with sem:
+                resp = await client.post("/auth/login", json=creds)
+                statuses[resp.status_code] += 1
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe_health(client, stop, loaded))
+        t0 = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        wall = time.perf_counter() - t0
+        stop.set()
+        await task
+
+    for name, samples in (("idle", idle), ("under logins", loaded)):
+        s = summarize(samples)
+        print(f"/health {name:>13}: n={s['n']:<5} p50={s['p50']:.2f}ms p95={s['p95']:.2f}ms p99={s['p99']:.2f}ms")
+    print(f"logins: {dict(statuses)} in {wall:.2f}s ({args.logins / wall:.1f}/s)")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--logins", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,83 @@
+# bench/pagination.py
+"""
+Миллион video_jobs у одного пользователя: старый «весь список» против keyset-страницы.
+Нужен Postgres (generate_series), берётся DATABASE_URL из окружения/.env:
+
+    python -m bench.pagination --rows 1000000 --limit 50
+
+Строки создаются под отдельным пользователем и удаляются в конце (ON DELETE CASCADE).
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import select, text
+
+from app import models
+from app.database import SessionLocal
+from app.pagination import encode_cursor, keyset, split_page
+
+async def timed(db, stmt, repeat: int):
+    best = float("inf")
+    rows = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = (await db.execute(stmt)).scalars().all()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, rows
+
+async def main(args):
+    J = models.VideoJob
+    uid = uuid.uuid4()
+    async with SessionLocal() as db:
+        t0 = time.perf_counter()
+        await db.execute(text("INSERT INTO users (id, email, password_hash, credits, is_admin) "
+                              "VALUES (:id, :email, 'x', 0, false)"),
+                         {"id": uid, "email": f"bench-{uid.hex[:8]}@example.com"})
+        await db.execute(text(
+            "INSERT INTO video_jobs (id, user_id, prompt, style, model, size, seconds, status, cost_credits, created_at, updated_at) "
+            "SELECT gen_random_uuid(), :uid, 'bench prompt ' || g, 'default', 'sora-2', '1280x720', 4, "
+            "       (ARRAY['queued','processing','completed','failed'])[1 + g % 4], 80, "
+            "       now() - g * interval '1 second', now() "
+            "FROM generate_series(1, :n) AS g"), {"uid": uid, "n": args.rows})
+        await db.commit()
+        await db.execute(text("ANALYZE video_jobs"))
+        print(f"generated {args.rows} rows in {time.perf_counter() - t0:.1f}s")
+
+        try:
+            base = select(J).where(J.user_id == uid)
+            ms, rows = await timed(db, base.order_by(J.created_at.desc()), 1)
+            print(f"{'full list (old)':>28}: {ms:9.1f} ms, {len(rows)} rows")
+
+            ms, rows = await timed(db, keyset(base, J.created_at, J.id, None, args.limit), args.repeat)
+            page, cursor = split_page(rows, args.limit)
+            print(f"{'keyset first page':>28}: {ms:9.3f} ms, {len(page)} rows")
+
+            # курсор из глубины — время не должно зависеть от номера страницы
+            mid = (await db.execute(select(J.created_at, J.id).where(J.user_id == uid)
+                                    .order_by(J.created_at.desc(), J.id.desc())
+                                    .offset(args.rows // 2).limit(1))).one()
+            deep = encode_cursor(mid.created_at, mid.id)
+            ms, rows = await timed(db, keyset(base, J.created_at, J.id, deep, args.limit), args.repeat)
+            print(f"{'keyset page at 50%':>28}: {ms:9.3f} ms, {len(rows[:args.limit])} rows")
+
+            filtered = base.where(J.status.in_([models.JobStatus.failed]))
+            ms, rows = await timed(db, keyset(filtered, J.created_at, J.id, None, args.limit), args.repeat)
+            print(f"{'keyset, status=failed':>28}: {ms:9.3f} ms, {len(rows[:args.limit])} rows")
+
+            plan = await db.execute(text(
+                "EXPLAIN ANALYZE SELECT * FROM video_jobs WHERE user_id = :uid "
+                "ORDER BY created_at DESC, id DESC LIMIT :n"), {"uid": uid, "n": args.limit + 1})
+            print("\n".join(r[0] for r in plan))
+        finally:
+            await db.rollback()
+            await db.execute(text("DELETE FROM users WHERE id = :id"), {"id": uid})
+            await db.commit()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--limit", type=int, default=50)
+    ap.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,138 @@
+# bench/pool_usage.py
+"""
+Соединения с БД во время медленного OpenAI: N задач одновременно ждут ответа заглушки
+(--latency на каждый запрос), а число занятых соединений пула должно оставаться около нуля.
+
+    python -m bench.pool_usage --jobs 40 --latency 0.5
+    python -m bench.pool_usage --database-url postgresql+asyncpg://...   # миграции уже применены
+
+Сценарии: submit (scheduler.dispatch_once), pull (POST /videos/{id}/pull при выключенном поллере,
+ASGI-клиент в этом же процессе), poll (poller.poll_once). Занятые соединения считаются по событиям
+checkout/checkin пула и сэмплируются, пока у заглушки есть запросы в работе.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from typing import List
+
+from .fake_upstream import FakeUpstream
+
+class PoolGauge:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.out = 0
+        event.listen(engine.sync_engine, "checkout", self._checkout)
+        event.listen(engine.sync_engine, "checkin", self._checkin)
+
+    def _checkout(self, *_):
+        self.out += 1
+
+    def _checkin(self, *_):
+        self.out -= 1
+
+async def measure(name: str, coro, gauge: PoolGauge, up: FakeUpstream, jobs: int) -> bool:
+    """Гоняет coro и сэмплирует занятые соединения, пока заглушка держит хоть один запрос."""
+    samples: List[int] = []
+    peak_up = 0
+    task = asyncio.ensure_future(coro)
+    t0 = time.perf_counter()
+    while not task.done():
+        if up.inflight:
+            samples.append(gauge.out)
+            peak_up = max(peak_up, up.inflight)
+        await asyncio.sleep(0.005)
+    await task
+    wall = time.perf_counter() - t0
+    mean = sum(samples) / len(samples) if samples else 0.0
+    peak = max(samples, default=0)
+    # пока N вызовов ждут OpenAI, соединения заняты только на короткие запросы до/после
+    ok = peak_up >= jobs // 2 and mean <= max(1.0, jobs / 10)
+    print(f"  [{'ok' if ok else 'FAIL'}] {name:<7} upstream in flight peak {peak_up:>3}, "
+          f"db connections mean {mean:.2f} / peak {peak} ({len(samples)} samples, {wall:.2f}s)")
+    return ok
+
+async def main(args):
+    tmp = tempfile.mkdtemp(prefix="pool-")
+    n = str(args.jobs)
+    # настройки читаются при импорте app.*, поэтому окружение — до него
+    os.environ.update(
+        DATABASE_URL=args.database_url or f"sqlite+aiosqlite:///{tmp}/pool.db",
+        STORAGE_BACKEND="local", STORAGE_LOCAL_PATH=os.path.join(tmp, "videos"),
+        OPENAI_API_KEY="bench", DEBUG="false", POLLER_ENABLED="false", SCHEDULER_IN_APP="false",
+        DB_POOL_SIZE=n, DB_MAX_OVERFLOW=n,
+        SCHEDULER_BATCH_SIZE=n, SCHEDULER_SCAN_SIZE=n, SCHEDULER_SUBMIT_CONCURRENCY=n,
+        SCHEDULER_USER_INFLIGHT=str(2 * args.jobs), SCHEDULER_PRIORITY_INFLIGHT=str(2 * args.jobs),
+        POLLER_BATCH_SIZE=n, POLLER_CONCURRENCY=n,
+        UPSTREAM_CREATE_RPS="0", UPSTREAM_STATUS_RPS="0", UPSTREAM_CONTENT_RPS="0",
+        UPSTREAM_CREATE_CONCURRENCY="0", UPSTREAM_STATUS_CONCURRENCY="0", UPSTREAM_CONTENT_CONCURRENCY="0",
+    )
+    async with FakeUpstream(latency=args.latency, content_size=args.content_size) as up:
+        os.environ["OPENAI_BASE_URL"] = up.base_url
+        import httpx
+        from sqlalchemy import update
+
+        from app import migrate, models, openai_client, poller, scheduler
+        from app.auth import create_access_token
+        from app.database import SessionLocal, engine
+        from app.main import app
+
+        if not args.database_url:
+            await migrate.upgrade()
+        gauge = PoolGauge(engine)
+        J = models.VideoJob
+
+        async with SessionLocal() as db:
+            user = models.User(email=f"pool-{uuid.uuid4().hex[:8]}@example.com", password_hash="-", credits=0)
+            db.add(user)
+            await db.flush()
+
+            async def add_jobs() -> List[uuid.UUID]:
+                batch = [J(user_id=user.id, prompt=f"pool {i}", seconds=4, status=models.JobStatus.queued)
+                         for i in range(args.jobs)]
+                await scheduler.enqueue(db, user.id, False, batch)
+                db.add_all(batch)
+                await db.commit()
+                return [j.id for j in batch]
+
+            first = await add_jobs()
+            second = await add_jobs()
+            token = create_access_token(str(user.id))
+
+        print(f"{args.jobs} jobs, {args.latency:.2f}s per upstream request, {engine.dialect.name}")
+        good = True
+        # обе пачки уходят в OpenAI; вторую сразу делаем «пора опрашивать» для поллера
+        good &= await measure("submit", scheduler.dispatch_once(), gauge, up, args.jobs)
+        await scheduler.dispatch_once()
+        async with SessionLocal() as db:
+            await db.execute(update(J).where(J.id.in_(second)).values(next_poll_at=None))
+            await db.commit()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60,
+                                     headers={"Authorization": f"Bearer {token}"}) as client:
+            async def pull_all():
+                rs = await asyncio.gather(*(client.post(f"/videos/{i}/pull") for i in first))
+                bad = [r.status_code for r in rs if r.status_code != 200]
+                if bad:
+                    raise RuntimeError(f"pull failed: {bad[:5]}")
+            good &= await measure("pull", pull_all(), gauge, up, args.jobs)
+        good &= await measure("poll", poller.poll_once(), gauge, up, args.jobs)
+
+        async with SessionLocal() as db:
+            done = (await db.execute(J.__table__.select().where(J.status == models.JobStatus.completed))).all()
+        good &= len(done) == 2 * args.jobs
+        print(f"  completed {len(done)} / {2 * args.jobs}")
+        print("PASS" if good else "FAIL")
+        await openai_client.close_client()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=40)
+    ap.add_argument("--latency", type=float, default=0.5, help="сек на каждый запрос к заглушке OpenAI")
+    ap.add_argument("--content-size", type=int, default=256 * 1024)
+    ap.add_argument("--database-url", default=None)
+    asyncio.run(main(ap.parse_args()))
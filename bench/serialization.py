@@ -0,0 +1,103 @@
+# bench/serialization.py
+"""
+Цена ответа GET /videos на тысячу строк: ORM-сущности + pydantic (from_attributes) + json.dumps
+против select нужных колонок + app.serialize (orjson) и против sparse fieldset.
+
+    python -m bench.serialization --rows 1000 --repeat 20
+    python -m bench.serialization --database-url postgresql+asyncpg://...   # миграции уже применены
+
+Отдельно — выборка (execute + разбор строк) и сериализация (до готовых байт ответа), мс на 1000 строк.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from .common import summarize
+
+LONG_PROMPT = ("Modern 2D anime painterly: visible brushstrokes, textured backgrounds, clear hand-drawn lineart, "
+               "precise facial details, glossy expressive eyes; soft but defined shading. ") * 3
+
+async def main(args):
+    tmp = tempfile.mkdtemp(prefix="ser-")
+    os.environ.update(DATABASE_URL=args.database_url or f"sqlite+aiosqlite:///{tmp}/ser.db",
+                      OPENAI_API_KEY="bench", DEBUG="false")
+    from sqlalchemy import delete, select
+    from starlette.responses import JSONResponse
+
+    from app import migrate, models, schemas, scheduler, serialize
+    from app.database import SessionLocal, engine
+
+    if not args.database_url:
+        await migrate.upgrade()
+    J = models.VideoJob
+    user_id = uuid.uuid4()
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        db.add(models.User(id=user_id, email=f"ser-{user_id.hex[:8]}@example.com", password_hash="-"))
+        db.add_all([J(user_id=user_id, prompt=f"{LONG_PROMPT}{i}", style="modern", openai_id=f"video_{i}",
+                      status=models.JobStatus.completed, cost_credits=4, file_path=f"/data/{i}.mp4",
+                      duration=4.0, width=1280, height=720, codec="avc1", group_id=uuid.uuid4(),
+                      created_at=now - timedelta(seconds=i), updated_at=now)
+                    for i in range(args.rows)])
+        await db.commit()
+
+    async def orm_path():
+        async with SessionLocal() as db:
+            t0 = time.perf_counter()
+            items = (await db.execute(select(J).where(J.user_id == user_id).limit(args.rows))).scalars().all()
+            await scheduler.annotate(db, items)
+            t1 = time.perf_counter()
+            # то, что делает FastAPI с response_model: валидация, dump в JSON-типы, json.dumps
+            content = schemas.VideoListOut.model_validate({"items": items}).model_dump(mode="json")
+            JSONResponse(content).body
+            return t1 - t0, time.perf_counter() - t1
+
+    def rows_path(fields):
+        names = serialize.fieldset(schemas.VideoOut, fields)
+        need = ["id", "created_at", *names]
+        if "queue_position" in names:
+            need += ["status", "openai_id", "source_job_id", "queue_tag"]
+
+        async def run():
+            async with SessionLocal() as db:
+                t0 = time.perf_counter()
+                rows = (await db.execute(select(*serialize.columns(J, need))
+                                         .where(J.user_id == user_id).limit(args.rows))).all()
+                extra = {"queue_position": await scheduler.queue_positions(db, rows)} if "queue_position" in names else None
+                t1 = time.perf_counter()
+                serialize.FastJSONResponse({"items": serialize.rows_to_dicts(rows, names, extra), "next_cursor": None}).body
+                return t1 - t0, time.perf_counter() - t1
+        return run
+
+    variants = [("orm + pydantic + json", orm_path),
+                (f"rows + {'orjson' if serialize.orjson else 'json'}", rows_path(None)),
+                ("rows, fields=id,status,file_url", rows_path("id,status,file_url"))]
+    per = 1000 / args.rows
+    print(f"{args.rows} rows, {args.repeat} runs, {engine.dialect.name}; ms per 1000 rows (p50)")
+    print(f"  {'variant':<34} {'fetch':>8} {'serialize':>10} {'total':>8}")
+    for name, fn in variants:
+        await fn()  # прогрев
+        fetch, ser = [], []
+        for _ in range(args.repeat):
+            f, s = await fn()
+            fetch.append(f * 1000 * per)
+            ser.append(s * 1000 * per)
+        f50, s50 = summarize(fetch)["p50"], summarize(ser)["p50"]
+        print(f"  {name:<34} {f50:8.1f} {s50:10.1f} {f50 + s50:8.1f}")
+
+    async with SessionLocal() as db:
+        await db.execute(delete(J).where(J.user_id == user_id))
+        await db.execute(delete(models.User).where(models.User.id == user_id))
+        await db.commit()
+    await engine.dispose()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--database-url", default=None)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,101 @@
+# bench/startup.py
+"""
+Холодный старт воркера: время `import app.main` в свежем интерпретаторе и время от запуска
+uvicorn до первого 200 на /health. Важно при автоскейлинге — новые реплики должны быстро принимать трафик.
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --database-url postgresql+asyncpg://...   # против реальной БД (миграции уже применены)
+
+По умолчанию — временная SQLite и локальное хранилище, без OpenAI и без поллера.
+Печатает самые тяжёлые модули (-X importtime) и проверяет, что boto3 не грузится при STORAGE_BACKEND=local.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from .common import summarize
+
+IMPORT_SNIPPET = ("import sys, time; t = time.perf_counter(); import app.main; "
+                  "print(time.perf_counter() - t, 'boto3' in sys.modules)")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def time_import(env: dict):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True, check=True)
+    seconds, boto = out.stdout.split()
+    return float(seconds) * 1000, boto == "True"
+
+def top_imports(env: dict, n: int):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                         env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:   # только прямые импорты app.* и их первый уровень
+            rows.append((int(parts[1]) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+def time_to_healthy(env: dict, timeout: float) -> float:
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited: {proc.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as r:
+                    if r.status == 200:
+                        return (time.perf_counter() - t0) * 1000
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"/health not ready after {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+def main(args):
+    tmp = tempfile.mkdtemp(prefix="startup-")
+    env = dict(os.environ, STORAGE_BACKEND="local", STORAGE_LOCAL_PATH=os.path.join(tmp, "videos"),
+               OPENAI_API_KEY="bench", POLLER_ENABLED="false", SCHEDULER_IN_APP="false", DEBUG="false",
+               DATABASE_URL=args.database_url or f"sqlite+aiosqlite:///{tmp}/startup.db")
+    if not args.database_url:
+        # схема — как при выкате: migrate отдельно, воркер только сверяет ревизию
+        subprocess.run([sys.executable, "-m", "app.migrate"], env=env, check=True, capture_output=True)
+
+    imports, boto = [], False
+    for _ in range(args.runs):
+        ms, loaded = time_import(env)
+        imports.append(ms)
+        boto |= loaded
+    s = summarize(imports)
+    print(f"import app.main:   p50 {s['p50']:.0f} ms, max {max(imports):.0f} ms ({s['n']} runs)")
+    print(f"boto3 loaded with local storage: {'yes (FAIL)' if boto else 'no'}")
+    for ms, name in top_imports(env, args.top):
+        print(f"    {ms:7.1f} ms  {name}")
+
+    ready = [time_to_healthy(env, args.timeout) for _ in range(args.runs)]
+    s = summarize(ready)
+    print(f"spawn -> /health:  p50 {s['p50']:.0f} ms, max {max(ready):.0f} ms ({s['n']} runs)")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=10, help="сколько самых тяжёлых импортов показать")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--database-url", default=None)
+    main(ap.parse_args())
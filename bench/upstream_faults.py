@@ -0,0 +1,116 @@
+# bench/upstream_faults.py
+"""
+Поведение app.openai_client при троттлинге и сбоях OpenAI — против локальной заглушки,
+которая отдаёт 429/5xx по сценарию (bench.fake_upstream.inject / down):
+
+    python -m bench.upstream_faults
+
+Проверяет: повтор 429 с учётом Retry-After, отсутствие повтора POST на 5xx, повтор GET на 5xx,
+размыкание breaker (дальше — отказ без запроса в upstream), пробный запрос после cooldown,
+лимит запросов/сек и параллельности.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from .fake_upstream import FakeUpstream
+
+def check(name: str, ok: bool) -> bool:
+    print(f"  [{'ok' if ok else 'FAIL'}] {name}")
+    return ok
+
+async def main(args):
+    # настройки читаются при импорте app.*, поэтому окружение — до него
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.update(UPSTREAM_BACKOFF_BASE="0.05", UPSTREAM_BACKOFF_MAX="0.2", UPSTREAM_RETRIES="3",
+                      UPSTREAM_BREAKER_THRESHOLD="5", UPSTREAM_BREAKER_COOLDOWN=str(args.cooldown),
+                      UPSTREAM_STATUS_RPS=str(args.rps), UPSTREAM_STATUS_CONCURRENCY=str(args.concurrency))
+    async with FakeUpstream(latency=0.05) as up:
+        os.environ["OPENAI_BASE_URL"] = up.base_url
+        import httpx
+        from app import metrics, openai_client, ratelimit
+
+        good = True
+        print("429 with Retry-After")
+        up.reset_counters()
+        up.inject(429, count=2, retry_after=0.5)
+        t0 = time.perf_counter()
+        info = await openai_client.get_video("video_1")
+        wall = time.perf_counter() - t0
+        good &= check(f"succeeds after 2 retries ({dict(up.statuses)})", info["status"] == "completed"
+                      and up.statuses[429] == 2)
+        good &= check(f"waited for Retry-After ({wall:.2f}s >= 1.0s)", wall >= 1.0)
+
+        print("5xx on POST is not retried")
+        up.reset_counters()
+        up.inject(500)
+        try:
+            await openai_client.create_video("prompt")
+            ok = False
+        except httpx.HTTPStatusError as e:
+            ok = e.response.status_code == 500
+        good &= check(f"one request, error surfaced ({up.requests} request)", ok and up.requests == 1)
+
+        print("5xx on GET is retried")
+        up.reset_counters()
+        up.inject(503, count=2)
+        info = await openai_client.get_video("video_1")
+        good &= check(f"succeeds on 3rd attempt ({up.requests} requests)", up.requests == 3)
+
+        print("circuit breaker")
+        up.reset_counters()
+        up.down = 503
+        for _ in range(3):
+            try:
+                await openai_client.get_video("video_1")
+            except (httpx.HTTPStatusError, ratelimit.UpstreamUnavailable):
+                pass
+        sent = up.requests
+        good &= check(f"opened after {ratelimit.breaker.threshold} failures", ratelimit.breaker.state == ratelimit.breaker.OPEN)
+        t0 = time.perf_counter()
+        try:
+            await openai_client.get_video("video_1")
+            ok = False
+        except ratelimit.UpstreamUnavailable as e:
+            ok = e.reason == "circuit_open"
+        good &= check(f"fails fast while open ({(time.perf_counter() - t0) * 1000:.1f} ms, no request sent)",
+                      ok and up.requests == sent)
+        up.down = None
+        await asyncio.sleep(args.cooldown + 0.1)
+        await openai_client.get_video("video_1")
+        good &= check("closes after a successful probe", ratelimit.breaker.state == ratelimit.breaker.CLOSED)
+
+        print(f"limits: {args.rps} req/s, {args.concurrency} in flight")
+        up.reset_counters()
+        peak = 0
+
+        async def one():
+            nonlocal peak
+            task = asyncio.create_task(openai_client.get_video("video_1"))
+            while not task.done():
+                peak = max(peak, ratelimit.limiters["get_video"].inflight)
+                await asyncio.sleep(0.005)
+            await task
+
+        n = int(args.rps * 3)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n)))
+        wall = time.perf_counter() - t0
+        expected = (n - args.rps) / args.rps  # первая секунда — из запаса (burst)
+        good &= check(f"{n} calls took {wall:.2f}s (>= {expected:.2f}s)", wall >= expected * 0.95)
+        good &= check(f"peak in flight {peak} <= {args.concurrency}", peak <= args.concurrency)
+
+        print()
+        for line in metrics.render().splitlines():
+            if line.startswith(("upstream_retries_total", "upstream_rejected_total", "upstream_circuit")):
+                print(line)
+        print("PASS" if good else "FAIL")
+        await openai_client.close_client()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rps", type=float, default=20)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--cooldown", type=float, default=1.0)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,64 @@
+# bench/upstream_pool.py
+"""
+Сравнение: новый httpx.AsyncClient на каждый запрос (как было) против общего пула
+из app.openai_client. Гоняет get_video против локальной заглушки.
+
+    python -m bench.upstream_pool --requests 500 --concurrency 20 --latency 0.005
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from .common import summarize
+from .fake_upstream import FakeUpstream
+
+async def _run(call, total: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i: int):
+        async with sem:
+            t0 = time.perf_counter()
+            await call(f"video_{i}")
+            samples.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return samples, time.perf_counter() - t0
+
+async def main(args):
+    async with FakeUpstream(latency=args.latency) as up:
+        os.environ["OPENAI_BASE_URL"] = up.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        # лимитеры допуска (app/ratelimit.py) выключены: меряем пул соединений, а не их
+        os.environ.update(UPSTREAM_CREATE_RPS="0", UPSTREAM_STATUS_RPS="0", UPSTREAM_CONTENT_RPS="0",
+                          UPSTREAM_CREATE_CONCURRENCY="0", UPSTREAM_STATUS_CONCURRENCY="0",
+                          UPSTREAM_CONTENT_CONCURRENCY="0")
+        from app import openai_client  # импортируем после подмены BASE_URL
+
+        async def per_request_client(vid: str):
+            async with httpx.AsyncClient(base_url=up.base_url, timeout=60) as client:
+                r = await client.get(f"/videos/{vid}")
+                r.raise_for_status()
+
+        await openai_client.init_client()
+        try:
+            for name, call in (("per-request client", per_request_client),
+                               ("shared pool", openai_client.get_video)):
+                up.reset_counters()
+                samples, wall = await _run(call, args.requests, args.concurrency)
+                s = summarize(samples)
+                print(f"{name:>20}: connections={up.connections:<5} rps={args.requests / wall:8.1f} "
+                      f"p50={s['p50']:.2f}ms p95={s['p95']:.2f}ms p99={s['p99']:.2f}ms")
+        finally:
+            await openai_client.close_client()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--latency", type=float, default=0.005, help="задержка заглушки, сек")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,45 @@
+# tests/conftest.py
+"""
+Общие фикстуры: SQLite во временном каталоге (настройки читаются при импорте app, поэтому
+окружение задаётся до него), схема из моделей, ASGI-клиент без поллера и диспетчера.
+
+    pip install -r requirements-dev.txt && python -m pytest -q
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="storycraft-tests-")
+os.environ.update(DATABASE_URL=f"sqlite+aiosqlite:///{_tmp}/test.db", STORAGE_LOCAL_PATH=f"{_tmp}/videos",
+                  OPENAI_API_KEY="test", OPENAI_BASE_URL="http://127.0.0.1:9/v1", DEBUG="false",
+                  POLLER_ENABLED="false", SCHEDULER_IN_APP="false", EVENTS_ENABLED="false")
+
+import httpx
+import pytest
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def db_schema():
+    from app import models
+    from app.database import engine
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+    yield
+    await engine.dispose()
+
+@pytest.fixture
+async def client(db_schema):
+    from app.main import app
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+            yield c
+
+@pytest.fixture
+async def auth(client):
+    """Заголовок Authorization нового пользователя."""
+    r = await client.post("/auth/register", json={"email": "user@example.com", "password": "secret1"})
+    assert r.status_code == 201, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
@@ -0,0 +1,12 @@
+# tests/test_batch.py
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+async def test_batch_reports_job_status_not_results(client, auth):
+    r = await client.post("/videos/batch", json={"prompt": "dog", "seconds": 4, "styles": ["80s"]}, headers=auth)
+    assert r.status_code == 201, r.text
+    body = r.json()
+    # батч только ставит в очередь: успех отправки ещё неизвестен, поэтому и results нет
+    assert "results" not in body
+    assert [(j["status"], j["group_id"]) for j in body["items"]] == [("queued", body["group_id"])]
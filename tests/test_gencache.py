@@ -0,0 +1,46 @@
+# tests/test_gencache.py
+import pytest
+from sqlalchemy import select
+
+from app import gencache, models
+from app.database import SessionLocal
+from app.storage import get_storage
+
+pytestmark = pytest.mark.anyio
+
+async def _source(file_path: str) -> models.VideoJob:
+    async with SessionLocal() as db:
+        user = models.User(email=f"{file_path[-12:]}@example.com", password_hash="-")
+        db.add(user)
+        await db.flush()
+        job = models.VideoJob(user_id=user.id, prompt="p", status=models.JobStatus.completed,
+                              request_hash=gencache.request_hash("p", "sora-2", "1280x720", 4),
+                              file_path=file_path, openai_id="video_1")
+        db.add(job)
+        await db.commit()
+        return job
+
+async def _reuse_count(job_id) -> int:
+    async with SessionLocal() as db:
+        return (await db.execute(select(models.VideoJob.reuse_count).where(models.VideoJob.id == job_id))).scalar_one()
+
+async def test_rejected_source_keeps_reuse_count(db_schema, tmp_path):
+    # плоский файл (до переноса в objects/) не переиспользуется и не тратит GENERATION_CACHE_MAX_HITS
+    flat = tmp_path / "legacy.mp4"
+    flat.write_bytes(b"mp4")
+    src = await _source(str(flat))
+    async with SessionLocal() as db:
+        assert await gencache.lookup(db, src.request_hash) is None
+        await db.commit()
+    assert await _reuse_count(src.id) == 0
+
+async def test_hit_counts_reuse(db_schema):
+    path = get_storage().object_path("ab" * 32)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"mp4")
+    src = await _source(str(path))
+    async with SessionLocal() as db:
+        row = await gencache.lookup(db, src.request_hash)
+        await db.commit()
+    assert row is not None and row.id == src.id
+    assert await _reuse_count(src.id) == 1
@@ -0,0 +1,20 @@
+# tests/test_metrics.py
+import re
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+def _sample(text: str, series: str) -> float:
+    m = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    return float(m.group(1)) if m else 0.0
+
+async def test_auth_cache_series(client, auth):
+    before = (await client.get("/metrics")).text
+    for _ in range(3):
+        assert (await client.get("/me", headers=auth)).status_code == 200
+    text = (await client.get("/metrics")).text
+    hit = 'cache_lookups_total{cache="auth_token",result="hit"}'
+    assert _sample(text, hit) - _sample(before, hit) >= 2
+    assert _sample(text, 'cache_entries{cache="auth_token"}') >= 1
+    assert _sample(text, 'cache_entries{cache="auth_principal"}') >= 1
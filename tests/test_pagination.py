@@ -0,0 +1,58 @@
+# tests/test_pagination.py
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from app import models
+from app.database import SessionLocal
+
+pytestmark = pytest.mark.anyio
+
+async def _user_id():
+    async with SessionLocal() as db:
+        return (await db.execute(select(models.User.id))).scalar_one()
+
+async def test_videos_pages_through_all_rows(client, auth):
+    # created_at — серверный func.now(): у всех строк одна секунда, порядок решает id
+    uid = await _user_id()
+    async with SessionLocal() as db:
+        db.add_all([models.VideoJob(user_id=uid, prompt=f"p{i}", status=models.JobStatus.completed)
+                    for i in range(7)])
+        await db.commit()
+    seen, cursor = [], None
+    for _ in range(10):
+        r = await client.get("/videos", params={"limit": 3, **({"after": cursor} if cursor else {})}, headers=auth)
+        assert r.status_code == 200
+        seen += [item["id"] for item in r.json()["items"]]
+        cursor = r.json()["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == 7
+    assert len(set(seen)) == 7
+
+async def test_transactions_cursor_in_header(client, auth):
+    uid = await _user_id()
+    async with SessionLocal() as db:
+        db.add_all([models.CreditTransaction(user_id=uid, type=models.TxType.spend, amount=-1, ref=str(uuid.uuid4()))
+                    for _ in range(4)])
+        await db.commit()
+    seen, cursor = [], None
+    for _ in range(10):
+        r = await client.get("/credits/transactions",
+                             params={"limit": 2, **({"after": cursor} if cursor else {})}, headers=auth)
+        assert r.status_code == 200
+        seen += [t["id"] for t in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(seen) == 5   # 4 траты + приветственные кредиты
+    assert len(set(seen)) == 5
+
+async def test_invalid_cursor(client, auth):
+    r = await client.get("/videos", params={"after": "not-a-cursor"}, headers=auth)
+    assert r.status_code == 400
+
+async def test_cursor_header_exposed_to_browsers(client, auth):
+    r = await client.get("/credits/transactions", headers={**auth, "Origin": "http://localhost:3000"})
+    assert "x-next-cursor" in r.headers["access-control-expose-headers"].lower()
@@ -0,0 +1,79 @@
+# tests/test_s3_storage.py
+"""S3Storage против moto: put_object, multipart через пул потоков, кэш подписанных ссылок."""
+import pytest
+
+pytest.importorskip("moto")
+from moto import mock_aws
+
+from app.config import settings
+from app.storage import S3Storage
+
+pytestmark = pytest.mark.anyio
+
+MiB = 1024 * 1024
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in dict(S3_BUCKET="videos", S3_REGION="us-east-1", S3_ENDPOINT_URL=None,
+                            S3_ACCESS_KEY="test", S3_SECRET_KEY="test", S3_MULTIPART_PART_SIZE=5 * MiB,
+                            S3_MULTIPART_CONCURRENCY=2, S3_MAX_WORKERS=4).items():
+        monkeypatch.setattr(settings, name, value)
+    with mock_aws():
+        storage = S3Storage()
+        storage.s3.create_bucket(Bucket="videos")
+        yield storage
+        storage._executor.shutdown(wait=True)
+
+async def _chunks(data: bytes, size: int = MiB):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+def _body(storage: S3Storage, key: str) -> bytes:
+    return storage.s3.get_object(Bucket="videos", Key=key)["Body"].read()
+
+async def test_small_file_is_put_object(s3):
+    data = b"x" * 1000
+    saved = await s3.save_stream("job1", _chunks(data))
+    assert saved.path == "videos/job1.mp4" and saved.size == len(data)
+    assert _body(s3, saved.path) == data
+
+async def test_multipart_upload(s3):
+    data = bytes(range(256)) * (12 * MiB // 256 + 7)   # три части, последняя неполная
+    saved = await s3.save_stream("job2", _chunks(data))
+    assert saved.size == len(data)
+    assert _body(s3, saved.path) == data
+    assert s3.s3.head_object(Bucket="videos", Key=saved.path)["ETag"].strip('"').endswith("-3")
+
+async def test_failed_stream_aborts_multipart(s3):
+    async def broken():
+        yield b"x" * (6 * MiB)
+        raise RuntimeError("upstream dropped")
+
+    with pytest.raises(RuntimeError):
+        await s3.save_stream("job3", broken())
+    assert not s3.s3.list_multipart_uploads(Bucket="videos").get("Uploads")
+
+async def test_presigned_url_cache(s3, monkeypatch):
+    calls = []
+    sign = s3.s3.generate_presigned_url
+
+    def counting(**kwargs):
+        calls.append(kwargs["Params"]["Key"])
+        return sign(**kwargs)
+
+    monkeypatch.setattr(s3.s3, "generate_presigned_url", counting)
+    first = await s3.presigned_url("videos/a.mp4")
+    assert await s3.presigned_url("videos/a.mp4") == first
+    assert calls == ["videos/a.mp4"]
+    await s3.presigned_url("videos/b.mp4")
+    assert calls == ["videos/a.mp4", "videos/b.mp4"]
+
+async def test_presigned_url_refreshed_before_expiry(s3, monkeypatch):
+    # запас на переподпись не меньше срока подписи — запись в кэше сразу считается протухшей
+    monkeypatch.setattr(settings, "S3_PRESIGN_REFRESH_MARGIN", settings.S3_PRESIGN_EXPIRES)
+    calls = []
+    sign = s3.s3.generate_presigned_url
+    monkeypatch.setattr(s3.s3, "generate_presigned_url", lambda **kw: calls.append(1) or sign(**kw))
+    await s3.presigned_url("videos/a.mp4")
+    await s3.presigned_url("videos/a.mp4")
+    assert len(calls) == 2